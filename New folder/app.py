@@ -1,12 +1,16 @@
+import io
 import os
 import sys
+import mmap
 import time
+import uuid
 import queue
+import tempfile
 import logging
 import subprocess
 import threading
 from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, Request, render_template, request, jsonify, Response
 from werkzeug.utils import secure_filename
 import pytesseract
 from PIL import Image, ImageEnhance, ImageFilter
@@ -14,6 +18,9 @@ import re
 import cv2
 import numpy as np
 
+from result_backend import backend_from_url
+from webhooks import WEBHOOK_SECRET, WebhookDispatcher, valid_callback_url
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -136,14 +143,85 @@ if not tesseract_found:
     # This allows the health check to pass
     pytesseract.pytesseract.tesseract_cmd = 'tesseract'  # Fallback
 
+# Uploads up to this size are spooled in memory; larger ones go to an
+# anonymous memfd (or unlinked temp file) that the worker maps read-only
+INGEST_MEMORY_LIMIT = 2 * 1024 * 1024
+
+def spool_upload(total_content_length):
+    """Pick where an incoming upload is buffered while the body is parsed"""
+    if total_content_length is not None and total_content_length <= INGEST_MEMORY_LIMIT:
+        return io.BytesIO()
+    if hasattr(os, 'memfd_create'):
+        return os.fdopen(os.memfd_create('upload', os.MFD_CLOEXEC), 'w+b')
+    return tempfile.TemporaryFile('w+b')
+
+def upload_view(stream):
+    """Zero-copy memoryview of a spooled upload (a buffer export or an mmap)"""
+    if isinstance(stream, io.BytesIO):
+        return stream.getbuffer()
+    stream.flush()
+    if os.fstat(stream.fileno()).st_size == 0:
+        return memoryview(b'')
+    # The mapping outlives the file object Werkzeug closes after the request
+    return memoryview(mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview, so PIL decodes without a copy"""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+class SpoolingRequest(Request):
+    """Request that buffers file uploads with spool_upload"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spool_upload(total_content_length)
+
 app = Flask(__name__)
+app.request_class = SpoolingRequest
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max file size
 
 # Task queue and worker pool
 task_queue = queue.Queue()
-result_store = {}
-result_lock = threading.Lock()
+
+# Job status and results, shared by every worker that points at the same
+# backend so a verify_status poll can land on any of them. memory:// only
+# works with a single worker; use redis:// to spread workers across nodes.
+RESULT_BACKEND_URL = os.environ.get(
+    'RESULT_BACKEND_URL',
+    'sqlite:///' + os.path.join(tempfile.gettempdir(), 'tes_ocr_results.db')
+)
+result_backend = backend_from_url(RESULT_BACKEND_URL)
+
+# Completion callbacks are delivered from their own threads, never from the OCR workers
+webhooks = WebhookDispatcher(
+    on_finished=lambda task_id, outcome: result_backend.update(task_id, callback=outcome)
+)
 
 # Thread pool for processing tasks
 MAX_WORKERS = 5
@@ -156,25 +234,39 @@ def worker():
         if task is None:  # Shutdown signal
             break
         try:
+            try:
+                result_backend.update(task_id, status='processing')
+            except Exception as e:
+                logger.warning(f"Could not mark task {task_id} as processing: {str(e)}")
             result = process_verification(
-                task['file'],
+                BufferReader(task['file']),
                 task['last_name'],
                 task['birthday'],
                 task['student_id']
             )
-            with result_lock:
-                result_store[task_id] = {
-                    'status': 'completed',
-                    'result': result,
-                    'timestamp': time.time()
-                }
+            record = {
+                'status': 'completed',
+                'result': result,
+                'timestamp': time.time()
+            }
         except Exception as e:
-            with result_lock:
-                result_store[task_id] = {
-                    'status': 'error',
-                    'error': str(e),
-                    'timestamp': time.time()
-                }
+            record = {
+                'status': 'error',
+                'error': str(e),
+                'timestamp': time.time()
+            }
+        finally:
+            # Drop the buffer export / mapping as soon as the image is decoded
+            task['file'].release()
+        if task.get('callback_url'):
+            record['callback'] = 'pending'
+        # A backend outage must not kill the worker or leave the task unacknowledged
+        try:
+            result_backend.put(task_id, record)
+        except Exception as e:
+            logger.error(f"Could not store result for task {task_id}: {str(e)}")
+        if task.get('callback_url'):
+            webhooks.enqueue(task_id, task['callback_url'], dict(record, task_id=task_id))
         task_queue.task_done()
 
 # Start worker threads
@@ -299,6 +391,7 @@ def verify_student():
     last_name = request.form.get('last_name', '').strip()
     birthday = request.form.get('birthday', '').strip()
     student_id = request.form.get('student_id', '').strip()
+    callback_url = request.form.get('callback_url', '').strip()
     
     if not all([last_name, birthday, student_id]):
         return jsonify({
@@ -306,28 +399,27 @@ def verify_student():
             'error': 'Last name, birthday, and student ID are required'
         }), 400
 
+    if callback_url:
+        if not WEBHOOK_SECRET:
+            return jsonify({'success': False, 'error': 'Callbacks are not enabled on this server'}), 400
+        if not valid_callback_url(callback_url):
+            return jsonify({'success': False, 'error': 'callback_url must be an http(s) URL'}), 400
+
     if file.filename == '':
         return jsonify({'success': False, 'error': 'No selected file'}), 400
         
-    # Create a unique task ID
-    task_id = str(int(time.time() * 1000)) + '_' + str(hash(file.filename))
-    
-    # Save file to process
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-    
-    # Add task to queue
-    with open(filepath, 'rb') as f:
-        task_queue.put((task_id, {
-            'file': f.read(),
-            'last_name': last_name,
-            'birthday': birthday,
-            'student_id': student_id
-        }))
+    # Create a unique task ID; it must not collide across workers and nodes
+    task_id = uuid.uuid4().hex
+    result_backend.put(task_id, {'status': 'queued', 'timestamp': time.time()})
     
-    # Clean up the file
-    os.remove(filepath)
+    # Hand the spooled upload to the worker as a view; no disk round trip or copy
+    task_queue.put((task_id, {
+        'file': upload_view(file.stream),
+        'last_name': last_name,
+        'birthday': birthday,
+        'student_id': student_id,
+        'callback_url': callback_url
+    }))
     
     # Return immediately with task ID
     return jsonify({
@@ -340,8 +432,7 @@ def verify_student():
 @app.route('/api/verify_status/<task_id>', methods=['GET'])
 def verify_status(task_id):
     """Check the status of a verification task"""
-    with result_lock:
-        result = result_store.get(task_id)
+    result = result_backend.get(task_id)
     
     if not result:
         return jsonify({
@@ -363,6 +454,13 @@ def verify_status(task_id):
             'error': result['error']
         })
     
+    elif result['status'] == 'queued':
+        return jsonify({
+            'success': True,
+            'status': 'queued',
+            'message': 'Task is waiting to be processed'
+        })
+    
     return jsonify({
         'success': True,
         'status': 'processing',
@@ -679,15 +777,11 @@ def cleanup_old_results():
     """Clean up old results from the result store"""
     while True:
         time.sleep(3600)  # Clean up every hour
-        current_time = time.time()
-        with result_lock:
+        try:
             # Remove results older than 24 hours
-            to_remove = [
-                task_id for task_id, result in result_store.items()
-                if current_time - result.get('timestamp', 0) > 86400
-            ]
-            for task_id in to_remove:
-                result_store.pop(task_id, None)
+            result_backend.cleanup(86400)
+        except Exception as e:
+            logger.warning(f"Result cleanup failed: {str(e)}")
 
 # Start cleanup thread
 cleanup_thread = threading.Thread(target=cleanup_old_results, daemon=True)
@@ -0,0 +1,193 @@
+"""
+Where verification jobs and their results live.
+
+A per-process dict only works with a single gunicorn worker: a status poll
+that lands on another worker (or node) finds nothing. Every backend here
+stores the same JSON record per task id, so any worker that shares the
+backend can answer /api/verify_status:
+
+    memory://                  this process only (single worker, development)
+    sqlite:///path/to/jobs.db  every worker on one host
+    redis://host:6379/0        every worker on every node
+
+Records look like {'status': 'queued'|'processing'|'completed'|'error',
+'result': ..., 'error': ..., 'timestamp': ...}.
+"""
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+# Records older than this are dropped by cleanup (Redis expires them itself)
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+class ResultBackend:
+    """Interface shared by all backends"""
+
+    def put(self, task_id, record):
+        """Create or replace the record for task_id"""
+        raise NotImplementedError
+
+    def get(self, task_id):
+        """The record for task_id, or None"""
+        raise NotImplementedError
+
+    def update(self, task_id, **fields):
+        """Merge fields into the record (creating it if needed) and refresh its timestamp"""
+        record = self.get(task_id) or {}
+        record.update(fields)
+        record['timestamp'] = time.time()
+        self.put(task_id, record)
+
+    def cleanup(self, max_age=DEFAULT_MAX_AGE):
+        """Drop records older than max_age seconds; returns how many went"""
+        return 0
+
+
+class MemoryBackend(ResultBackend):
+    """The original per-process dict"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def put(self, task_id, record):
+        with self._lock:
+            self._records[task_id] = dict(record)
+
+    def get(self, task_id):
+        with self._lock:
+            record = self._records.get(task_id)
+            return dict(record) if record is not None else None
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            record = self._records.setdefault(task_id, {})
+            record.update(fields)
+            record['timestamp'] = time.time()
+
+    def cleanup(self, max_age=DEFAULT_MAX_AGE):
+        cutoff = time.time() - max_age
+        with self._lock:
+            expired = [task_id for task_id, record in self._records.items()
+                       if record.get('timestamp', 0) < cutoff]
+            for task_id in expired:
+                del self._records[task_id]
+        return len(expired)
+
+
+class SQLiteBackend(ResultBackend):
+    """One SQLite file shared by every worker process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'task_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS results_updated ON results (updated)')
+
+    def _connect(self):
+        # sqlite3 connections may not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return conn
+
+    def put(self, task_id, record):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results (task_id, record, updated) VALUES (?, ?, ?)',
+                (task_id, json.dumps(record), record.get('timestamp', time.time()))
+            )
+
+    def get(self, task_id):
+        row = self._connect().execute(
+            'SELECT record FROM results WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id, **fields):
+        conn = self._connect()
+        with conn:
+            # Read-modify-write in one write transaction so updates don't race
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT record FROM results WHERE task_id = ?', (task_id,)).fetchone()
+            record = json.loads(row[0]) if row else {}
+            record.update(fields)
+            record['timestamp'] = time.time()
+            conn.execute(
+                'INSERT OR REPLACE INTO results (task_id, record, updated) VALUES (?, ?, ?)',
+                (task_id, json.dumps(record), record['timestamp'])
+            )
+
+    def cleanup(self, max_age=DEFAULT_MAX_AGE):
+        with self._connect() as conn:
+            cursor = conn.execute('DELETE FROM results WHERE updated < ?', (time.time() - max_age,))
+            return cursor.rowcount
+
+
+class RedisBackend(ResultBackend):
+    """
+    Records as JSON strings under a key prefix, expiring after max_age.
+    Works with anything speaking the redis-py client API (redis.Redis,
+    fakeredis.FakeRedis).
+    """
+
+    def __init__(self, client, prefix='tes_ocr:result:', max_age=DEFAULT_MAX_AGE):
+        self.client = client
+        self.prefix = prefix
+        self.max_age = max_age
+
+    def put(self, task_id, record):
+        self.client.set(self.prefix + task_id, json.dumps(record), ex=int(self.max_age))
+
+    def get(self, task_id):
+        value = self.client.get(self.prefix + task_id)
+        return json.loads(value) if value is not None else None
+
+    def update(self, task_id, **fields):
+        key = self.prefix + task_id
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic transaction: retried if another worker writes the key first
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    record = json.loads(value) if value is not None else {}
+                    record.update(fields)
+                    record['timestamp'] = time.time()
+                    pipe.multi()
+                    pipe.set(key, json.dumps(record), ex=int(self.max_age))
+                    pipe.execute()
+                    return
+                except self._watch_error:
+                    continue
+
+    @property
+    def _watch_error(self):
+        import redis
+        return redis.WatchError
+
+
+def backend_from_url(url):
+    """Build a backend from a URL such as memory://, sqlite:///jobs.db or redis://host:6379/0"""
+    scheme = urlparse(url).scheme
+    if scheme in ('', 'memory'):
+        return MemoryBackend()
+    if scheme == 'sqlite':
+        path = url[len('sqlite://'):]
+        # sqlite:///relative.db -> relative.db, sqlite:////abs/path.db -> /abs/path.db
+        return SQLiteBackend(path[1:] if path.startswith('/') else path)
+    if scheme in ('redis', 'rediss', 'unix'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required for a redis:// RESULT_BACKEND_URL')
+        return RedisBackend(redis.Redis.from_url(url))
+    raise ValueError(f"Unsupported result backend URL: {url}")
@@ -0,0 +1,132 @@
+"""
+Contract tests for result_backend: every backend must behave the same.
+
+Run with: python -m pytest test_result_backend.py
+"""
+import time
+import threading
+
+import pytest
+
+from result_backend import MemoryBackend, SQLiteBackend, RedisBackend, backend_from_url
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'results.db'))
+    return RedisBackend(fakeredis.FakeRedis())
+
+
+def test_get_missing_is_none(backend):
+    assert backend.get('nope') is None
+
+
+def test_put_then_get_round_trips(backend):
+    record = {'status': 'completed', 'result': {'verified': True, 'fields': ['a', 'b']}, 'timestamp': time.time()}
+    backend.put('t1', record)
+    assert backend.get('t1') == record
+
+
+def test_put_replaces(backend):
+    backend.put('t1', {'status': 'queued', 'timestamp': time.time()})
+    backend.put('t1', {'status': 'error', 'error': 'boom', 'timestamp': time.time()})
+    assert backend.get('t1')['status'] == 'error'
+    assert 'result' not in backend.get('t1')
+
+
+def test_update_merges_and_refreshes_timestamp(backend):
+    backend.put('t1', {'status': 'queued', 'timestamp': 1.0})
+    backend.update('t1', status='processing')
+    record = backend.get('t1')
+    assert record['status'] == 'processing'
+    assert record['timestamp'] > 1.0
+
+
+def test_update_creates_missing_record(backend):
+    backend.update('t1', callback='delivered')
+    assert backend.get('t1')['callback'] == 'delivered'
+
+
+def test_concurrent_updates_are_not_lost(backend):
+    backend.put('t1', {'status': 'queued', 'timestamp': time.time()})
+    start = threading.Barrier(8)
+
+    def bump(n):
+        start.wait()
+        for i in range(10):
+            backend.update('t1', **{f"f{n}_{i}": i})
+
+    threads = [threading.Thread(target=bump, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    record = backend.get('t1')
+    assert all(f"f{n}_{i}" in record for n in range(8) for i in range(10))
+    assert record['status'] == 'queued'
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_cleanup_drops_only_expired(kind, tmp_path):
+    backend = MemoryBackend() if kind == 'memory' else SQLiteBackend(str(tmp_path / 'results.db'))
+    backend.put('old', {'status': 'completed', 'timestamp': time.time() - 120})
+    backend.put('new', {'status': 'completed', 'timestamp': time.time()})
+    assert backend.cleanup(60) == 1
+    assert backend.get('old') is None
+    assert backend.get('new') is not None
+
+
+def test_redis_records_expire():
+    client = fakeredis.FakeRedis()
+    backend = RedisBackend(client, max_age=1)
+    backend.put('t1', {'status': 'queued', 'timestamp': time.time()})
+    backend.update('t2', status='processing')
+    assert 0 < client.ttl(backend.prefix + 't1') <= 1
+    assert 0 < client.ttl(backend.prefix + 't2') <= 1
+    time.sleep(1.2)
+    assert backend.get('t1') is None
+    assert backend.get('t2') is None
+
+
+def test_redis_update_retries_after_a_conflicting_write():
+    import redis
+
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server)
+    other = fakeredis.FakeRedis(server=server)
+    backend = RedisBackend(client)
+    backend.put('t1', {'status': 'queued', 'timestamp': time.time()})
+    key = backend.prefix + 't1'
+    execute = redis.client.Pipeline.execute
+    attempts = []
+
+    def interleaved_execute(pipe, *args, **kwargs):
+        # Another worker writes the watched key between our read and our write, once
+        attempts.append(1)
+        if len(attempts) == 1:
+            other.set(key, '{"status": "queued", "callback": "delivered", "timestamp": 0}')
+        return execute(pipe, *args, **kwargs)
+
+    redis.client.Pipeline.execute = interleaved_execute
+    try:
+        backend.update('t1', status='processing')
+    finally:
+        redis.client.Pipeline.execute = execute
+    assert len(attempts) == 2
+    record = backend.get('t1')
+    assert record['status'] == 'processing'
+    assert record['callback'] == 'delivered'
+
+
+def test_backend_from_url(tmp_path):
+    assert isinstance(backend_from_url('memory://'), MemoryBackend)
+    backend = backend_from_url(f"sqlite:///{tmp_path / 'results.db'}")
+    assert isinstance(backend, SQLiteBackend)
+    assert backend.path == str(tmp_path / 'results.db')
+    with pytest.raises(ValueError):
+        backend_from_url('postgres://localhost/db')
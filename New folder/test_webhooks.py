@@ -0,0 +1,131 @@
+"""
+Delivery tests for webhooks against a real HTTP receiver on 127.0.0.1.
+
+Run with: python -m pytest test_webhooks.py
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import webhooks
+from webhooks import WebhookDispatcher, verify_signature
+
+SECRET = 'test-secret'
+
+
+class Receiver:
+    """Answers each POST with the next scripted status (the last one repeats)"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.requests.append((dict(self.headers), body))
+                index = min(len(receiver.requests), len(receiver.statuses)) - 1
+                self.send_response(receiver.statuses[index])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def receive(monkeypatch):
+    # Retries after milliseconds rather than seconds
+    monkeypatch.setattr(webhooks, 'BACKOFF_BASE', 0.01)
+    receivers = []
+
+    def start(*statuses):
+        receiver = Receiver(statuses)
+        receivers.append(receiver)
+        return receiver
+
+    yield start
+    for receiver in receivers:
+        receiver.close()
+
+
+def dispatcher(tmp_path, max_attempts=3):
+    """A dispatcher plus the outcomes it reports, and an event set on the first one"""
+    outcomes = []
+    finished = threading.Event()
+
+    def on_finished(task_id, outcome):
+        outcomes.append((task_id, outcome))
+        finished.set()
+
+    hooks = WebhookDispatcher(secret=SECRET, workers=1, max_attempts=max_attempts, timeout=5,
+                              dead_letter_db=str(tmp_path / 'webhooks.db'), on_finished=on_finished)
+    return hooks, outcomes, finished
+
+
+def test_delivery_is_signed(receive, tmp_path):
+    receiver = receive(200)
+    hooks, outcomes, finished = dispatcher(tmp_path)
+    delivery_id = hooks.enqueue('t1', receiver.url, {'task_id': 't1', 'status': 'completed'})
+    assert finished.wait(5)
+    assert outcomes == [('t1', 'delivered')]
+
+    headers, body = receiver.requests[0]
+    assert json.loads(body) == {'task_id': 't1', 'status': 'completed'}
+    assert headers['X-Webhook-Delivery'] == delivery_id
+    assert verify_signature(SECRET, headers['X-Webhook-Timestamp'], body, headers['X-Webhook-Signature'])
+    assert not verify_signature('other-secret', headers['X-Webhook-Timestamp'], body,
+                                headers['X-Webhook-Signature'])
+    assert not verify_signature(SECRET, headers['X-Webhook-Timestamp'], body + b' ',
+                                headers['X-Webhook-Signature'])
+
+
+def test_retries_after_server_error(receive, tmp_path):
+    receiver = receive(503, 500, 200)
+    hooks, outcomes, finished = dispatcher(tmp_path)
+    hooks.enqueue('t1', receiver.url, {'task_id': 't1'})
+    assert finished.wait(5)
+    assert outcomes == [('t1', 'delivered')]
+    assert len(receiver.requests) == 3
+    # Retries keep the delivery id and are signed afresh
+    assert len({headers['X-Webhook-Delivery'] for headers, _ in receiver.requests}) == 1
+    for headers, body in receiver.requests:
+        assert verify_signature(SECRET, headers['X-Webhook-Timestamp'], body, headers['X-Webhook-Signature'])
+    assert hooks.dead_letters.list() == []
+
+
+def test_dead_letter_after_max_attempts(receive, tmp_path):
+    receiver = receive(502)
+    hooks, outcomes, finished = dispatcher(tmp_path, max_attempts=3)
+    delivery_id = hooks.enqueue('t1', receiver.url, {'task_id': 't1'})
+    assert finished.wait(5)
+    assert outcomes == [('t1', 'dead_letter')]
+    assert len(receiver.requests) == 3
+
+    [dead] = hooks.dead_letters.list()
+    assert dead['delivery_id'] == delivery_id
+    assert dead['task_id'] == 't1'
+    assert dead['url'] == receiver.url
+    assert dead['attempts'] == 3
+    assert dead['last_error'] == 'HTTP 502'
+
+
+def test_client_error_is_not_retried(receive, tmp_path):
+    receiver = receive(404)
+    hooks, outcomes, finished = dispatcher(tmp_path)
+    hooks.enqueue('t1', receiver.url, {'task_id': 't1'})
+    assert finished.wait(5)
+    assert outcomes == [('t1', 'dead_letter')]
+    assert len(receiver.requests) == 1
+    assert hooks.dead_letters.list()[0]['attempts'] == 1
@@ -0,0 +1,222 @@
+"""
+Completion webhooks for verification tasks.
+
+When a task submitted with a callback_url finishes, its result is POSTed to
+that URL as JSON, signed with HMAC-SHA256 over "<timestamp>.<body>" using
+WEBHOOK_SECRET:
+
+    X-Webhook-Timestamp: 1700000000
+    X-Webhook-Signature: sha256=<hex digest>
+    X-Webhook-Delivery:  <unique id, stable across retries>
+
+Deliveries run on their own small thread pool; OCR workers only enqueue.
+Failed attempts are retried with exponential backoff, and deliveries that
+run out of attempts (or get a non-retryable 4xx) go to a dead-letter table.
+"""
+import os
+import hmac
+import json
+import time
+import uuid
+import heapq
+import queue
+import random
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 2))
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 6))
+WEBHOOK_DEAD_LETTER_DB = os.environ.get(
+    'WEBHOOK_DEAD_LETTER_DB', os.path.join(tempfile.gettempdir(), 'tes_ocr_webhooks.db'))
+
+# Retry n waits BACKOFF_BASE * 2**(n-1) seconds (plus jitter), capped
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+# Client errors worth retrying; any other 4xx will not succeed on a retry
+RETRYABLE_STATUS = {408, 425, 429}
+
+
+def valid_callback_url(url):
+    parsed = urlparse(url)
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
+
+
+def sign(secret, timestamp, body):
+    """Signature header value for body sent at timestamp"""
+    message = f"{timestamp}.".encode('utf-8') + body
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, timestamp, body, signature):
+    """For receivers: check a delivery's X-Webhook-Signature"""
+    return hmac.compare_digest(sign(secret, timestamp, body), signature)
+
+
+def backoff(attempt):
+    """Seconds to wait before retry number attempt (1-based)"""
+    delay = min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class DeadLetters:
+    """Deliveries that could not be made, kept in SQLite for inspection and replay"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS dead_letters ('
+                'delivery_id TEXT PRIMARY KEY, task_id TEXT, url TEXT, payload TEXT, '
+                'attempts INTEGER, last_error TEXT, failed_at REAL)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, delivery, error):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO dead_letters VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (delivery['id'], delivery['task_id'], delivery['url'], delivery['body'].decode('utf-8'),
+                 delivery['attempts'], error, time.time())
+            )
+
+    def list(self, limit=100):
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT delivery_id, task_id, url, attempts, last_error, failed_at '
+                'FROM dead_letters ORDER BY failed_at DESC LIMIT ?', (limit,)
+            ).fetchall()
+        keys = ('delivery_id', 'task_id', 'url', 'attempts', 'last_error', 'failed_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class WebhookDispatcher:
+    """
+    Delivery threads plus a scheduler for retries. enqueue never blocks and
+    never raises, so it is safe to call from an OCR worker.
+    """
+
+    def __init__(self, secret=WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 timeout=WEBHOOK_TIMEOUT, dead_letter_db=WEBHOOK_DEAD_LETTER_DB, on_finished=None):
+        self.secret = secret
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.dead_letters = DeadLetters(dead_letter_db)
+        # Called as on_finished(task_id, outcome) with 'delivered' or 'dead_letter'
+        self.on_finished = on_finished
+        self._ready = queue.Queue()
+        self._retries = []  # heap of (due, seq, delivery)
+        self._retry_cond = threading.Condition()
+        self._seq = 0
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            for _ in range(self.workers):
+                threading.Thread(target=self._deliver_loop, daemon=True).start()
+            threading.Thread(target=self._retry_loop, daemon=True).start()
+            self._started = True
+
+    def enqueue(self, task_id, url, payload):
+        """Schedule delivery of payload to url; returns the delivery id"""
+        delivery = {
+            'id': uuid.uuid4().hex,
+            'task_id': task_id,
+            'url': url,
+            'body': json.dumps(payload).encode('utf-8'),
+            'attempts': 0,
+        }
+        try:
+            self._ensure_started()
+            self._ready.put_nowait(delivery)
+        except Exception as e:
+            logger.error(f"Could not schedule webhook for task {task_id}: {str(e)}")
+        return delivery['id']
+
+    def _deliver_loop(self):
+        while True:
+            delivery = self._ready.get()
+            try:
+                self._attempt(delivery)
+            except Exception as e:
+                logger.error(f"Webhook delivery {delivery['id']} crashed: {str(e)}")
+
+    def _retry_loop(self):
+        while True:
+            with self._retry_cond:
+                while not self._retries or self._retries[0][0] > time.time():
+                    timeout = self._retries[0][0] - time.time() if self._retries else None
+                    self._retry_cond.wait(timeout)
+                _, _, delivery = heapq.heappop(self._retries)
+            self._ready.put(delivery)
+
+    def _post(self, delivery):
+        """One attempt; returns (delivered, retryable, error)"""
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'tes-ocr-webhook/1.0',
+            'X-Webhook-Delivery': delivery['id'],
+            'X-Webhook-Timestamp': timestamp,
+        }
+        if self.secret:
+            headers['X-Webhook-Signature'] = sign(self.secret, timestamp, delivery['body'])
+        req = urllib.request.Request(delivery['url'], data=delivery['body'], headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                response.read()
+            return True, False, None
+        except urllib.error.HTTPError as e:
+            retryable = e.code >= 500 or e.code in RETRYABLE_STATUS
+            return False, retryable, f'HTTP {e.code}'
+        except (urllib.error.URLError, OSError) as e:
+            return False, True, str(getattr(e, 'reason', e))
+
+    def _attempt(self, delivery):
+        delivery['attempts'] += 1
+        delivered, retryable, error = self._post(delivery)
+        if delivered:
+            logger.info(f"Webhook for task {delivery['task_id']} delivered after {delivery['attempts']} attempt(s)")
+            self._finish(delivery, 'delivered')
+            return
+
+        if retryable and delivery['attempts'] < self.max_attempts:
+            delay = backoff(delivery['attempts'])
+            logger.warning(f"Webhook for task {delivery['task_id']} failed ({error}); retrying in {delay:.1f}s")
+            with self._retry_cond:
+                self._seq += 1
+                heapq.heappush(self._retries, (time.time() + delay, self._seq, delivery))
+                self._retry_cond.notify()
+            return
+
+        logger.error(f"Webhook for task {delivery['task_id']} dead-lettered after "
+                     f"{delivery['attempts']} attempt(s): {error}")
+        self.dead_letters.add(delivery, error)
+        self._finish(delivery, 'dead_letter')
+
+    def _finish(self, delivery, outcome):
+        if self.on_finished is None:
+            return
+        try:
+            self.on_finished(delivery['task_id'], outcome)
+        except Exception as e:
+            logger.warning(f"Could not record webhook outcome for task {delivery['task_id']}: {str(e)}")
@@ -1,13 +1,43 @@
 import os
 import shutil
-from flask import Flask, render_template, request, jsonify
+import time
+import hashlib
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+# Each Tesseract process should use one core; request threads and the tile
+# pool provide the parallelism, and OpenMP threads on top only oversubscribe
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+from flask import Flask, render_template, request, jsonify, send_from_directory, url_for, Response
 from werkzeug.utils import secure_filename
 import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
 from io import BytesIO
 import re
-import cv2
 import numpy as np
+from layouts import LayoutRegistry, MIN_INLIERS, read_fields
+from matching import find_id_match
+from memory_budget import ImageTooLarge, MemoryBudget, MemoryBudgetExhausted, default_budget_bytes
+from deadline import Deadline, DeadlineExceeded, client_disconnect_probe
+from metrics import metrics
+import ocr_engine
+from ocr_engine import OcrResult, recognize, PRIMARY_PASS, REFINE_PASSES, FALLBACK_PASSES, LOW_CONFIDENCE
+from ocr_profiles import ID_PATTERNS, id_profile, name_profile
+from ocr_workers import OcrWorkerPool
+from profiling import RequestProfiler
+from quality_gate import DEFAULT_THRESHOLDS, REASONS as GATE_REASONS, QualityGate
+from preprocessing import iter_frames, binarize, resolve_chain, stage_cache, BASE_WIDTH, STAGE_CACHE_BYTES
+from singleflight import SingleFlight
+from upload_store import UploadStore
+from previews import PreviewRenderer, PREVIEW_WIDTHS
+from chunked_uploads import ChunkError, ChunkedUploads, JobRecords, DEFAULT_CHUNK_SIZE
+from warmup import Warmup
+from create_test_image import render_test_document
 
 # Set Tesseract command path - works in Docker, Heroku, and local development
 def find_tesseract():
@@ -261,12 +291,139 @@ def init_tesseract():
 # Don't verify immediately - will be called after app starts
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max file size
+# Edits (beyond OCR look-alikes) tolerated when matching ID numbers
+app.config['ID_MATCH_MAX_DISTANCE'] = int(os.environ.get('ID_MATCH_MAX_DISTANCE', 1))
+# Tesseract user-patterns (\d digit, \c letter) for the ID formats we issue,
+# used by the ID profile; separate several with commas
+app.config['ID_PATTERNS'] = [
+    pattern for pattern in os.environ.get('ID_PATTERNS', ','.join(ID_PATTERNS)).split(',') if pattern
+]
+# Seconds of preprocessing and OCR one request may spend before the best
+# partial result is returned
+app.config['OCR_BUDGET_SECONDS'] = float(os.environ.get('OCR_BUDGET_SECONDS', 60))
+# Worker processes that run Tesseract on pages handed over in shared memory;
+# 0 keeps OCR in the request thread
+app.config['OCR_PROCESSES'] = int(os.environ.get('OCR_PROCESSES', 0))
+# Tesseract processes that read the strips of tall pages, shared by every
+# request in this process; by default the host's cores split between the
+# server's WEB_CONCURRENCY worker processes
+app.config['OCR_TILE_WORKERS'] = int(os.environ.get(
+    'OCR_TILE_WORKERS', max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1)))))
+# Preprocessing chain per endpoint (a name from preprocessing.CHAINS or a
+# comma-separated list of stages); requests may pick another with 'preprocess'
+app.config['PREPROCESS_CHAINS'] = {
+    'upload': os.environ.get('PREPROCESS_CHAIN_UPLOAD', 'default'),
+    'verify_student': os.environ.get('PREPROCESS_CHAIN_VERIFY', 'default'),
+}
+
+# Retention limits for stored uploads
+app.config['UPLOAD_MAX_AGE'] = int(os.environ.get('UPLOAD_MAX_AGE', 7 * 24 * 3600))  # seconds
+app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('UPLOAD_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Uploads over this many pixels are rejected from their header, before decode
+app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', 60 * 1000 * 1000))
+# Bytes of preprocessing stage outputs each process keeps for reuse by later
+# requests on the same image; 0 turns the cache off
+app.config['STAGE_CACHE_BYTES'] = int(os.environ.get('STAGE_CACHE_BYTES', STAGE_CACHE_BYTES))
+# Bytes of estimated OCR working memory this process admits at once; jobs
+# wait up to MEMORY_ADMIT_WAIT seconds for room before getting a 503. The
+# default leaves room for the stage cache
+app.config['MEMORY_BUDGET_BYTES'] = int(os.environ.get(
+    'MEMORY_BUDGET_BYTES', default_budget_bytes(int(os.environ.get('WEB_CONCURRENCY', 1)),
+                                                reserved=app.config['STAGE_CACHE_BYTES'])))
+app.config['MEMORY_ADMIT_WAIT'] = float(os.environ.get('MEMORY_ADMIT_WAIT', 10))
+
+# Opt-in request profiling: requests carrying PROFILE_TOKEN in X-Profile-Token,
+# plus a random PROFILE_SAMPLE_RATE fraction, are profiled ('pstats' for
+# cProfile, 'collapsed' for sampled flamegraph stacks). Off when both are unset.
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN', '')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_FORMAT'] = os.environ.get('PROFILE_FORMAT', 'pstats')
+# Kept outside static/, which is served to anyone
+app.config['PROFILE_DIR'] = os.environ.get(
+    'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'tes_ocr_request_profiles'))
+app.config['PROFILE_MAX_FILES'] = int(os.environ.get('PROFILE_MAX_FILES', 50))
+
+# Pages the quality gate finds hopeless (blank, dark, blurry, not a document)
+# are rejected before OCR. QUALITY_GATE=0 turns it off; each threshold can be
+# overridden as QUALITY_GATE_<NAME>, e.g. QUALITY_GATE_MIN_SHARPNESS=25
+app.config['QUALITY_GATE'] = os.environ.get('QUALITY_GATE', '1').lower() not in ('0', 'false', 'no')
+app.config['QUALITY_GATE_THRESHOLDS'] = {
+    name: type(default)(os.environ.get(f'QUALITY_GATE_{name.upper()}', default))
+    for name, default in DEFAULT_THRESHOLDS.items()
+}
+
+# Layout templates of known ID card designs (JSON plus reference image, see
+# layouts.py); pages matching one have only its field boxes OCRed. Unset,
+# no templates load and matching is off. LAYOUT_MATCHING=0 turns it off too
+app.config['LAYOUTS_DIR'] = os.environ.get('LAYOUTS_DIR', '')
+app.config['LAYOUT_MATCHING'] = os.environ.get('LAYOUT_MATCHING', '1').lower() not in ('0', 'false', 'no')
+app.config['LAYOUT_MIN_INLIERS'] = int(os.environ.get('LAYOUT_MIN_INLIERS', MIN_INLIERS))
+
+# Widths of the WebP previews rendered for each upload; responses point at the largest
+app.config['PREVIEW_WIDTHS'] = [
+    int(width) for width in os.environ.get('PREVIEW_WIDTHS', ','.join(map(str, PREVIEW_WIDTHS))).split(',') if width
+]
+
+# Resumable chunked uploads: unfinished sessions and the records of the OCR
+# jobs they start (shared by every worker on the host); finalized uploads are
+# OCRed on CHUNKED_UPLOAD_WORKERS background threads
+app.config['CHUNKED_UPLOAD_DIR'] = os.environ.get(
+    'CHUNKED_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'tes_ocr_chunked_uploads'))
+app.config['CHUNKED_UPLOAD_WORKERS'] = int(os.environ.get('CHUNKED_UPLOAD_WORKERS', 2))
+# Finalized uploads waiting for OCR or being OCRed; past this finalize answers
+# 503 and the chunks stay where they are until the client retries
+app.config['CHUNKED_UPLOAD_MAX_PENDING'] = int(os.environ.get('CHUNKED_UPLOAD_MAX_PENDING', 8))
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Uploads are stored by content hash; writes and cleanup run in the background
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    max_age=app.config['UPLOAD_MAX_AGE'],
+    max_bytes=app.config['UPLOAD_MAX_BYTES']
+)
+
+# Previews are rendered in the background and kept in the upload store
+previews = PreviewRenderer(upload_store, app.config['PREVIEW_WIDTHS'])
+
+chunked_uploads = ChunkedUploads(app.config['CHUNKED_UPLOAD_DIR'], app.config['MAX_CONTENT_LENGTH'])
+upload_jobs = JobRecords(os.path.join(app.config['CHUNKED_UPLOAD_DIR'], 'jobs'))
+upload_job_executor = ThreadPoolExecutor(max_workers=app.config['CHUNKED_UPLOAD_WORKERS'],
+                                         thread_name_prefix='upload-job')
+upload_job_slots = threading.BoundedSemaphore(app.config['CHUNKED_UPLOAD_MAX_PENDING'])
+
+layout_registry = LayoutRegistry(
+    app.config['LAYOUTS_DIR'],
+    min_inliers=app.config['LAYOUT_MIN_INLIERS'],
+    enabled=app.config['LAYOUT_MATCHING']
+)
+
+quality_gate = QualityGate(app.config['QUALITY_GATE_THRESHOLDS'], enabled=app.config['QUALITY_GATE'])
+
+stage_cache.max_bytes = app.config['STAGE_CACHE_BYTES']
+ocr_engine.TILE_WORKERS = app.config['OCR_TILE_WORKERS']
+
+# PIL's own bomb check (an error at twice its limit) backs up ours
+Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
+memory_budget = MemoryBudget(
+    app.config['MEMORY_BUDGET_BYTES'],
+    app.config['MAX_IMAGE_PIXELS'],
+    wait=app.config['MEMORY_ADMIT_WAIT']
+)
+
+request_profiler = RequestProfiler(
+    app.config['PROFILE_DIR'],
+    token=app.config['PROFILE_TOKEN'],
+    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+    fmt=app.config['PROFILE_FORMAT'],
+    max_files=app.config['PROFILE_MAX_FILES']
+)
+profiled = partial(request_profiler.wrap, get_headers=lambda: request.headers)
+
 # Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'tif', 'tiff'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -398,6 +555,7 @@ def clean_text_for_matching(text):
     return re.sub(r'[^a-z0-9]', '', text.lower())
 
 @app.route('/api/verify_student', methods=['POST'])
+@profiled('verify_student')
 def verify_student():
     if 'file' not in request.files:
         return jsonify({'success': False, 'error': 'No file part'}), 400
@@ -417,7 +575,8 @@ def verify_student():
         return jsonify({'success': False, 'error': 'No selected file'}), 400
 
     # Validate the image file before processing
-    is_valid, error_msg = is_valid_image_file(file)
+    data = file.read()
+    is_valid, error_msg = is_valid_image_file(BytesIO(data))
     if not is_valid:
         app.logger.error(f"Invalid image file: {error_msg}")
         return jsonify({
@@ -425,107 +584,136 @@ def verify_student():
             'error': f'Invalid image file: {error_msg}'
         }), 400
 
+    result, status = verify_student_job(data, last_name, student_id,
+                                        client_disconnect_probe(request.environ),
+                                        chain=request.values.get('preprocess'))
+    return jsonify(result), status
+
+def student_fields_verified(last_name, student_id, text):
+    """Whether the last name and the student ID each appear in text"""
+    # Clean and normalize all text for comparison
+    clean_extracted = clean_text_for_matching(text)
+    clean_last_name = clean_text_for_matching(last_name)
+    clean_student_id = clean_text_for_matching(student_id).replace(' ', '')
+    
+    # Special handling for birthday to handle different formats
+    # clean_birthday = clean_date_string(birthday)
+    # clean_extracted_date = clean_date_string(text)
+    
+    last_name_found = clean_last_name in clean_extracted
+    # birthday_found = clean_birthday and clean_birthday in clean_extracted_date
+    student_id_found = clean_student_id and clean_student_id in clean_extracted.replace(' ', '')
+    return last_name_found, student_id_found
+
+def student_verified(last_name, student_id, text):
+    return all(student_fields_verified(last_name, student_id, text))
+
+def verify_student_job(data, last_name, student_id, is_disconnected=None, chain=None):
+    """
+    OCR an uploaded ID and check it for the last name and student ID.
+    Returns (payload, status); shared by the Flask and ASGI front ends.
+    """
     try:
-        # Process the image and extract text
-        image = Image.open(file)
-        image = image.convert('L')
-        
-        # Resize for better OCR
-        base_width = 2000
-        w_percent = (base_width / float(image.size[0]))
-        h_size = int((float(image.size[1]) * float(w_percent)))
-        image = image.resize((base_width, h_size), Image.Resampling.LANCZOS)
-        
-        # Convert to binary image
-        img_array = np.array(image)
-        _, binary_image = cv2.threshold(img_array, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        image = Image.fromarray(binary_image)
-        
-        # Extract text with Tesseract using multiple configurations
-        configs = [
-            r'--oem 3 --psm 6',
-            r'--oem 3 --psm 4',
-            r'--oem 3 --psm 11'
-        ]
-        
-        all_text = []
-        tesseract_found = False
-        
-        for config in configs:
-            try:
-                current_text = pytesseract.image_to_string(image, config=config)
-                if current_text.strip():
-                    all_text.append(current_text.strip())
-                    tesseract_found = True
-            except pytesseract.TesseractNotFoundError:
-                app.logger.warning(f"Tesseract not found at {pytesseract.pytesseract.tesseract_cmd}, attempting re-detection...")
-                # Try to re-detect Tesseract at runtime
-                if verify_tesseract():
-                    app.logger.info(f"Tesseract re-detected, retrying OCR...")
-                    try:
-                        current_text = pytesseract.image_to_string(image, config=config)
-                        if current_text.strip():
-                            all_text.append(current_text.strip())
-                            tesseract_found = True
-                    except Exception as retry_error:
-                        app.logger.error(f"OCR still failed after re-detection: {str(retry_error)}")
-                else:
-                    app.logger.error(f"Tesseract re-detection failed. CMD: {pytesseract.pytesseract.tesseract_cmd}")
-                    # Only return error if this is the first config and we haven't found any text yet
-                    if not all_text and config == configs[0]:
-                        return jsonify({
-                            'success': False,
-                            'error': 'Tesseract OCR is not installed or not found in PATH. Please check the server configuration.',
-                            'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd,
-                            'path': os.environ.get('PATH', 'Not set')
-                        }), 500
-            except pytesseract.TesseractError as e:
-                app.logger.error(f"Tesseract error: {str(e)}")
-                # Continue with other configs if one fails
-                continue
+        chain = resolve_chain(chain or app.config['PREPROCESS_CHAINS']['verify_student'])
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    
+    try:
+        # Size the job from the image header; bombs are refused undecoded
+        try:
+            estimated = memory_budget.estimate(data)
+        except ImageTooLarge as e:
+            metrics.incr('images_rejected_too_large')
+            return {'success': False, 'error': str(e)}, 413
+        
+        # Hash the upload so retries reuse cached preprocessing decisions
+        image_key = hashlib.sha256(data).hexdigest()
         
+        # Extract text page by page, stopping as soon as both fields are found
+        # or the request's budget runs out
+        job_key = ocr_job_key('verify_student', image_key, chain, last_name, student_id)
+        try:
+            with request_deadline(job_key, is_disconnected) as deadline:
+                pages, memory = run_coalesced(
+                    job_key,
+                    lambda: within_budget(estimated, lambda: ocr_document(
+                        Image.open(BytesIO(data)), image_key,
+                        partial(student_verified, last_name, student_id), deadline, chain,
+                        field_profiles(last_name, student_id)))
+                )
+        except MemoryBudgetExhausted as e:
+            metrics.incr('ocr_jobs_rejected_memory')
+            return {'success': False, 'error': str(e), 'retry': True}, 503
+        except ImageTooLarge as e:
+            # A later frame of a multi-frame image was over the pixel limit
+            metrics.incr('images_rejected_too_large')
+            return {'success': False, 'error': str(e)}, 413
+        except pytesseract.TesseractNotFoundError:
+            return {
+                'success': False,
+                'error': 'Tesseract OCR is not installed or not found in PATH. Please check the server configuration.',
+                'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd,
+                'path': os.environ.get('PATH', 'Not set')
+            }, 500
+        
+        rejected = quality_rejection(pages)
+        if rejected:
+            return {
+                'success': False,
+                'verified': False,
+                'error': rejected['message'],
+                'quality': rejected,
+                'memory': memory
+            }, 422
+        
+        all_text = [text for page in pages for text in page.texts]
+        skipped = skipped_passes(pages)
+        if not all_text and skipped:
+            return {
+                'success': False,
+                'error': 'OCR budget ran out before any text was read',
+                'partial': True,
+                'skipped_passes': skipped,
+                'memory': memory
+            }, 504
         if not all_text:
-            return jsonify({
+            return {
                 'success': False,
                 'error': 'Failed to extract text from image. Tesseract may not be properly configured.',
                 'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd
-            }), 500
+            }, 500
         
         # Combine all extracted text
         full_text = ' '.join(all_text)
         
-        # Clean and normalize all text for comparison
-        clean_extracted = clean_text_for_matching(full_text)
-        clean_last_name = clean_text_for_matching(last_name)
-        clean_student_id = clean_text_for_matching(student_id).replace(' ', '')
-        
-        # Special handling for birthday to handle different formats
-        # clean_birthday = clean_date_string(birthday)
-        # clean_extracted_date = clean_date_string(full_text)
-        
         # Verification
-        last_name_found = clean_last_name in clean_extracted
-        # birthday_found = clean_birthday and clean_birthday in clean_extracted_date
-        student_id_found = clean_student_id and clean_student_id in clean_extracted.replace(' ', '')
+        last_name_found, student_id_found = student_fields_verified(last_name, student_id, full_text)
         
-        return jsonify({
+        return {
             'success': True,
-            'verified': all([last_name_found, student_id_found])
-        })
+            'verified': all([last_name_found, student_id_found]),
+            'partial': bool(skipped),
+            'skipped_passes': skipped,
+            'memory': memory
+        }, 200
 
     except Exception as e:
         app.logger.error(f"Error processing request: {str(e)}", exc_info=True)
-        return jsonify({
+        return {
             'success': False,
             'error': f"Error processing request: {str(e)}"
-        }), 500
+        }, 500
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', upload_target_width=BASE_WIDTH)
 
 @app.route('/health')
 def health_check():
     """Health check endpoint for load balancers and monitoring"""
+    return jsonify(health_status()), 200
+
+def health_status():
+    """Tesseract status, initialising or re-detecting it when needed"""
     # Initialize Tesseract on first health check
     if not hasattr(app, '_tesseract_initialized'):
         try:
@@ -542,12 +730,90 @@ def health_check():
         except:
             pass
     
-    return jsonify({
+    return {
         'status': 'healthy',
         'tesseract': 'available' if is_tesseract_available() else 'unavailable',
         'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd or 'Not found',
         'path': os.environ.get('PATH', 'Not set')
-    }), 200
+    }
+
+def warm_up(record):
+    """
+    Push a synthetic document through the layout matcher (when templates
+    are configured), each configured preprocessing chain, every OCR pass
+    (the fields never match, so refine, profile and fallback passes all
+    run) and the matchers, so a new worker pays those first-use costs
+    before it takes traffic.
+    """
+    def step(name, fn):
+        began = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            record(name, time.perf_counter() - began, str(e))
+            app.logger.warning(f"Warm-up step {name} failed: {str(e)}")
+        else:
+            record(name, time.perf_counter() - began)
+
+    def tesseract():
+        init_tesseract()
+        app._tesseract_initialized = True
+
+    step('tesseract', tesseract)
+
+    buffer = BytesIO()
+    render_test_document().save(buffer, 'JPEG')
+    data = buffer.getvalue()
+    # Fields that are not on the document keep every follow-up pass running
+    last_name, student_id = 'Warmup', '0000-000000'
+    for chain_spec in sorted(set(app.config['PREPROCESS_CHAINS'].values())):
+        step(f"ocr:{chain_spec}", lambda: ocr_document(
+            Image.open(BytesIO(data)), f"warmup:{os.getpid()}:{chain_spec}",
+            partial(student_verified, last_name, student_id),
+            Deadline(app.config['OCR_BUDGET_SECONDS']), resolve_chain(chain_spec),
+            field_profiles(last_name, student_id)))
+
+    text = 'Last Name: DOE Student ID: 2021-004587'
+    step('matching', lambda: (student_fields_verified('Doe', '2021-004587', text),
+                              is_name_in_text('John Doe', text), find_id_in_text('2021-004587', text)))
+
+warmup = Warmup(warm_up)
+
+@app.route('/ready')
+def ready_check():
+    """Readiness for the router: 503 until this worker has warmed up"""
+    warmup.start()
+    status = warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request and OCR counters for this worker process"""
+    snapshot = metrics.snapshot()
+    snapshot['ocr_jobs_in_flight'] = ocr_flights.in_flight()
+    snapshot['memory_budget'] = memory_budget.snapshot()
+    snapshot['quality_gate'] = {'enabled': quality_gate.enabled, 'thresholds': quality_gate.thresholds}
+    snapshot['layouts'] = {
+        'enabled': layout_registry.enabled,
+        'templates': [template.name for template in layout_registry.templates]
+    }
+    return jsonify(snapshot), 200
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """Recent request profiles (admin token required)"""
+    if not request_profiler.authorized(request.headers):
+        return jsonify({'error': 'Not found'}), 404
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'profiles': request_profiler.recent(limit)}), 200
+
+@app.route('/admin/profiles/<name>')
+def download_profile(name):
+    """One stored profile file (admin token required)"""
+    path = request_profiler.path(name)
+    if not request_profiler.authorized(request.headers) or path is None:
+        return jsonify({'error': 'Not found'}), 404
+    return send_from_directory(os.path.abspath(request_profiler.root), name, as_attachment=True)
 
 @app.route('/debug/tesseract')
 def debug_tesseract():
@@ -598,6 +864,188 @@ def is_tesseract_available():
     except (pytesseract.TesseractNotFoundError, Exception):
         return False
 
+def run_ocr(image, is_satisfied=None, deadline=None, engine=recognize, profiles=()):
+    """Run the OCR passes, re-detecting Tesseract once if it has gone missing"""
+    try:
+        return engine(image, is_satisfied, deadline, profiles)
+    except pytesseract.TesseractNotFoundError:
+        app.logger.warning(f"Tesseract not found at {pytesseract.pytesseract.tesseract_cmd}, attempting re-detection...")
+        if not verify_tesseract():
+            app.logger.error(f"Tesseract re-detection failed. CMD: {pytesseract.pytesseract.tesseract_cmd}")
+            raise
+        app.logger.info(f"Tesseract re-detected, retrying OCR...")
+        return engine(image, is_satisfied, deadline, profiles)
+
+# Created lazily per process; None when OCR runs in the request thread
+ocr_pool = OcrWorkerPool(app.config['OCR_PROCESSES']) if app.config['OCR_PROCESSES'] > 0 else None
+
+def satisfied_after(is_satisfied, earlier, text):
+    """is_satisfied over the text of earlier pages plus this one (picklable)"""
+    return is_satisfied(earlier + '\n' + text)
+
+def ocr_document(image, image_key, is_satisfied=None, deadline=None, chain=None, profiles=()):
+    """
+    OCR an uploaded image page by page (multi-frame TIFF/GIF included), with
+    only one decoded frame alive at a time. Stops as soon as is_satisfied
+    accepts the text read so far; returns the OcrResult of each page read.
+    With OCR worker processes, each page is binarized into a shared-memory
+    segment and only its handle is sent to the worker, so is_satisfied must
+    be picklable. When the deadline stops the document early, the page it
+    stopped on lists what was skipped ('document' scope: any pages not
+    started). chain names the preprocessing stages run on each page and
+    profiles the field profiles that stand in for the general follow-up passes.
+    Pages the quality gate rejects are not read; their result carries the
+    gate's verdict in rejected. A page matching a layout template has only
+    its field boxes read, unless those leave is_satisfied unsatisfied.
+    """
+    pages = []
+    earlier_text = ''
+    for index, frame in iter_frames(image):
+        reason = deadline.check() if deadline is not None else None
+        if reason:
+            skipped = OcrResult()
+            skipped.skip([('document', None, None)], reason)
+            pages.append(skipped)
+            break
+        
+        # The header check only saw the first frame
+        if index and frame.size[0] * frame.size[1] > app.config['MAX_IMAGE_PIXELS']:
+            raise ImageTooLarge(f"Page {index + 1} is {frame.size[0]}x{frame.size[1]}; "
+                                f"the limit is {app.config['MAX_IMAGE_PIXELS']:,} pixels")
+
+        # Pages the gate finds hopeless are not preprocessed or OCRed at all
+        verdict = quality_gate.check(frame)
+        if quality_gate.enabled:
+            metrics.observe('quality_gate', verdict.seconds)
+        if not verdict.passed:
+            rejected = OcrResult()
+            rejected.rejected = {
+                'reason': verdict.reason,
+                'message': GATE_REASONS[verdict.reason],
+                'measures': verdict.measures
+            }
+            pages.append(rejected)
+            metrics.incr(f'quality_gate_rejected_{verdict.reason}')
+            # Going by the pages that were OCRed, this is the time not spent
+            metrics.incr('quality_gate_ocr_seconds_saved', metrics.mean('ocr_page'))
+            continue
+
+        page_satisfied = None
+        if is_satisfied is not None:
+            page_satisfied = partial(satisfied_after, is_satisfied, earlier_text)
+        
+        # A known card design is read from its field boxes alone; when those
+        # don't give the caller what it needs, the full page is read as usual
+        layout_page = None
+        if page_satisfied is not None and layout_registry.enabled and layout_registry.templates:
+            try:
+                layout_page = read_layout(frame, deadline, profiles)
+            except DeadlineExceeded:
+                pass  # The full-page path records what the deadline skipped
+        if layout_page is not None:
+            if page_satisfied('\n'.join(layout_page.texts)):
+                pages.append(layout_page)
+                break
+            metrics.incr('layout_fallbacks')
+        
+        timings = []
+        began = time.perf_counter()
+        with ocr_pool.lease() if ocr_pool is not None else nullcontext() as lease:
+            try:
+                page = binarize(frame, f"{image_key}:{index}", deadline,
+                                lease.allocate if lease is not None else None,
+                                chain=chain or resolve_chain(None), timings=timings)
+            except DeadlineExceeded as e:
+                page = None
+                skipped = OcrResult()
+                skipped.skip([('preprocess', None, None)], e.reason)
+                pages.append(skipped)
+            
+            if page is not None and lease is not None:
+                pages.append(run_ocr(lease, page_satisfied, deadline, ocr_pool.recognize, profiles))
+            elif page is not None:
+                pages.append(run_ocr(Image.fromarray(page), page_satisfied, deadline, recognize, profiles))
+            del page
+        pages[-1].preprocess = timings
+        if layout_page is not None:
+            pages[-1].layout = dict(layout_page.layout, fallback=True)
+        if not pages[-1].skipped:
+            metrics.observe('ocr_page', time.perf_counter() - began)
+
+        if pages[-1].skipped:
+            # Out of budget or the client left; later pages would be skipped too
+            if index + 1 < getattr(image, 'n_frames', 1):
+                pages[-1].skip([('document', None, None)], pages[-1].skipped[-1]['reason'])
+            break
+        
+        earlier_text = '\n'.join(text for result in pages for text in result.texts)
+        if is_satisfied is not None and is_satisfied(earlier_text):
+            break
+    return pages
+
+def read_layout(frame, deadline=None, profiles=()):
+    """OcrResult of a page's field boxes when it matches a layout template, else None"""
+    gray = np.asarray(ImageOps.exif_transpose(frame).convert('L'))
+    match = layout_registry.match(gray)
+    if match is None:
+        metrics.incr('layout_unmatched')
+        return None
+    metrics.observe('layout_match', match.seconds)
+    metrics.incr(f'layout_matched_{match.template.name}')
+    began = time.perf_counter()
+    result = read_fields(gray, match, profiles, deadline)
+    metrics.observe('layout_fields', time.perf_counter() - began)
+    return result
+
+# Identical OCR jobs (double-clicks, client retries) that overlap share one run
+ocr_flights = SingleFlight()
+
+def ocr_job_key(endpoint, image_key, *fields):
+    """Identity of an OCR job: endpoint, image content, pipeline config and fields"""
+    pipeline = (BASE_WIDTH, PRIMARY_PASS, tuple(REFINE_PASSES), tuple(FALLBACK_PASSES), LOW_CONFIDENCE)
+    return hashlib.sha256(repr((endpoint, image_key, pipeline, fields)).encode('utf-8')).hexdigest()
+
+def run_coalesced(key, job):
+    """Run job() unless an identical one is in flight, in which case share its result"""
+    result, shared = ocr_flights.do(key, job)
+    metrics.incr('ocr_jobs_coalesced' if shared else 'ocr_jobs_run')
+    return result
+
+def within_budget(estimated, job, admission=None):
+    """
+    Run job() once its estimated memory is admitted, or under an admission
+    the caller already holds; returns (result, memory report)
+    """
+    if admission is not None:
+        return job(), admission.report()
+    with memory_budget.admit(estimated) as admission:
+        result = job()
+    return result, admission.report()
+
+def request_deadline(key, probe=None):
+    """
+    Budget for the OCR job of a request. probe() reports whether the client
+    has gone; a disconnect only cancels the job while no coalesced duplicate
+    is waiting on its result.
+    """
+    is_disconnected = None
+    if probe is not None:
+        is_disconnected = lambda: probe() and not ocr_flights.has_waiters(key)
+    return Deadline(app.config['OCR_BUDGET_SECONDS'], is_disconnected)
+
+def quality_rejection(pages):
+    """The quality gate's verdict when it rejected every page read, else None"""
+    if pages and all(page.rejected for page in pages):
+        return pages[0].rejected
+    return None
+
+def skipped_passes(pages):
+    """Passes the deadline cut from a document, tagged with their page number"""
+    skipped = [dict(entry, page=index) for index, page in enumerate(pages) for entry in page.skipped]
+    for entry in skipped:
+        metrics.incr(f"ocr_passes_skipped_{entry['reason']}")
+    return skipped
+
 def clean_text_for_matching(text):
     """Clean and normalize text for matching"""
     return re.sub(r'[^\w\s]', ' ', text.lower())
@@ -655,46 +1103,45 @@ def is_name_in_text(name, text):
 
 def is_id_in_text(id_number, text):
     """
-    Check if the ID exists in the extracted text with flexible matching
+    Check if the ID exists in the extracted text, tolerating OCR look-alikes
+    (O/0, l/1, S/5, B/8) and up to ID_MATCH_MAX_DISTANCE other edits
     """
+    return find_id_in_text(id_number, text) is not None
+
+def find_id_in_text(id_number, text):
+    """Return the best IdMatch for the ID in the extracted text, or None"""
     if not id_number or not text:
-        return False
-    
-    # Clean and normalize the ID - keep only digits
-    clean_id = re.sub(r'[^\d]', '', id_number)
-    if not clean_id:  # If no digits found in the ID
-        return False
-    
-    # Clean the text - keep only digits and spaces
-    clean_text = re.sub(r'[^\d\s]', ' ', text)
-    
-    # Check for exact match first
-    if clean_id in clean_text:
-        return True
-    
-    # For longer IDs, check if parts of it exist in the text
-    if len(clean_id) > 5:
-        # Try first 6 digits if ID is long enough
-        first_part = clean_id[:6]
-        if first_part in clean_text:
-            return True
-        
-        # Try last 6 digits
-        last_part = clean_id[-6:]
-        if last_part in clean_text:
-            return True
-    
-    # Check if the ID is present with common separators
-    id_formats = [
-        clean_id,  # 1234567890
-        '-'.join([clean_id[:4], clean_id[4:]]),  # 1234-567890
-        ' '.join([clean_id[:4], clean_id[4:]]),  # 1234 567890
-        ' '.join([clean_id[i:i+4] for i in range(0, len(clean_id), 4)]),  # 1234 5678 90
-    ]
-    
-    return any(fmt in text for fmt in id_formats if len(fmt) > 3)
+        return None
+    return find_id_match(id_number, text, max_distance=app.config['ID_MATCH_MAX_DISTANCE'])
+
+@app.route('/uploads/<name>')
+def uploaded_file(name):
+    """Serve a stored upload by hash, from memory if its write is still pending"""
+    filename = secure_filename(name)
+    pending = upload_store.get_pending(filename)
+    if pending is not None:
+        mimetype = Image.MIME.get(Image.open(BytesIO(pending)).format, 'application/octet-stream')
+        return Response(pending, mimetype=mimetype)
+    # Content never changes under a hash name, so it can be cached forever
+    return send_from_directory(upload_store.root, filename, max_age=365 * 24 * 3600)
+
+@app.route('/previews/<int:width>/<name>')
+def preview_file(width, name):
+    """WebP preview of a stored upload, rendered now if the background render is still queued"""
+    preview = previews.get(secure_filename(name), width)
+    data = upload_store.read(preview) if preview is not None else None
+    if data is None:
+        return jsonify({'error': 'Not found'}), 404
+    response = Response(data, mimetype='image/webp')
+    # The name is derived from the content, so it never changes
+    response.set_etag(preview)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
 
 @app.route('/upload', methods=['POST'])
+@profiled('upload')
 def upload_file():
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -707,80 +1154,111 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
     
     if not allowed_file(file.filename):
-        return jsonify({'error': 'File type not allowed. Please upload a PNG, JPG, or JPEG image.'}), 400
+        return jsonify({'error': 'File type not allowed. Please upload a PNG, JPG, JPEG, GIF or TIFF image.'}), 400
+    
+    result, status = upload_job(
+        file.read(), file.filename, name, id_number,
+        structured=request.values.get('structured', '').lower() in ('1', 'true', 'yes'),
+        image_url_for=lambda filename: url_for('uploaded_file', name=filename),
+        preview_url_for=lambda filename, width: url_for('preview_file', width=width, name=filename),
+        is_disconnected=client_disconnect_probe(request.environ),
+        chain=request.values.get('preprocess')
+    )
+    return jsonify(result), status
+
+def upload_fields_found(name, id_number, text):
+    """Whether every field the client asked about appears in text"""
+    return all([
+        is_name_in_text(name, text) if name else True,
+        is_id_in_text(id_number, text) if id_number else True
+    ])
+
+def field_profiles(name, id_number):
+    """OCR profiles for the fields a request asks about, ID first"""
+    profiles = []
+    if id_number:
+        profiles.append(id_profile(id_number, app.config['ID_PATTERNS']))
+    if name:
+        profiles.append(name_profile(name))
+    return profiles
+
+def upload_job(data, original_filename, name, id_number, structured=False,
+               image_url_for=None, preview_url_for=None, is_disconnected=None, chain=None,
+               admission=None):
+    """
+    Store an upload, OCR it and look for the name and ID number.
+    Returns (payload, status); shared by the Flask and ASGI front ends.
+    A caller that reserved the job's memory before reading the upload
+    passes its admission so the job is not charged twice.
+    """
+    try:
+        chain = resolve_chain(chain or app.config['PREPROCESS_CHAINS']['upload'])
+    except ValueError as e:
+        return {'error': str(e)}, 400
     
     try:
-        # Save the uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Open and preprocess the image
-        image = Image.open(filepath)
-        
-        # Convert to grayscale
-        image = image.convert('L')
-        
-        # Resize image to improve OCR accuracy
-        base_width = 2000
-        w_percent = (base_width / float(image.size[0]))
-        h_size = int((float(image.size[1]) * float(w_percent)))
-        image = image.resize((base_width, h_size), Image.Resampling.LANCZOS)
-        
-        # Apply thresholding to get a binary image
-        img_array = np.array(image)
-        _, binary_image = cv2.threshold(img_array, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # Size the job from the image header; bombs are refused undecoded and unstored
+        try:
+            estimated = memory_budget.estimate(data)
+        except ImageTooLarge as e:
+            metrics.incr('images_rejected_too_large')
+            return {'error': str(e)}, 413
         
-        # Convert back to PIL Image
-        image = Image.fromarray(binary_image)
+        # Store the upload under its content hash; the disk write happens off
+        # the request thread, so OCR works from the bytes already in memory
+        image_key = hashlib.sha256(data).hexdigest()
+        extension = secure_filename(original_filename).rsplit('.', 1)[-1].lower()
+        filename = upload_store.put(data, extension, name=f"{image_key}.{extension}")
+        previews.schedule(filename, data)
         
-        # Try multiple OCR configurations
-        configs = [
-            r'--oem 3 --psm 6',  # Assume a single uniform block of text
-            r'--oem 3 --psm 4',  # Assume a single column of text of variable sizes
-            r'--oem 3 --psm 11'  # Sparse text with OSD
-        ]
+        # Extract text page by page, re-reading weak lines only while a field
+        # is missing and stopping at the first page that completes the match
+        job_key = ocr_job_key('upload', image_key, chain, name, id_number)
+        try:
+            with request_deadline(job_key, is_disconnected) as deadline:
+                pages, memory = run_coalesced(
+                    job_key,
+                    lambda: within_budget(estimated, lambda: ocr_document(
+                        Image.open(BytesIO(data)), image_key,
+                        partial(upload_fields_found, name, id_number) if name or id_number else None,
+                        deadline, chain, field_profiles(name, id_number)), admission)
+                )
+        except MemoryBudgetExhausted as e:
+            metrics.incr('ocr_jobs_rejected_memory')
+            return {'error': str(e), 'retry': True}, 503
+        except ImageTooLarge as e:
+            # A later frame of a multi-frame image was over the pixel limit
+            metrics.incr('images_rejected_too_large')
+            return {'error': str(e)}, 413
+        except pytesseract.TesseractNotFoundError:
+            return {
+                'error': 'Tesseract OCR is not installed or not found in PATH. Please check the server configuration.',
+                'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd,
+                'path': os.environ.get('PATH', 'Not set')
+            }, 500
         
-        all_text = []
-        tesseract_found = False
-        
-        for config in configs:
-            try:
-                current_text = pytesseract.image_to_string(image, config=config)
-                if current_text.strip():
-                    all_text.append(current_text.strip())
-                    tesseract_found = True
-            except pytesseract.TesseractNotFoundError:
-                app.logger.warning(f"Tesseract not found at {pytesseract.pytesseract.tesseract_cmd}, attempting re-detection...")
-                # Try to re-detect Tesseract at runtime
-                if verify_tesseract():
-                    app.logger.info(f"Tesseract re-detected, retrying OCR...")
-                    try:
-                        current_text = pytesseract.image_to_string(image, config=config)
-                        if current_text.strip():
-                            all_text.append(current_text.strip())
-                            tesseract_found = True
-                    except Exception as retry_error:
-                        app.logger.error(f"OCR still failed after re-detection: {str(retry_error)}")
-                else:
-                    app.logger.error(f"Tesseract re-detection failed. CMD: {pytesseract.pytesseract.tesseract_cmd}")
-                    # Only return error if this is the first config and we haven't found any text yet
-                    if not all_text and config == configs[0]:
-                        return jsonify({
-                            'error': 'Tesseract OCR is not installed or not found in PATH. Please check the server configuration.',
-                            'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd,
-                            'path': os.environ.get('PATH', 'Not set')
-                        }), 500
-            except pytesseract.TesseractError as e:
-                app.logger.error(f"Tesseract error: {str(e)}")
-                # Continue with other configs if one fails
-                continue
+        rejected = quality_rejection(pages)
+        if rejected:
+            return {
+                'error': rejected['message'],
+                'quality': rejected,
+                'memory': memory
+            }, 422
         
+        all_text = [text for page in pages for text in page.texts]
+        skipped = skipped_passes(pages)
+        if not all_text and skipped:
+            return {
+                'error': 'OCR budget ran out before any text was read',
+                'partial': True,
+                'skipped_passes': skipped,
+                'memory': memory
+            }, 504
         if not all_text:
-            return jsonify({
+            return {
                 'error': 'Failed to extract text from image. Tesseract may not be properly configured.',
                 'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd
-            }), 500
+            }, 500
         
         # Combine all extracted text and remove duplicate lines
         unique_lines = []
@@ -799,23 +1277,204 @@ def upload_file():
         name_found = is_name_in_text(name, final_text) if name else False
         
         # Perform ID verification if ID is provided
-        id_found = is_id_in_text(id_number, final_text) if id_number else False
+        id_match = find_id_in_text(id_number, final_text) if id_number else None
         
-        return jsonify({
+        preview_urls = {
+            str(width): preview_url_for(filename, width) if preview_url_for else f"/previews/{width}/{filename}"
+            for width in previews.widths
+        }
+        
+        response = {
             'success': True,
             'text': final_text,
-            'image_url': f'/static/uploads/{filename}',
+            'image_url': preview_urls[str(max(previews.widths))],
+            'preview_urls': preview_urls,
+            'original_url': image_url_for(filename) if image_url_for else f"/uploads/{filename}",
             'name_found': name_found,
-            'id_found': id_found
-        })
+            'id_found': id_match is not None,
+            'id_match': {
+                'position': id_match.start,
+                'distance': id_match.distance,
+                'matched': id_match.matched
+            } if id_match else None,
+            'pages_processed': sum(1 for page in pages if page.passes),
+            'partial': bool(skipped),
+            'skipped_passes': skipped,
+            'memory': memory
+        }
+        
+        # Word boxes and confidences are opt-in; they can be large
+        if structured:
+            response['ocr'] = {'pages': [page.to_dict() for page in pages]}
+        
+        return response, 200
         
     except Exception as e:
         app.logger.error(f"Error processing upload: {str(e)}", exc_info=True)
-        return jsonify({
+        return {
             'error': f'Error processing request: {str(e)}',
             'tesseract_cmd': pytesseract.pytesseract.tesseract_cmd
-        }), 500
+        }, 500
+
+def start_chunked_upload(params):
+    """
+    Open a chunked upload from the client's JSON: filename, size, optional
+    chunk_size and sha256 of the whole file, and the /upload fields.
+    Returns (payload, status); shared by the Flask and ASGI front ends.
+    """
+    filename = str(params.get('filename') or '')
+    if not filename:
+        return {'error': 'filename is required'}, 400
+    if not allowed_file(filename):
+        return {'error': 'File type not allowed. Please upload a PNG, JPG, JPEG, GIF or TIFF image.'}, 400
+    fields = {
+        'name': str(params.get('name') or '').strip(),
+        'id_number': str(params.get('id_number') or '').strip(),
+        'structured': str(params.get('structured', '')).lower() in ('1', 'true', 'yes'),
+        'preprocess': params.get('preprocess'),
+    }
+    # Refuse a bad chain now rather than after the whole file has been sent
+    try:
+        resolve_chain(fields['preprocess'] or app.config['PREPROCESS_CHAINS']['upload'])
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    try:
+        meta = chunked_uploads.init(filename, params.get('size'),
+                                    params.get('chunk_size') or DEFAULT_CHUNK_SIZE,
+                                    (params.get('sha256') or '').lower() or None, fields)
+    except ChunkError as e:
+        return {'error': str(e)}, e.status
+    metrics.incr('chunked_uploads_started')
+    return {
+        'upload_id': meta['upload_id'],
+        'chunk_size': meta['chunk_size'],
+        'total_chunks': meta['total_chunks'],
+    }, 201
+
+def put_upload_chunk(upload_id, index, data, sha256=None):
+    """Store one chunk; the payload lists the chunks still missing"""
+    try:
+        return chunked_uploads.put_chunk(upload_id, index, data, sha256), 200
+    except ChunkError as e:
+        return {'error': str(e)}, e.status
+
+def chunked_upload_status(upload_id):
+    """Which chunks have arrived, so a client resuming an upload resends only the rest"""
+    try:
+        return chunked_uploads.status(upload_id), 200
+    except ChunkError as e:
+        return {'error': str(e)}, e.status
+
+def finalize_chunked_upload(upload_id, status_url_for=None):
+    """
+    Assemble and verify the upload, then queue its OCR job. The request
+    returns at once with a job id to poll instead of waiting for OCR.
+    """
+    # A slot is taken before the file is assembled, so a backlog of finalized
+    # uploads can't hold more than CHUNKED_UPLOAD_MAX_PENDING files on disk
+    if not upload_job_slots.acquire(blocking=False):
+        metrics.incr('chunked_uploads_busy')
+        return {'error': 'Too many uploads waiting for OCR; finalize again shortly', 'retry': True}, 503
+    try:
+        path, meta = chunked_uploads.assemble(upload_id)
+    except ChunkError as e:
+        upload_job_slots.release()
+        payload = {'error': str(e)}
+        if e.status == 409:
+            payload.update(chunked_upload_status(upload_id)[0])
+        return payload, e.status
+
+    job_id = uuid.uuid4().hex
+    try:
+        upload_jobs.put(job_id, {'status': 'queued', 'created': time.time()})
+        upload_job_executor.submit(run_chunked_upload_job, job_id, path, meta)
+    except Exception:
+        os.remove(path)
+        upload_job_slots.release()
+        raise
+    metrics.incr('chunked_uploads_finalized')
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': status_url_for(job_id) if status_url_for else f"/api/upload_jobs/{job_id}"
+    }, 202
+
+def admit_when_possible(estimated):
+    """Admission for a background job, which can wait as long as it takes"""
+    while True:
+        try:
+            return memory_budget.admit(estimated)
+        except MemoryBudgetExhausted:
+            continue
+
+def run_chunked_upload_job(job_id, path, meta):
+    """
+    Run upload_job on an assembled upload and record its outcome. The job's
+    memory, the file included, is reserved before the file is read.
+    """
+    fields = meta['fields']
+    try:
+        try:
+            estimated = memory_budget.estimate_file(path)
+        except ImageTooLarge as e:
+            metrics.incr('images_rejected_too_large')
+            record = {'status': 'completed', 'result': {'error': str(e)}, 'status_code': 413}
+        else:
+            with admit_when_possible(estimated) as admission:
+                upload_jobs.put(job_id, {'status': 'processing', 'created': meta['created']})
+                with open(path, 'rb') as f:
+                    data = f.read()
+                result, status = upload_job(data, meta['filename'], fields['name'], fields['id_number'],
+                                            structured=fields['structured'], chain=fields['preprocess'],
+                                            admission=admission)
+                del data
+            record = {'status': 'completed', 'result': result, 'status_code': status}
+    except Exception as e:
+        app.logger.error(f"Chunked upload job {job_id} failed: {str(e)}", exc_info=True)
+        record = {'status': 'error', 'error': str(e), 'status_code': 500}
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        upload_job_slots.release()
+    upload_jobs.put(job_id, dict(record, created=meta['created']))
+
+def upload_job_status(job_id):
+    record = upload_jobs.get(job_id)
+    if record is None:
+        return {'success': False, 'status': 'not_found', 'error': 'Job not found'}, 404
+    return dict(record, success=record['status'] != 'error'), 200
+
+@app.route('/api/uploads', methods=['POST'])
+def chunked_upload_start():
+    result, status = start_chunked_upload(request.get_json(silent=True) or {})
+    return jsonify(result), status
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_progress(upload_id):
+    result, status = chunked_upload_status(upload_id)
+    return jsonify(result), status
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def chunked_upload_chunk(upload_id, index):
+    result, status = put_upload_chunk(upload_id, index, request.get_data(),
+                                      request.headers.get('X-Chunk-SHA256'))
+    return jsonify(result), status
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def chunked_upload_finalize(upload_id):
+    result, status = finalize_chunked_upload(
+        upload_id, status_url_for=lambda job_id: url_for('upload_job_progress', job_id=job_id))
+    return jsonify(result), status
+
+@app.route('/api/upload_jobs/<job_id>', methods=['GET'])
+def upload_job_progress(job_id):
+    result, status = upload_job_status(job_id)
+    return jsonify(result), status
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
+    warmup.start()
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,348 @@
+"""
+Async serving mode: the same OCR routes on an asyncio event loop.
+
+Under gthread a slow mobile upload holds a worker thread for the whole body
+transfer before OCR even starts. Here the event loop reads request bodies
+and writes responses, so one process can hold thousands of slow connections,
+and only the CPU-bound part (decode, preprocessing, Tesseract) is handed to
+a bounded OCR executor sized to the machine's cores.
+
+Run with:  uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import os
+import time
+import uuid
+import asyncio
+import threading
+from io import BytesIO
+from contextlib import asynccontextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# Each Tesseract process should use one core; the executor provides the
+# parallelism, and OpenMP threads on top of it only oversubscribe the CPU
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+from PIL import Image
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, FileResponse
+from starlette.routing import Mount, Route
+
+from deadline import WATCH_INTERVAL
+from app import (app as flask_app, allowed_file, is_valid_image_file, health_status,
+                 previews, upload_job, upload_store, verify_student_job, warmup,
+                 start_chunked_upload, put_upload_chunk, chunked_upload_status,
+                 finalize_chunked_upload, upload_job_status, upload_jobs)
+from chunked_uploads import MAX_CHUNK_SIZE
+from metrics import metrics
+
+# OCR jobs run concurrently; queued jobs wait without holding a connection thread
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr')
+
+
+def is_truthy(value):
+    return (value or '').lower() in ('1', 'true', 'yes')
+
+
+class BodyTooLarge(Exception):
+    """The request body went past its limit while it was being read"""
+
+
+def length_error(request, too_large='File too large', limit=None):
+    """
+    (error, status) for a body that should not be read: over limit (the
+    Flask app's by default) (413) or with a Content-Length that is not a
+    byte count (400). None when the body can be read.
+    """
+    if limit is None:
+        limit = flask_app.config['MAX_CONTENT_LENGTH']
+    length = request.headers.get('content-length')
+    if length is None:
+        return None
+    try:
+        length = int(length)
+    except ValueError:
+        return 'Invalid Content-Length', 400
+    if length < 0:
+        return 'Invalid Content-Length', 400
+    if length > limit:
+        return too_large, 413
+    return None
+
+
+def limit_body(request, limit=None):
+    """
+    The request with its body counted as it is received: BodyTooLarge is
+    raised past limit bytes, so a chunked body (no Content-Length) is cut
+    off just like the Flask app cuts off its stream.
+    """
+    if limit is None:
+        limit = flask_app.config['MAX_CONTENT_LENGTH']
+    receive = request.receive
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > limit:
+                raise BodyTooLarge()
+        return message
+
+    return Request(request.scope, limited_receive)
+
+
+async def run_job(request, job, *args, **kwargs):
+    """
+    Run an OCR job on the executor. While it runs, the event loop watches the
+    connection so the job's deadline can cancel it if the client goes away.
+    """
+    gone = threading.Event()
+
+    async def watch():
+        while not gone.is_set():
+            if await request.is_disconnected():
+                gone.set()
+                return
+            await asyncio.sleep(WATCH_INTERVAL)
+
+    watcher = asyncio.ensure_future(watch())
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            ocr_executor, partial(job, *args, is_disconnected=gone.is_set, **kwargs))
+    finally:
+        watcher.cancel()
+
+
+async def read_upload(form):
+    """Return (bytes, filename) of the form's file field, or None if missing"""
+    upload = form.get('file')
+    if upload is None or not hasattr(upload, 'read'):
+        return None
+    return await upload.read(), upload.filename or ''
+
+
+async def upload(request):
+    error = length_error(request)
+    if error:
+        return JSONResponse({'error': error[0]}, status_code=error[1])
+
+    try:
+        async with limit_body(request).form() as form:
+            received = await read_upload(form)
+            name = (form.get('name') or '').strip()
+            id_number = (form.get('id_number') or '').strip()
+            structured = is_truthy(form.get('structured') or request.query_params.get('structured'))
+            chain = form.get('preprocess') or request.query_params.get('preprocess')
+    except BodyTooLarge:
+        return JSONResponse({'error': 'File too large'}, status_code=413)
+
+    if received is None:
+        return JSONResponse({'error': 'No file part'}, status_code=400)
+    data, filename = received
+    if filename == '':
+        return JSONResponse({'error': 'No selected file'}, status_code=400)
+    if not allowed_file(filename):
+        return JSONResponse({'error': 'File type not allowed. Please upload a PNG, JPG, JPEG, GIF or TIFF image.'},
+                            status_code=400)
+
+    result, status = await run_job(
+        request, upload_job, data, filename, name, id_number, structured=structured, chain=chain,
+        image_url_for=lambda stored: str(request.url_for('uploaded_file', name=stored).path),
+        preview_url_for=lambda stored, width: str(request.url_for('preview_file', width=width, name=stored).path))
+    return JSONResponse(result, status_code=status)
+
+
+async def verify_student(request):
+    error = length_error(request)
+    if error:
+        return JSONResponse({'success': False, 'error': error[0]}, status_code=error[1])
+
+    try:
+        async with limit_body(request).form() as form:
+            received = await read_upload(form)
+            last_name = (form.get('last_name') or '').strip()
+            student_id = (form.get('student_id') or '').strip()
+            run_async = is_truthy(form.get('async') or request.query_params.get('async'))
+            chain = form.get('preprocess') or request.query_params.get('preprocess')
+    except BodyTooLarge:
+        return JSONResponse({'success': False, 'error': 'File too large'}, status_code=413)
+
+    if received is None:
+        return JSONResponse({'success': False, 'error': 'No file part'}, status_code=400)
+    if not all([last_name, student_id]):
+        return JSONResponse({'success': False, 'error': 'Last name, and student ID are required'},
+                            status_code=400)
+    data, filename = received
+    if filename == '':
+        return JSONResponse({'success': False, 'error': 'No selected file'}, status_code=400)
+
+    is_valid, error_msg = is_valid_image_file(BytesIO(data))
+    if not is_valid:
+        flask_app.logger.error(f"Invalid image file: {error_msg}")
+        return JSONResponse({'success': False, 'error': f'Invalid image file: {error_msg}'},
+                            status_code=400)
+
+    if not run_async:
+        result, status = await run_job(request, verify_student_job, data, last_name, student_id,
+                                       chain=chain)
+        return JSONResponse(result, status_code=status)
+
+    # Queue the job and let the client poll verify_status; the connection is
+    # released immediately, so there is no client to watch for a disconnect
+    # Task records live on disk with the chunked upload jobs, so a poll that
+    # lands on another worker process finds them (and they expire with them)
+    task_id = uuid.uuid4().hex
+    upload_jobs.put(task_id, {'status': 'queued', 'timestamp': time.time()})
+    future = ocr_executor.submit(verify_student_job, data, last_name, student_id, chain=chain)
+    future.add_done_callback(partial(store_result, task_id))
+    metrics.incr('verify_tasks_queued')
+
+    return JSONResponse({
+        'success': True,
+        'task_id': task_id,
+        'status': 'queued',
+        'message': 'Request received and queued for processing'
+    })
+
+
+def store_result(task_id, future):
+    try:
+        result, _ = future.result()
+        record = {'status': 'completed', 'result': result, 'timestamp': time.time()}
+    except Exception as e:
+        record = {'status': 'error', 'error': str(e), 'timestamp': time.time()}
+    try:
+        upload_jobs.put(task_id, record)
+    except OSError as e:
+        flask_app.logger.error(f"Could not store result of task {task_id}: {str(e)}")
+
+
+async def verify_status(request):
+    """Check the status of a verification task"""
+    result = upload_jobs.get(request.path_params['task_id'])
+
+    if not result:
+        return JSONResponse({'success': True, 'status': 'not_found', 'message': 'Task ID not found'})
+    if result['status'] == 'completed':
+        return JSONResponse({'success': True, 'status': 'completed', 'result': result['result']})
+    if result['status'] == 'error':
+        return JSONResponse({'success': False, 'status': 'error', 'error': result['error']})
+    return JSONResponse({'success': True, 'status': result['status']})
+
+
+async def health_check(request):
+    """Health check endpoint for load balancers and monitoring"""
+    # Re-detection may shell out to Tesseract; keep it off the event loop
+    status = await asyncio.get_running_loop().run_in_executor(None, health_status)
+    return JSONResponse(status)
+
+
+async def ready_check(request):
+    """Readiness for the router: 503 until this worker has warmed up"""
+    warmup.start()
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+
+async def uploaded_file(request):
+    """Serve a stored upload, from memory if its background write is pending"""
+    name = request.path_params['name']
+    pending = upload_store.get_pending(name)
+    if pending is not None:
+        mimetype = Image.MIME.get(Image.open(BytesIO(pending)).format, 'application/octet-stream')
+        return Response(pending, media_type=mimetype)
+    path = upload_store.path(os.path.basename(name))
+    if not os.path.isfile(path):
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    return FileResponse(path, headers={'Cache-Control': f'public, max-age={365 * 24 * 3600}'})
+
+
+async def preview_file(request):
+    """WebP preview of a stored upload, rendered now if the background render is still queued"""
+    name = os.path.basename(request.path_params['name'])
+    loop = asyncio.get_running_loop()
+    preview = await loop.run_in_executor(None, previews.get, name, request.path_params['width'])
+    data = upload_store.read(preview) if preview is not None else None
+    if data is None:
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    headers = {
+        'ETag': f'"{preview}"',
+        'Cache-Control': f'public, max-age={365 * 24 * 3600}, immutable',
+    }
+    if request.headers.get('if-none-match') in (headers['ETag'], f'W/{headers["ETag"]}', '*'):
+        return Response(status_code=304, headers=headers)
+    return Response(data, media_type='image/webp', headers=headers)
+
+
+async def chunked_upload_start(request):
+    try:
+        params = await request.json()
+    except ValueError:
+        params = {}
+    result, status = start_chunked_upload(params if isinstance(params, dict) else {})
+    return JSONResponse(result, status_code=status)
+
+
+async def chunked_upload_progress(request):
+    result, status = chunked_upload_status(request.path_params['upload_id'])
+    return JSONResponse(result, status_code=status)
+
+
+async def chunked_upload_chunk(request):
+    error = length_error(request, 'Chunk too large', MAX_CHUNK_SIZE)
+    if error:
+        return JSONResponse({'error': error[0]}, status_code=error[1])
+    try:
+        data = await limit_body(request, MAX_CHUNK_SIZE).body()
+    except BodyTooLarge:
+        return JSONResponse({'error': 'Chunk too large'}, status_code=413)
+    # Hashing and writing the chunk is blocking file work; keep it off the loop
+    result, status = await asyncio.get_running_loop().run_in_executor(
+        None, put_upload_chunk, request.path_params['upload_id'], request.path_params['index'],
+        data, request.headers.get('x-chunk-sha256'))
+    return JSONResponse(result, status_code=status)
+
+
+async def chunked_upload_finalize(request):
+    result, status = await asyncio.get_running_loop().run_in_executor(
+        None, partial(finalize_chunked_upload, request.path_params['upload_id'],
+                      status_url_for=lambda job_id: str(request.url_for('upload_job_progress',
+                                                                        job_id=job_id).path)))
+    return JSONResponse(result, status_code=status)
+
+
+async def upload_job_progress(request):
+    result, status = upload_job_status(request.path_params['job_id'])
+    return JSONResponse(result, status_code=status)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    warmup.start()
+    yield
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/upload', upload, methods=['POST']),
+    Route('/api/verify_student', verify_student, methods=['POST']),
+    Route('/api/verify_status/{task_id}', verify_status, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+    Route('/ready', ready_check, methods=['GET']),
+    Route('/uploads/{name}', uploaded_file, methods=['GET']),
+    Route('/previews/{width:int}/{name}', preview_file, methods=['GET']),
+    Route('/api/uploads', chunked_upload_start, methods=['POST']),
+    Route('/api/uploads/{upload_id}', chunked_upload_progress, methods=['GET']),
+    Route('/api/uploads/{upload_id}/chunks/{index:int}', chunked_upload_chunk, methods=['PUT']),
+    Route('/api/uploads/{upload_id}/finalize', chunked_upload_finalize, methods=['POST']),
+    Route('/api/upload_jobs/{job_id}', upload_job_progress, methods=['GET']),
+    # Everything without a body to stream (the web UI, static files, /metrics,
+    # admin and debug pages) is served by the Flask app on a thread pool
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
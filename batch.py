@@ -0,0 +1,213 @@
+"""
+Offline batch OCR: a directory or manifest in, one JSONL record per file out.
+
+Runs the web app's pipeline (page-by-page preprocessing, OCR with field
+profiles, name and ID matching) in a pool of worker processes, one
+single-threaded Tesseract per core, without going through the web server.
+The output file doubles as the checkpoint: files already recorded in it are
+skipped when the same command is run again, so an interrupted backfill
+resumes where it stopped.
+
+    python batch.py scans/ --output results.jsonl
+    python batch.py manifest.jsonl --output results.jsonl --workers 8 --budget 120
+
+A manifest has one JSON object per line: {"file": path} plus, optionally,
+"name" and "id_number" to look for. Paths are relative to the manifest.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from io import BytesIO
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# One Tesseract thread per worker process; the pool supplies the parallelism
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+from PIL import Image
+
+# Submitted but unfinished files per worker; keeps the pool busy without
+# queueing the whole directory up front
+QUEUE_DEPTH = 4
+
+# Runs in a row a file may fail with the same content before resumed runs
+# stop trying it
+MAX_ATTEMPTS = 3
+
+
+def iter_directory(root, extensions):
+    """Manifest entries for every image below root, in a stable order"""
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.rsplit('.', 1)[-1].lower() in extensions:
+                path = os.path.join(directory, filename)
+                yield {'file': os.path.relpath(path, root), 'path': path}
+
+
+def iter_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f"{path}:{number}: invalid JSON: {str(e)}")
+            entry['path'] = os.path.join(base, entry['file'])
+            yield entry
+
+
+def load_checkpoint(output, max_attempts=MAX_ATTEMPTS):
+    """
+    Files already recorded in output without an error, and files whose last
+    max_attempts records are errors for the same content; returns (done,
+    exhausted). Other failed files are tried again and get a new record, so
+    the last record of a file is the one that counts. A record cut short by
+    a crash is dropped from the file so appending starts on a clean line.
+    """
+    done = set()
+    failures = {}  # file -> (sha256, failed runs in a row)
+    if not os.path.exists(output):
+        return done, set()
+    valid_bytes = 0
+    with open(output, 'rb') as f:
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('record cut short')
+                record = json.loads(line)
+                name = record['file']
+            except (ValueError, KeyError, TypeError):
+                break
+            valid_bytes += len(line)
+            if 'error' not in record:
+                done.add(name)
+                failures.pop(name, None)
+                continue
+            # A file whose content changed since it last failed starts over
+            sha256, count = failures.get(name, (None, 0))
+            failures[name] = (record.get('sha256'), count + 1 if sha256 == record.get('sha256') else 1)
+    with open(output, 'rb+') as f:
+        f.truncate(valid_bytes)
+    exhausted = {name for name, (_, count) in failures.items() if count >= max_attempts and name not in done}
+    return done, exhausted
+
+
+_budget = None
+
+
+def cpu_seconds():
+    """CPU time of this process and its waited-for children (Tesseract)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def init_worker(budget):
+    """Per-process setup: OCR in this process only, no caching between unrelated files"""
+    import app
+    import ocr_engine
+    from preprocessing import stage_cache
+    app.ocr_pool = None
+    ocr_engine.TILE_WORKERS = 1
+    stage_cache.max_bytes = 0
+    global _budget
+    _budget = budget
+
+
+def process_file(entry):
+    """OCR one file and match its fields; returns the JSONL record"""
+    import app
+    from deadline import Deadline
+
+    name = (entry.get('name') or '').strip()
+    id_number = (entry.get('id_number') or '').strip()
+    record = {'file': entry['file']}
+    began = time.perf_counter()
+    cpu_began = cpu_seconds()
+    try:
+        with open(entry['path'], 'rb') as f:
+            data = f.read()
+        record['sha256'] = image_key = hashlib.sha256(data).hexdigest()
+        app.memory_budget.estimate(data)  # pixel limit, checked before decode
+
+        deadline = Deadline(_budget) if _budget else None
+        is_satisfied = partial(app.upload_fields_found, name, id_number) if name or id_number else None
+        pages = app.ocr_document(Image.open(BytesIO(data)), image_key, is_satisfied, deadline, None,
+                                 app.field_profiles(name, id_number))
+        text = '\n'.join(text for page in pages for text in page.texts)
+        skipped = [dict(skip, page=index) for index, page in enumerate(pages) for skip in page.skipped]
+
+        record['text'] = text
+        record['pages_processed'] = sum(1 for page in pages if page.passes)
+        if name:
+            record['name_found'] = app.is_name_in_text(name, text)
+        if id_number:
+            id_match = app.find_id_in_text(id_number, text)
+            record['id_found'] = id_match is not None
+            record['id_match'] = id_match._asdict() if id_match else None
+        layout = next((page.layout for page in pages if page.layout), None)
+        if layout:
+            record['layout'] = layout
+        rejected = app.quality_rejection(pages)
+        if rejected:
+            record['quality'] = rejected
+        record['partial'] = bool(skipped)
+        record['skipped_passes'] = skipped
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {str(e)}"
+    record['seconds'] = round(time.perf_counter() - began, 3)
+    record['cpu_seconds'] = round(cpu_seconds() - cpu_began, 3)
+    return record
+
+
+def run(entries, output, workers, budget, max_attempts=MAX_ATTEMPTS):
+    done, exhausted = load_checkpoint(output, max_attempts)
+    pending = (entry for entry in entries if entry['file'] not in done and entry['file'] not in exhausted)
+    written = failed = 0
+    began = time.perf_counter()
+    with open(output, 'a', encoding='utf-8') as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(budget,)) as pool:
+        in_flight = set()
+        while True:
+            for entry in pending:
+                in_flight.add(pool.submit(process_file, entry))
+                if len(in_flight) >= workers * QUEUE_DEPTH:
+                    break
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                # One complete line per file, flushed, so a crash loses at most the files in flight
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+                written += 1
+                failed += 'error' in record
+            rate = written / (time.perf_counter() - began)
+            print(f"\r{written} done ({failed} failed), {rate:.2f} files/s", end='', file=sys.stderr, flush=True)
+    print(f"\n{len(done)} already done, {len(exhausted)} given up after {max_attempts} failures, "
+          f"{written} processed, {failed} failed", file=sys.stderr)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='OCR a directory or manifest of images into JSONL')
+    parser.add_argument('source', help='directory of images, or a JSONL manifest')
+    parser.add_argument('--output', required=True, help='JSONL results; also the resume checkpoint')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--budget', type=float, default=0, help='OCR seconds per file (0: unlimited)')
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help='failed runs in a row after which an unchanged file is no longer retried')
+    args = parser.parse_args()
+
+    from app import ALLOWED_EXTENSIONS
+    if os.path.isdir(args.source):
+        entries = iter_directory(args.source, ALLOWED_EXTENSIONS)
+    else:
+        entries = iter_manifest(args.source)
+    sys.exit(1 if run(entries, args.output, args.workers, args.budget, args.max_attempts) else 0)
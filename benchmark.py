@@ -0,0 +1,204 @@
+import re
+import time
+import random
+import string
+import timeit
+import argparse
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from create_test_image import TEST_LAST_NAME, TEST_STUDENT_ID, render_test_document
+from matching import find_id_match
+from ocr_engine import REFINE_PASSES, recognize
+from ocr_profiles import id_profile, name_profile, with_profile
+from preprocessing import preprocess_image
+
+# Configuration
+TEXT_LENGTHS = [2_000, 20_000, 200_000]  # characters of OCR output
+REPEATS = 5
+PROFILE_SAMPLES = 30  # rendered fields per profile benchmark
+DOCUMENT_SAMPLES = 10  # rendered documents per recognize() benchmark
+
+
+def legacy_is_id_in_text(id_number, text):
+    """The variant loop is_id_in_text used before the approximate matcher"""
+    if not id_number or not text:
+        return False
+
+    clean_id = re.sub(r'[^\d]', '', id_number)
+    if not clean_id:
+        return False
+
+    clean_text = re.sub(r'[^\d\s]', ' ', text)
+
+    if clean_id in clean_text:
+        return True
+
+    if len(clean_id) > 5:
+        if clean_id[:6] in clean_text:
+            return True
+        if clean_id[-6:] in clean_text:
+            return True
+
+    id_formats = [
+        clean_id,
+        '-'.join([clean_id[:4], clean_id[4:]]),
+        ' '.join([clean_id[:4], clean_id[4:]]),
+        ' '.join([clean_id[i:i+4] for i in range(0, len(clean_id), 4)]),
+    ]
+
+    return any(fmt in text for fmt in id_formats if len(fmt) > 3)
+
+
+def make_ocr_text(length, seed=0):
+    """Page-like OCR noise: words, short numbers, punctuation and line breaks"""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < length:
+        roll = rng.random()
+        if roll < 0.6:
+            word = ''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(2, 9)))
+        elif roll < 0.9:
+            word = str(rng.randint(0, 99999))
+        else:
+            word = rng.choice(['|', '-', ':', '.', '\n'])
+        parts.append(word)
+        size += len(word) + 1
+    return ' '.join(parts)[:length]
+
+
+def benchmark_id_matching(lengths=TEXT_LENGTHS, repeats=REPEATS):
+    """Time the legacy variant loop against find_id_match on long OCR output"""
+    student_id = '2021-004587'
+    cases = {
+        # The legacy loop has to try every variant before giving up
+        'absent': lambda text: text,
+        'exact': lambda text: text[:len(text) // 2] + ' 2021-004587 ' + text[len(text) // 2:],
+        'confused': lambda text: text[:len(text) // 2] + ' 2O21-OO4S87 ' + text[len(text) // 2:],
+    }
+
+    print(f"{'chars':>8}  {'case':<9} {'legacy ms':>10} {'bitap ms':>10} {'speedup':>8}  legacy/bitap found")
+    for length in lengths:
+        base = make_ocr_text(length)
+        for case, build in cases.items():
+            text = build(base)
+            legacy_found = legacy_is_id_in_text(student_id, text)
+            match = find_id_match(student_id, text)
+            number = max(1, 200_000 // length)
+            legacy = min(timeit.repeat(lambda: legacy_is_id_in_text(student_id, text),
+                                       number=number, repeat=repeats)) / number
+            bitap = min(timeit.repeat(lambda: find_id_match(student_id, text),
+                                      number=number, repeat=repeats)) / number
+            print(f"{length:>8}  {case:<9} {legacy * 1000:>10.3f} {bitap * 1000:>10.3f} "
+                  f"{legacy / bitap:>7.2f}x  {legacy_found}/{match is not None}")
+
+
+def render_field(text, seed=0, height=48):
+    """A single-line field crop like the ones refine passes re-read: noisy, slightly blurred"""
+    rng = np.random.default_rng(seed)
+    font = ImageFont.load_default(size=int(height * 0.6))
+    width = int(font.getlength(text)) + height
+    image = Image.new('L', (width, height), 255)
+    ImageDraw.Draw(image).text((height // 2, height // 5), text, fill=0, font=font)
+    pixels = np.asarray(image, dtype=np.float64)
+    pixels += rng.normal(0, 40, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def benchmark_profiles(samples=PROFILE_SAMPLES):
+    """Time and score the general line pass against the field profiles on rendered fields"""
+    try:
+        pytesseract.get_tesseract_version()
+    except (pytesseract.TesseractNotFoundError, OSError):
+        print("skipped: Tesseract not found")
+        return
+
+    rng = random.Random(0)
+    surnames = ['Dela Cruz', 'Santos', 'Reyes', 'Bautista', 'Villanueva', 'Gonzales', 'Mendoza']
+    ids = [f"{rng.randint(2015, 2025)}-{rng.randint(0, 999999):06d}" for _ in range(samples)]
+    names = [rng.choice(surnames) for _ in range(samples)]
+    config = REFINE_PASSES[0][0]
+
+    def normalise_id(text):
+        return re.sub(r'[^0-9A-Za-z]', '', text)
+
+    def normalise_name(text):
+        return re.sub(r'[^a-z]', '', text.lower())
+
+    cases = [
+        ('id', 'general', ids, lambda value: None, normalise_id),
+        ('id', 'id', ids, id_profile, normalise_id),
+        ('name', 'general', names, lambda value: None, normalise_name),
+        ('name', 'name', names, name_profile, normalise_name),
+    ]
+
+    print(f"{'field':<6} {'profile':<8} {'ms/read':>8} {'exact':>6}")
+    for field, label, values, profile_for, normalise in cases:
+        images = [render_field(value, seed) for seed, value in enumerate(values)]
+        correct = 0
+        began = time.perf_counter()
+        for value, image in zip(values, images):
+            profile = profile_for(value)
+            read = pytesseract.image_to_string(image, config=with_profile(config, profile))
+            correct += normalise(read) == normalise(value)
+        elapsed = (time.perf_counter() - began) / len(values)
+        print(f"{field:<6} {label:<8} {elapsed * 1000:>8.1f} {correct / len(values):>6.0%}")
+
+
+def render_document(seed=0, noise=60):
+    """The warm-up test document, noisy and blurred enough to leave weak lines"""
+    rng = np.random.default_rng(seed)
+    image = render_test_document().convert('L').filter(ImageFilter.GaussianBlur(1.2))
+    pixels = np.asarray(image, dtype=np.float64)
+    pixels += rng.normal(0, noise, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def benchmark_recognize(samples=DOCUMENT_SAMPLES):
+    """Time recognize() with and without field profiles on whole rendered documents"""
+    try:
+        pytesseract.get_tesseract_version()
+    except (pytesseract.TesseractNotFoundError, OSError):
+        print("skipped: Tesseract not found")
+        return
+
+    def is_satisfied(text):
+        return (TEST_LAST_NAME.lower() in text.lower()
+                and find_id_match(TEST_STUDENT_ID, text) is not None)
+
+    pages = [preprocess_image(render_document(seed)) for seed in range(samples)]
+    cases = [
+        ('off', []),
+        ('on', [id_profile(TEST_STUDENT_ID), name_profile(TEST_LAST_NAME)]),
+    ]
+
+    print(f"{'profiles':<9} {'ms/doc':>8} {'passes':>7} {'found':>6}")
+    for label, profiles in cases:
+        passes = found = 0
+        began = time.perf_counter()
+        for page in pages:
+            result = recognize(page, is_satisfied, profiles=profiles)
+            passes += len(result.passes)
+            found += is_satisfied('\n'.join(result.texts))
+        elapsed = (time.perf_counter() - began) / len(pages)
+        print(f"{label:<9} {elapsed * 1000:>8.1f} {passes / len(pages):>7.1f} {found / len(pages):>6.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the OCR pipeline')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--samples', type=int, default=PROFILE_SAMPLES)
+    parser.add_argument('--documents', type=int, default=DOCUMENT_SAMPLES)
+    args = parser.parse_args()
+
+    print("=== ID matching ===")
+    benchmark_id_matching(repeats=args.repeats)
+
+    print("\n=== OCR profiles ===")
+    benchmark_profiles(samples=args.samples)
+
+    print("\n=== recognize() with and without profiles ===")
+    benchmark_recognize(samples=args.documents)
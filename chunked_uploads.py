@@ -0,0 +1,224 @@
+"""
+Resumable chunked uploads and the status of the OCR jobs they start.
+
+A large scan is sent as numbered chunks instead of one request body: the
+client opens an upload, PUTs each chunk (with its SHA-256), and finalizes.
+A dropped connection only costs the chunk in flight; the client asks which
+chunks are missing and resends those. Each chunk request is short, so no
+server thread sits on a slow body for minutes.
+
+Sessions and job records live on disk under one directory, so any worker
+process on the host can take any chunk or status request:
+
+    <root>/<upload_id>/meta.json      what was announced at init
+    <root>/<upload_id>/<index>.part   chunks received so far
+    <root>/assembled/<upload_id>-*    finalized files waiting for their OCR job
+    <root>/jobs/<job_id>.json         status and result of finalized uploads
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Unfinished sessions and job records are removed after this long
+SESSION_TTL = 24 * 3600
+
+# Directories under the root that are not upload sessions
+_RESERVED = ('jobs', 'assembled')
+
+_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ChunkError(ValueError):
+    """A request the client has to fix; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ChunkedUploads:
+    """Upload sessions assembled from chunks on disk"""
+
+    def __init__(self, root, max_bytes, ttl=SESSION_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, upload_id):
+        if not _ID.match(upload_id or ''):
+            raise ChunkError('Unknown upload', 404)
+        return os.path.join(self.root, upload_id)
+
+    def _meta(self, upload_id):
+        try:
+            with open(os.path.join(self._dir(upload_id), 'meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ChunkError('Unknown upload', 404)
+
+    def init(self, filename, size, chunk_size=DEFAULT_CHUNK_SIZE, sha256=None, fields=None):
+        """Open a session; returns its metadata, including upload_id and total_chunks"""
+        # bool is an int subclass, but true is not a size
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise ChunkError('size must be a positive number of bytes')
+        if size > self.max_bytes:
+            raise ChunkError('File too large', 413)
+        if (not isinstance(chunk_size, int) or isinstance(chunk_size, bool)
+                or not 0 < chunk_size <= MAX_CHUNK_SIZE):
+            raise ChunkError(f'chunk_size must be between 1 and {MAX_CHUNK_SIZE} bytes')
+        if sha256 is not None and not re.match(r'^[0-9a-f]{64}$', sha256):
+            raise ChunkError('sha256 must be a hex SHA-256 digest')
+
+        self.collect_garbage()
+        upload_id = uuid.uuid4().hex
+        meta = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': chunk_size,
+            'total_chunks': -(-size // chunk_size),
+            'sha256': sha256,
+            'fields': fields or {},
+            'created': time.time(),
+        }
+        os.makedirs(self._dir(upload_id))
+        _write_atomic(os.path.join(self._dir(upload_id), 'meta.json'), json.dumps(meta).encode('utf-8'))
+        return meta
+
+    def put_chunk(self, upload_id, index, data, sha256=None):
+        """Store chunk index after checking its length and (if given) its SHA-256"""
+        meta = self._meta(upload_id)
+        if not 0 <= index < meta['total_chunks']:
+            raise ChunkError(f"Chunk index must be between 0 and {meta['total_chunks'] - 1}")
+        expected = min(meta['chunk_size'], meta['size'] - index * meta['chunk_size'])
+        if len(data) != expected:
+            raise ChunkError(f"Chunk {index} must be {expected} bytes, got {len(data)}")
+        if sha256 and hashlib.sha256(data).hexdigest() != sha256.lower():
+            raise ChunkError(f"Chunk {index} does not match its SHA-256; send it again", 422)
+        # Rewriting a chunk is harmless, so retries of a lost response are safe
+        _write_atomic(os.path.join(self._dir(upload_id), f'{index}.part'), data)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        meta = self._meta(upload_id)
+        received = sorted(
+            int(name[:-len('.part')]) for name in os.listdir(self._dir(upload_id)) if name.endswith('.part')
+        )
+        present = set(received)
+        return {
+            'upload_id': upload_id,
+            'size': meta['size'],
+            'chunk_size': meta['chunk_size'],
+            'total_chunks': meta['total_chunks'],
+            'received': len(received),
+            'missing': [index for index in range(meta['total_chunks']) if index not in present],
+        }
+
+    def assemble(self, upload_id):
+        """
+        Join the chunks into one file on disk and check its SHA-256, holding
+        one chunk in memory at a time. Returns (path, meta) and removes the
+        session; the caller removes the file. Raises ChunkError (409) while
+        chunks are missing.
+        """
+        meta = self._meta(upload_id)
+        missing = self.status(upload_id)['missing']
+        if missing:
+            raise ChunkError(f"{len(missing)} of {meta['total_chunks']} chunks are missing", 409)
+
+        directory = self._dir(upload_id)
+        assembled = os.path.join(self.root, 'assembled')
+        os.makedirs(assembled, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=assembled, prefix=f'{upload_id}-')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for index in range(meta['total_chunks']):
+                    try:
+                        with open(os.path.join(directory, f'{index}.part'), 'rb') as f:
+                            part = f.read()
+                    except FileNotFoundError:
+                        # A concurrent finalize of the same upload got there first
+                        raise ChunkError('Unknown upload', 404)
+                    digest.update(part)
+                    out.write(part)
+                    del part
+            if meta['sha256'] and digest.hexdigest() != meta['sha256']:
+                # Some chunk was corrupted without a chunk hash to catch it; start over
+                shutil.rmtree(directory, ignore_errors=True)
+                raise ChunkError('Assembled file does not match its SHA-256; upload it again', 422)
+        except Exception:
+            os.remove(path)
+            raise
+        shutil.rmtree(directory, ignore_errors=True)
+        return path, meta
+
+    def collect_garbage(self):
+        """Remove sessions, assembled files and job records older than the TTL"""
+        cutoff = time.time() - self.ttl
+        for directory in [self.root] + [os.path.join(self.root, name) for name in _RESERVED]:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name in _RESERVED or entry.stat().st_mtime > cutoff:
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+
+class JobRecords:
+    """Status and result of background OCR jobs, one JSON file each"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, job_id):
+        if not _ID.match(job_id or ''):
+            return None
+        return os.path.join(self.root, f'{job_id}.json')
+
+    def put(self, job_id, record):
+        record = dict(record, job_id=job_id, updated=time.time())
+        _write_atomic(self._path(job_id), json.dumps(record).encode('utf-8'))
+
+    def get(self, job_id):
+        path = self._path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,37 @@
+from PIL import Image, ImageDraw, ImageFont
+
+# Fields printed on the test document
+TEST_LAST_NAME = 'Doe'
+TEST_STUDENT_ID = '2021-004587'
+
+
+def render_test_document(width=1200, height=800):
+    """A plain student ID document with a name, an ID number and some filler text"""
+    image = Image.new('RGB', (width, height), color='white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=height // 24)
+
+    lines = [
+        'STATE UNIVERSITY',
+        'STUDENT IDENTIFICATION CARD',
+        '',
+        f'Last Name: {TEST_LAST_NAME.upper()}',
+        'First Name: JOHN',
+        f'Student ID: {TEST_STUDENT_ID}',
+        '',
+        'This is a test document for OCR validation.',
+    ]
+    y = height // 12
+    for line in lines:
+        draw.text((width // 16, y), line, fill='black', font=font)
+        y += int(font.size * 1.6)
+    return image
+
+
+def create_test_image(path='test_document.jpg'):
+    render_test_document().save(path)
+    print(f"Test image created: {path}")
+
+
+if __name__ == "__main__":
+    create_test_image()
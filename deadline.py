@@ -0,0 +1,198 @@
+"""
+Per-request time budgets for OCR work.
+
+A Deadline is created for each request and handed down the pipeline. Every
+Tesseract call gets the share of the remaining budget its stage is allowed
+(pytesseract kills the process when that timeout expires), and the request
+is cancelled early if the client disconnects: a watcher thread polls the
+connection and kills the Tesseract processes the request has running.
+"""
+import time
+import select
+import socket
+import logging
+import threading
+import subprocess
+
+import pytesseract
+
+logger = logging.getLogger(__name__)
+
+# Reasons a request stops before all of its passes ran
+DEADLINE = 'deadline'
+CLIENT_DISCONNECTED = 'client_disconnected'
+
+# Calls shorter than this are not worth starting
+MIN_CALL_SECONDS = 0.5
+
+# How often the watcher checks whether the client is still there
+WATCH_INTERVAL = 0.25
+
+_active = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of budget or its client goes away"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Deadline:
+    """Time budget and cancellation state for one request"""
+
+    def __init__(self, seconds, is_disconnected=None):
+        self.started = time.monotonic()
+        self.expires = self.started + seconds
+        self.is_disconnected = is_disconnected
+        self.reason = None
+
+        self._procs = set()
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self):
+        """Return why the request should stop, or None if it may continue"""
+        if self.reason is None:
+            if self.remaining() <= 0:
+                self.reason = DEADLINE
+            elif self.is_disconnected is not None and self.is_disconnected():
+                self.reason = CLIENT_DISCONNECTED
+        return self.reason
+
+    def timeout(self, share=1.0):
+        """
+        Seconds the next Tesseract call may take: share of what is left.
+        Raises DeadlineExceeded when that is too little to be useful.
+        """
+        reason = self.check()
+        if reason:
+            raise DeadlineExceeded(reason)
+        seconds = self.remaining() * share
+        if seconds < MIN_CALL_SECONDS:
+            self.reason = DEADLINE
+            raise DeadlineExceeded(DEADLINE)
+        return seconds
+
+    def cancel(self, reason):
+        """Stop the request and kill any Tesseract process it has running"""
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            procs = list(self._procs)
+        for proc in procs:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        if procs:
+            logger.info(f"Killed {len(procs)} Tesseract process(es): {reason}")
+
+    def _track(self, proc):
+        with self._lock:
+            self._procs.add(proc)
+            cancelled = self.reason is not None
+        if cancelled:
+            proc.kill()
+
+    def _forget_exited(self):
+        with self._lock:
+            self._procs = {proc for proc in self._procs if proc.poll() is None}
+
+    def __enter__(self):
+        """Watch the client connection for the duration of the request"""
+        if self.is_disconnected is not None:
+            self._watcher = threading.Thread(target=self._watch, name='deadline-watch', daemon=True)
+            self._watcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        return False
+
+    def _watch(self):
+        while not self._stop.wait(WATCH_INTERVAL):
+            self._forget_exited()
+            if self.reason is None and self.is_disconnected():
+                self.cancel(CLIENT_DISCONNECTED)
+            elif self.reason is None and self.remaining() <= 0:
+                self.cancel(DEADLINE)
+            if self.reason is not None:
+                return
+
+
+def call_tesseract(fn, image, config, deadline=None, share=1.0, **kwargs):
+    """
+    Run one pytesseract call under a deadline. The process is killed when
+    its share of the budget runs out or the request is cancelled, and
+    DeadlineExceeded is raised instead of a Tesseract error.
+    """
+    if deadline is None:
+        return fn(image, config=config, **kwargs)
+
+    timeout = deadline.timeout(share)
+    _active.deadline = deadline
+    try:
+        return fn(image, config=config, timeout=timeout, **kwargs)
+    except pytesseract.TesseractError:
+        # A process killed by the watcher exits with an error of its own
+        reason = deadline.check()
+        if reason:
+            raise DeadlineExceeded(reason)
+        raise
+    except RuntimeError as e:
+        # pytesseract kills the process and raises this when the timeout expires
+        if 'timeout' not in str(e).lower():
+            raise
+        deadline.reason = deadline.reason or DEADLINE
+        raise DeadlineExceeded(deadline.reason)
+    finally:
+        _active.deadline = None
+
+
+class _TrackingSubprocess:
+    """
+    Stands in for the subprocess module inside pytesseract so that every
+    Tesseract process started under a deadline is registered with it and
+    can be killed from the watcher thread.
+    """
+
+    def __getattr__(self, name):
+        return getattr(subprocess, name)
+
+    def Popen(self, *args, **kwargs):
+        proc = subprocess.Popen(*args, **kwargs)
+        deadline = getattr(_active, 'deadline', None)
+        if deadline is not None:
+            deadline._track(proc)
+        return proc
+
+
+pytesseract.pytesseract.subprocess = _TrackingSubprocess()
+
+
+def client_disconnect_probe(environ):
+    """
+    Return a callable that reports whether the client behind a WSGI request
+    has closed its connection, or None when the server does not expose it
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return None
+
+    def is_disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            # Readable with nothing to read means the peer closed the connection
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+
+    return is_disconnected
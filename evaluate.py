@@ -0,0 +1,254 @@
+"""
+Accuracy against cost for pipeline variants.
+
+Each variant (preprocessing chain, resize width, which follow-up passes run,
+field profiles on or off) verifies every document of a labeled corpus the
+way /api/verify_student does. Each case is a document plus a last name and
+student ID, and whether they should verify. For every variant we record
+accuracy, false accept and false reject rates, and CPU seconds per document
+(this process plus the Tesseract processes it ran). Variants that no other
+variant beats on both accuracy and CPU are marked as the Pareto front.
+
+Corpus: --synthetic N renders N ID cards and checks each against its own
+fields (should verify) and another card's fields (should not). Or use
+--labels cases.jsonl, one {"file", "last_name", "student_id", "expected"}
+per line, with files relative to --image-dir (default static/uploads).
+
+    python evaluate.py --synthetic 40
+    python evaluate.py --labels static/uploads/labels.jsonl --variants baseline,no-psm11 --min-accuracy 0.95
+"""
+import os
+import json
+import time
+import random
+import argparse
+from contextlib import contextmanager
+from functools import partial
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+import ocr_engine
+import preprocessing
+import app as ocr_app
+
+# Pipeline settings a variant may override, with the module attribute each patches
+SETTINGS = {
+    'base_width': (preprocessing, 'BASE_WIDTH'),
+    'refine_passes': (ocr_engine, 'REFINE_PASSES'),
+    'fallback_passes': (ocr_engine, 'FALLBACK_PASSES'),
+    'profile_page_pass': (ocr_engine, 'PROFILE_PAGE_PASS'),
+    'quality_gate': (ocr_app.quality_gate, 'enabled'),
+    'layouts': (ocr_app.layout_registry, 'enabled'),
+}
+
+# Besides SETTINGS: 'chain' (a preprocessing chain) and 'profiles' (bool)
+VARIANTS = {
+    'baseline': {},
+    'no-psm11': {'fallback_passes': [r'--oem 3 --psm 4'], 'profile_page_pass': r'--oem 3 --psm 4'},
+    'no-refine': {'refine_passes': []},
+    'no-profiles': {'profiles': False},
+    'width-1600': {'base_width': 1600},
+    'width-2400': {'base_width': 2400},
+    'clahe': {'chain': 'clahe'},
+    'adaptive': {'chain': 'adaptive'},
+    'no-gate': {'quality_gate': False},
+    'no-layouts': {'layouts': False},
+}
+
+SURNAMES = ['Dela Cruz', 'Santos', 'Reyes', 'Bautista', 'Villanueva', 'Gonzales', 'Mendoza', 'Garcia']
+GIVEN_NAMES = ['Juan', 'Maria', 'Jose', 'Ana', 'Mark', 'Angela', 'Paolo', 'Kristine']
+
+
+def render_document(last_name, given_name, student_id, seed=0):
+    """A student ID card photo: a few labeled lines, noise, blur and a slight tilt"""
+    rng = random.Random(seed)
+    noise = np.random.default_rng(seed)
+    width = rng.randint(1000, 1400)
+    image = Image.new('L', (width, int(width * 0.63)), rng.randint(215, 245))
+    draw = ImageDraw.Draw(image)
+    title = ImageFont.load_default(size=width // 22)
+    body = ImageFont.load_default(size=width // 30)
+    lines = [
+        (title, 'STATE UNIVERSITY'),
+        (body, 'STUDENT IDENTIFICATION CARD'),
+        (body, f'Name: {last_name.upper()}, {given_name}'),
+        (body, f'ID No.: {student_id}'),
+        (body, f'Course: BS {rng.choice(["Computer Science", "Nursing", "Accountancy"])}'),
+        (body, f'Valid until: {rng.randint(2025, 2029)}'),
+    ]
+    y = width // 20
+    for font, text in lines:
+        draw.text((width // 16, y), text, fill=rng.randint(0, 60), font=font)
+        y += int(font.size * 1.6)
+
+    image = image.filter(ImageFilter.GaussianBlur(rng.uniform(0, 1.2)))
+    image = image.rotate(rng.uniform(-3, 3), resample=Image.Resampling.BICUBIC, expand=True, fillcolor=230)
+    pixels = np.asarray(image, dtype=np.float64)
+    pixels += noise.normal(0, rng.uniform(5, 25), pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).convert('RGB')
+
+
+def synthetic_corpus(count, seed=0):
+    """(name, image, last_name, student_id, expected): each card with its own and another card's fields"""
+    rng = random.Random(seed)
+    people = [(rng.choice(SURNAMES), rng.choice(GIVEN_NAMES),
+               f"{rng.randint(2015, 2025)}-{rng.randint(0, 999999):06d}") for _ in range(count)]
+    cases = []
+    for index, (last_name, given_name, student_id) in enumerate(people):
+        image = render_document(last_name, given_name, student_id, seed=seed + index)
+        cases.append((f'synthetic-{index}', image, last_name, student_id, True))
+        # Another person's ID (and usually name) must not verify against this card
+        other_last, _, other_id = people[(index + 1) % count]
+        if other_id == student_id:
+            other_id = f"{int(student_id[:4]) + 1}{student_id[4:]}"
+        cases.append((f'synthetic-{index}-impostor', image, other_last, other_id, False))
+    return cases
+
+
+def labeled_corpus(labels_path, image_dir):
+    cases = []
+    with open(labels_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            label = json.loads(line)
+            with Image.open(os.path.join(image_dir, label['file'])) as image:
+                image.load()
+                cases.append((label['file'], image.copy(), label['last_name'], label['student_id'],
+                              bool(label.get('expected', True))))
+    return cases
+
+
+@contextmanager
+def applied(variant):
+    """Patch the pipeline settings of variant for the duration of the block"""
+    saved = {}
+    try:
+        for key, value in variant.items():
+            if key in SETTINGS:
+                module, attribute = SETTINGS[key]
+                saved[key] = getattr(module, attribute)
+                setattr(module, attribute, value)
+        yield
+    finally:
+        for key, value in saved.items():
+            module, attribute = SETTINGS[key]
+            setattr(module, attribute, value)
+
+
+def cpu_seconds():
+    """CPU time of this process and its waited-for children (Tesseract)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def evaluate(name, variant, cases):
+    chain = preprocessing.resolve_chain(variant.get('chain'))
+    use_profiles = variant.get('profiles', True)
+    counts = {'correct': 0, 'false_accept': 0, 'false_reject': 0, 'positives': 0, 'negatives': 0}
+    cpu = wall = 0.0
+    with applied(variant):
+        for case_name, image, last_name, student_id, expected in cases:
+            profiles = ocr_app.field_profiles(last_name, student_id) if use_profiles else ()
+            cpu_began, wall_began = cpu_seconds(), time.perf_counter()
+            # The variant name keeps cached stages and orientations from leaking between variants
+            pages = ocr_app.ocr_document(image, f"evaluate:{name}:{case_name}",
+                                         partial(ocr_app.student_verified, last_name, student_id),
+                                         None, chain, profiles)
+            verified = ocr_app.student_verified(last_name, student_id,
+                                                ' '.join(text for page in pages for text in page.texts))
+            cpu += cpu_seconds() - cpu_began
+            wall += time.perf_counter() - wall_began
+
+            counts['positives' if expected else 'negatives'] += 1
+            if verified == expected:
+                counts['correct'] += 1
+            elif verified:
+                counts['false_accept'] += 1
+            else:
+                counts['false_reject'] += 1
+
+    return {
+        'variant': name,
+        'accuracy': counts['correct'] / len(cases),
+        'false_accept_rate': counts['false_accept'] / counts['negatives'] if counts['negatives'] else 0.0,
+        'false_reject_rate': counts['false_reject'] / counts['positives'] if counts['positives'] else 0.0,
+        'cpu_per_doc': cpu / len(cases),
+        'wall_per_doc': wall / len(cases),
+    }
+
+
+def pareto_front(rows):
+    """Mark rows that no other row matches or beats on both accuracy and CPU"""
+    for row in rows:
+        row['pareto'] = not any(
+            other['accuracy'] >= row['accuracy'] and other['cpu_per_doc'] <= row['cpu_per_doc']
+            and (other['accuracy'] > row['accuracy'] or other['cpu_per_doc'] < row['cpu_per_doc'])
+            for other in rows
+        )
+    return rows
+
+
+def print_table(rows, min_accuracy=None):
+    print(f"{'variant':<14} {'accuracy':>8} {'FAR':>6} {'FRR':>6} {'cpu s/doc':>10} {'wall s/doc':>10}  pareto")
+    for row in sorted(rows, key=lambda row: row['cpu_per_doc']):
+        print(f"{row['variant']:<14} {row['accuracy']:>8.1%} {row['false_accept_rate']:>6.1%} "
+              f"{row['false_reject_rate']:>6.1%} {row['cpu_per_doc']:>10.3f} {row['wall_per_doc']:>10.3f}  "
+              f"{'*' if row['pareto'] else ''}")
+    if min_accuracy is not None:
+        meeting = [row for row in rows if row['accuracy'] >= min_accuracy]
+        if meeting:
+            cheapest = min(meeting, key=lambda row: row['cpu_per_doc'])
+            print(f"\ncheapest variant with accuracy >= {min_accuracy:.0%}: {cheapest['variant']}")
+        else:
+            print(f"\nno variant reaches accuracy {min_accuracy:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Accuracy/CPU Pareto table for OCR pipeline variants')
+    parser.add_argument('--synthetic', type=int, default=0, help='render this many synthetic ID cards')
+    parser.add_argument('--labels', help='JSONL of {"file", "last_name", "student_id", "expected"}')
+    parser.add_argument('--image-dir', default=ocr_app.app.config['UPLOAD_FOLDER'])
+    parser.add_argument('--variants', default=','.join(VARIANTS), help='comma-separated variant names')
+    parser.add_argument('--variant-file', help='JSON object of extra variants, same keys as VARIANTS')
+    parser.add_argument('--min-accuracy', type=float)
+    parser.add_argument('--json', help='also write the rows to this file')
+    args = parser.parse_args()
+
+    try:
+        pytesseract.get_tesseract_version()
+    except (pytesseract.TesseractNotFoundError, OSError):
+        raise SystemExit("Tesseract not found")
+
+    variants = dict(VARIANTS)
+    if args.variant_file:
+        with open(args.variant_file, encoding='utf-8') as f:
+            variants.update(json.load(f))
+    selected = [name.strip() for name in args.variants.split(',') if name.strip()]
+    if args.variant_file and args.variants == parser.get_default('variants'):
+        selected = list(variants)
+    unknown = [name for name in selected if name not in variants]
+    if unknown:
+        parser.error(f"unknown variants: {', '.join(unknown)}")
+
+    cases = []
+    if args.labels:
+        cases += labeled_corpus(args.labels, args.image_dir)
+    if args.synthetic or not cases:
+        cases += synthetic_corpus(args.synthetic or 20)
+
+    # Variants patch this process's pipeline, so OCR must not run in worker processes
+    ocr_app.ocr_pool = None
+
+    rows = []
+    for name in selected:
+        rows.append(evaluate(name, variants[name], cases))
+        print(f"evaluated {name}", flush=True)
+    print()
+    print_table(pareto_front(rows), args.min_accuracy)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,8 @@
+# Gunicorn reads this file from the working directory; the command line in
+# the Procfile / start.sh still sets bind, workers and threads.
+
+
+def post_worker_init(worker):
+    """Warm each worker up in the background; /ready answers 503 until it is done"""
+    from app import warmup
+    warmup.start()
@@ -0,0 +1,212 @@
+"""
+Layout templates for known ID card designs, with field-cropped OCR.
+
+Most uploads are one of a few card designs with the fields always in the
+same place. A template names the fields of one design as boxes on a
+reference image. An upload is registered against the templates on a
+thumbnail: ORB keypoints, ratio-tested matches and a RANSAC homography.
+When a template fits, each field box is warped out of the full-resolution
+page and read with a single-line Tesseract pass under the field's profile,
+instead of OCRing the whole page.
+
+Templates live in a directory, one JSON file each, next to the reference
+image it names:
+
+    {
+      "name": "test-document",
+      "reference": "test-document.png",
+      "fields": {
+        "last_name": {"box": [0.20, 0.27, 0.60, 0.33], "profile": "name"},
+        "student_id": {"box": [0.20, 0.40, 0.58, 0.46], "profile": "id"}
+      }
+    }
+
+Boxes are [left, top, right, bottom] as fractions of the reference image.
+profile is a key of ocr_profiles.PROFILES (or null), and psm (default 7,
+a single line) the Tesseract page segmentation mode for the field.
+"""
+import os
+import json
+import time
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from ocr_engine import OcrResult, image_to_lines
+from ocr_profiles import PROFILES, with_profile
+
+logger = logging.getLogger(__name__)
+
+# Longest side of the thumbnails keypoints are found on
+MATCH_SIZE = 640
+ORB_FEATURES = 1500
+
+# Lowe's ratio test: best match must be this much closer than the second best
+MATCH_RATIO = 0.75
+
+# RANSAC inliers a template needs before its layout is trusted
+MIN_INLIERS = 40
+
+# Reprojection error, in thumbnail pixels, for a match to count as an inlier
+RANSAC_THRESHOLD = 4.0
+
+# The matched card must cover at least this share of the page thumbnail
+MIN_CARD_AREA = 0.05
+
+# Field crops shorter than this are upscaled; Tesseract reads ~30 px text best
+MIN_FIELD_HEIGHT = 64
+
+Field = namedtuple('Field', ['name', 'box', 'profile', 'psm'])
+LayoutMatch = namedtuple('LayoutMatch', ['template', 'to_page', 'inliers', 'seconds'])
+
+
+def _thumbnail(gray):
+    """(thumbnail, scale) of a grayscale array, longest side at most MATCH_SIZE"""
+    scale = min(1.0, MATCH_SIZE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray, scale
+
+
+class LayoutTemplate:
+    """Field boxes of one card design and the keypoints of its reference image"""
+
+    def __init__(self, name, reference, fields):
+        self.name = name
+        self.fields = fields
+        self.size = (reference.shape[1], reference.shape[0])
+        thumb, _ = _thumbnail(reference)
+        self.thumb_size = (thumb.shape[1], thumb.shape[0])
+        self.keypoints, self.descriptors = cv2.ORB_create(ORB_FEATURES).detectAndCompute(thumb, None)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+        reference_path = os.path.join(os.path.dirname(path), spec['reference'])
+        with Image.open(reference_path) as image:
+            reference = np.asarray(image.convert('L'))
+        fields = []
+        for name, field in spec['fields'].items():
+            left, top, right, bottom = field['box']
+            if not 0 <= left < right <= 1 or not 0 <= top < bottom <= 1:
+                raise ValueError(f"Field {name} of {path} needs a box inside [0, 1]")
+            if field.get('profile') is not None and field['profile'] not in PROFILES:
+                raise ValueError(f"Field {name} of {path} has unknown profile {field['profile']!r}")
+            fields.append(Field(name, (left, top, right, bottom), field.get('profile'), int(field.get('psm', 7))))
+        return cls(spec.get('name') or os.path.splitext(os.path.basename(path))[0], reference, fields)
+
+
+class LayoutRegistry:
+    """The templates of a directory, matched against incoming pages"""
+
+    def __init__(self, root=None, min_inliers=MIN_INLIERS, enabled=True):
+        self.min_inliers = min_inliers
+        self.enabled = enabled
+        self.templates = []
+        self._matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        if root and os.path.isdir(root):
+            for filename in sorted(os.listdir(root)):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    self.templates.append(LayoutTemplate.from_file(os.path.join(root, filename)))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Could not load layout template {filename}: {str(e)}")
+        if self.templates:
+            logger.info(f"Loaded layout templates: {', '.join(t.name for t in self.templates)}")
+
+    def match(self, gray):
+        """LayoutMatch of the best-fitting template for a grayscale page, or None"""
+        if not self.enabled or not self.templates:
+            return None
+        began = time.perf_counter()
+        thumb, scale = _thumbnail(gray)
+        keypoints, descriptors = cv2.ORB_create(ORB_FEATURES).detectAndCompute(thumb, None)
+        if descriptors is None or len(keypoints) < self.min_inliers:
+            return None
+
+        best = None
+        for template in self.templates:
+            if template.descriptors is None:
+                continue
+            pairs = self._matcher.knnMatch(descriptors, template.descriptors, k=2)
+            good = [pair[0] for pair in pairs
+                    if len(pair) == 2 and pair[0].distance < MATCH_RATIO * pair[1].distance]
+            if len(good) < self.min_inliers:
+                continue
+            page_points = np.float32([keypoints[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
+            reference_points = np.float32([template.keypoints[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+            to_thumb, mask = cv2.findHomography(reference_points, page_points, cv2.RANSAC, RANSAC_THRESHOLD)
+            if to_thumb is None:
+                continue
+            inliers = int(mask.sum())
+            if inliers < self.min_inliers or (best is not None and inliers <= best[2]):
+                continue
+            # Reference fractions -> reference thumbnail -> page thumbnail -> page
+            to_page = (np.diag([1 / scale, 1 / scale, 1.0]) @ to_thumb @
+                       np.diag([template.thumb_size[0], template.thumb_size[1], 1.0]))
+            if not self._plausible(to_page, gray.shape):
+                continue
+            best = (template, to_page, inliers)
+
+        if best is None:
+            return None
+        return LayoutMatch(best[0], best[1], best[2], time.perf_counter() - began)
+
+    def _plausible(self, to_page, shape):
+        """Whether the card outline lands on the page as a convex, reasonably sized quad"""
+        corners = cv2.perspectiveTransform(np.float32([[[0, 0]], [[1, 0]], [[1, 1]], [[0, 1]]]), to_page)
+        if not cv2.isContourConvex(corners):
+            return False
+        return cv2.contourArea(corners) >= MIN_CARD_AREA * shape[0] * shape[1]
+
+
+def field_crop(gray, match, field):
+    """The field's box warped out of the page as an upright grayscale array"""
+    left, top, right, bottom = field.box
+    quad = cv2.perspectiveTransform(
+        np.float32([[[left, top]], [[right, top]], [[right, bottom]], [[left, bottom]]]), match.to_page
+    ).reshape(4, 2)
+    width = max(np.linalg.norm(quad[1] - quad[0]), np.linalg.norm(quad[2] - quad[3]))
+    height = max(np.linalg.norm(quad[3] - quad[0]), np.linalg.norm(quad[2] - quad[1]))
+    scale = max(1.0, MIN_FIELD_HEIGHT / max(height, 1.0))
+    width, height = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    return cv2.warpPerspective(gray, cv2.getPerspectiveTransform(quad, target), (width, height),
+                               flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def read_fields(gray, match, profiles=(), deadline=None):
+    """
+    OcrResult of reading only the template's field crops. profiles (from the
+    request) replace the template's default profile of the same name.
+    DeadlineExceeded propagates.
+    """
+    result = OcrResult()
+    by_name = {profile.name: profile for profile in profiles}
+    fields = {}
+    for step, field in enumerate(match.template.fields):
+        crop = field_crop(gray, match, field)
+        # Otsu on the crop alone copes with the colored bands cards print fields on
+        _, crop = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        profile = by_name.get(field.profile) or (PROFILES[field.profile]() if field.profile else None)
+        config = f'--oem 3 --psm {field.psm}'
+        try:
+            lines = image_to_lines(Image.fromarray(crop), with_profile(config, profile), deadline,
+                                   1.0 / (len(match.template.fields) - step))
+        except pytesseract.TesseractError as e:
+            logger.error(f"Tesseract error: {str(e)}")
+            lines = []
+        fields[field.name] = ' '.join(line.text for line in lines)
+        result.add_text(fields[field.name])
+        described = {'config': config, 'scope': 'field', 'field': field.name, 'scale': 1.0}
+        if profile is not None:
+            described['profile'] = profile.name
+        result.passes.append(described)
+    result.layout = {'template': match.template.name, 'inliers': match.inliers, 'fields': fields}
+    return result
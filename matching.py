@@ -0,0 +1,184 @@
+"""
+Approximate matching of ID numbers inside noisy OCR text.
+
+Tesseract regularly misreads look-alike glyphs (O/0, l/1, S/5, B/8), so an
+exact substring check misses IDs that are plainly on the page. Both the ID
+and the OCR text are folded onto a confusion-free alphabet first, which makes
+those substitutions free, and the remaining differences are searched with a
+bit-parallel Bitap (Wu-Manber) scan bounded by a maximum edit distance.
+"""
+import re
+from collections import namedtuple
+
+# Look-alike glyphs folded onto one representative; substituting one for
+# another inside a class costs nothing
+OCR_CONFUSION_CLASSES = {
+    '0': 'oOQ',
+    '1': 'iIlL|!',
+    '2': 'zZ',
+    '5': 'sS',
+    '6': 'gG',
+    '8': 'bB',
+}
+
+_FOLD_TABLE = {ord(c): c.lower() for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'}
+for _canonical, _variants in OCR_CONFUSION_CLASSES.items():
+    for _variant in _variants:
+        _FOLD_TABLE[ord(_variant)] = _canonical
+
+# A run of separators holding whitespace is a word break; other separators
+# (hyphens, dots, slashes) are dropped
+_BREAK = r'[^a-z0-9]*\s[^a-z0-9]*'
+_PUNCTUATION = r'[^a-z0-9\s]*'
+_PUNCTUATION_RUN = re.compile(r'[^a-z0-9\s]+')
+
+IdMatch = namedtuple('IdMatch', ['start', 'end', 'distance', 'matched'])
+
+
+def fold_ocr_text(text):
+    """Fold case and OCR confusions; the result has the same length as text"""
+    return text.translate(_FOLD_TABLE)
+
+
+def _stream(folded):
+    """
+    Drop separators so '2021-004587' and '2021004587' read the same, but keep
+    each word break as one space: a match spanning a break the ID does not
+    have pays an edit for it
+    """
+    return ' '.join(_PUNCTUATION_RUN.sub('', folded).split())
+
+
+def _locate_in_text(folded, stream_slice):
+    """Find stream_slice in the folded text, allowing the separators _stream dropped"""
+    parts = [_BREAK if char == ' ' else re.escape(char) for char in stream_slice]
+    located = re.search(_PUNCTUATION.join(parts), folded)
+    return located.start(), located.end()
+
+
+def _bitap_best_end(pattern, text, max_distance):
+    """
+    Wu-Manber Bitap scan; returns (distance, end_index) of the best match
+    ending in text, or None when nothing is within max_distance
+    """
+    m = len(pattern)
+    full = (1 << m) - 1
+    accept = 1 << (m - 1)
+
+    masks = {}
+    for i, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << i)
+
+    # states[d] bit i: pattern[:i + 1] matches a suffix of the text read so
+    # far with at most d edits; d leading deletions are always possible
+    states = [(1 << d) - 1 for d in range(max_distance + 1)]
+    best = None
+
+    for position, char in enumerate(text):
+        mask = masks.get(char, 0)
+        previous = states[0]
+        states[0] = ((previous << 1) | 1) & mask
+        for d in range(1, max_distance + 1):
+            current = states[d]
+            states[d] = ((((current << 1) | 1) & mask)   # match
+                         | previous                        # extra text char
+                         | (((previous | states[d - 1]) << 1) | 1)  # substitution / missing char
+                         ) & full
+            previous = current
+
+        for d in range(max_distance + 1):
+            if states[d] & accept:
+                # An equally good match on the next character is the same
+                # occurrence read one glyph further; prefer the longer span
+                if best is None or d < best[0] or (d == best[0] and position == best[1] + 1):
+                    best = (d, position)
+                break
+
+        if best is not None and best[0] == 0:
+            break
+
+    return best
+
+
+def _match_start(pattern, text, end, distance):
+    """Recover where a match ending at text[end] starts (backwards alignment)"""
+    m = len(pattern)
+    window = text[max(0, end - m - distance + 1):end + 1][::-1]
+    reversed_pattern = pattern[::-1]
+
+    # Edit distance between the reversed pattern and each reversed window prefix
+    previous_row = list(range(len(window) + 1))
+    for i in range(1, m + 1):
+        row = [i] + [0] * len(window)
+        for j in range(1, len(window) + 1):
+            cost = 0 if reversed_pattern[i - 1] == window[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+        previous_row = row
+
+    span = min(range(len(window) + 1), key=lambda j: (previous_row[j], j))
+    return end - span + 1
+
+
+def find_id_match(id_number, text, max_distance=1):
+    """
+    Find the closest occurrence of id_number in OCR text.
+
+    Case, punctuation and OCR look-alikes are ignored; other differences,
+    including a word break the ID does not have, count as edits. At most
+    max_distance edits are accepted, and never more than a third of the ID.
+    Returns an IdMatch with positions into text, or None.
+    """
+    if not id_number or not text:
+        return None
+
+    pattern = _stream(fold_ocr_text(id_number))
+    if not pattern:
+        return None
+
+    folded = fold_ocr_text(text)
+    stream = _stream(folded)
+    m = len(pattern)
+    k = max(0, min(max_distance, (m - 1) // 3))
+
+    best = None
+    position = stream.find(pattern)
+    if position != -1:
+        best = (0, position, position + m - 1)
+    elif k:
+        # Pigeonhole filter: with k edits one of k + 1 pieces survives intact,
+        # so only windows around exact piece hits need the Bitap scan
+        piece_length = m // (k + 1)
+        windows = []
+        for piece_index in range(k + 1):
+            offset = piece_index * piece_length
+            piece = pattern[offset:offset + piece_length] if piece_index < k else pattern[offset:]
+            hit = stream.find(piece)
+            while hit != -1:
+                windows.append((max(0, hit - offset - k), hit - offset + m + k))
+                hit = stream.find(piece, hit + 1)
+
+        windows.sort()
+        merged = []
+        for lo, hi in windows:
+            if merged and lo <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+
+        for lo, hi in merged:
+            found = _bitap_best_end(pattern, stream[lo:hi], k)
+            if found is None:
+                continue
+            distance, end = found[0], lo + found[1]
+            if best is None or distance < best[0]:
+                best = (distance, _match_start(pattern, stream, end, distance), end)
+                if distance == 1:
+                    break
+
+    if best is None:
+        return None
+
+    # The first occurrence of the matched characters is an equally good match
+    distance, stream_start, stream_end = best
+    start, end = _locate_in_text(folded, stream[stream_start:stream_end + 1])
+    return IdMatch(start, end, distance, text[start:end])
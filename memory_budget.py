@@ -0,0 +1,225 @@
+"""
+Memory admission for OCR jobs.
+
+Before any pixel is decoded, an upload's header gives its width, height and
+bands. From those we estimate the job's peak memory: the decoded frame, its
+grayscale copy, the orientation-corrected copy, the resized stage outputs,
+the image handed to Tesseract and the Tesseract process itself. Images over
+the pixel limit are rejected outright; other jobs are admitted only while
+the sum of running estimates fits the process's budget, and otherwise wait
+(briefly) for running jobs to finish.
+
+While jobs run, a sampler reads the process RSS so each job can report the
+peak it saw. RSS is process-wide: concurrent jobs show up in each other's
+peaks, so treat it as an upper bound for the request.
+"""
+import os
+import time
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+import preprocessing
+
+# Resized copies alive at once during the preprocessing chain
+STAGE_COPIES = 3
+
+# Rough Tesseract working set: per pixel of the page it reads, plus the model
+TESSERACT_BYTES_PER_PIXEL = 6
+TESSERACT_BASE_BYTES = 64 * 1024 * 1024
+
+# How often the RSS sampler runs while jobs are admitted
+RSS_INTERVAL = 0.05
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class ImageTooLarge(ValueError):
+    """The image can never fit: over the pixel limit or the whole budget"""
+
+
+class MemoryBudgetExhausted(RuntimeError):
+    """The job would fit, but not while the jobs already running hold the budget"""
+
+
+def default_budget_bytes(workers=1, reserved=0):
+    """
+    Half of the container's memory limit (or of RAM), split between server
+    workers, less the reserved bytes each worker holds outside OCR jobs
+    (such as its stage cache)
+    """
+    limit = None
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value.isdigit() and int(value) < 1 << 60:
+                limit = int(value)
+                break
+        except OSError:
+            continue
+    if limit is None:
+        try:
+            limit = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            limit = 2 * 1024 * 1024 * 1024
+    return max(0, limit // 2 // max(1, workers) - reserved)
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def estimate_page_bytes(width, height, bands):
+    """Peak bytes to preprocess and OCR one width x height page with bands channels"""
+    pixels = width * height
+    # Orientation correction may turn the page a quarter before the resize,
+    # so budget for whichever way round is taller; the width is read on each
+    # call so a changed preprocessing.BASE_WIDTH is honoured
+    base_width = preprocessing.BASE_WIDTH
+    long_side, short_side = max(width, height), max(1, min(width, height))
+    scaled = base_width * max(1, int(long_side * base_width / float(short_side)))
+    return (
+        pixels * bands               # decoded frame
+        + pixels * 2                 # grayscale and orientation-corrected copies
+        + scaled * STAGE_COPIES      # resize and threshold outputs
+        + scaled                     # page handed to Tesseract
+        + scaled * TESSERACT_BYTES_PER_PIXEL + TESSERACT_BASE_BYTES
+    )
+
+
+class Admission:
+    """One admitted job's reservation and the RSS peak seen while it ran"""
+
+    def __init__(self, budget, estimated):
+        self.budget = budget
+        self.estimated = estimated
+        self.waited = 0.0
+        self.rss_start = None
+        self.rss_peak = None
+
+    def observe(self, rss):
+        if self.rss_start is None:
+            self.rss_start = rss
+        self.rss_peak = rss if self.rss_peak is None else max(self.rss_peak, rss)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.budget._release(self)
+        return False
+
+    def report(self):
+        return {
+            'estimated_bytes': self.estimated,
+            'admission_wait_ms': int(self.waited * 1000),
+            'peak_rss_bytes': self.rss_peak,
+            'peak_rss_growth_bytes': self.rss_peak - self.rss_start if self.rss_peak is not None else None,
+        }
+
+
+class MemoryBudget:
+    """Admits jobs while the sum of their estimated peaks fits total_bytes"""
+
+    def __init__(self, total_bytes, max_pixels, wait=10.0):
+        self.total_bytes = total_bytes
+        self.max_pixels = max_pixels
+        self.wait = wait
+        self._reserved = 0
+        self._active = []
+        self._cond = threading.Condition()
+        self._sampler = None
+
+    def estimate(self, data):
+        """
+        Estimated peak bytes for OCR of an upload, from its header only.
+        Raises ImageTooLarge for images over the pixel limit or the budget.
+        """
+        return self._estimate(BytesIO(data), len(data))
+
+    def estimate_file(self, path):
+        """estimate() for an upload on disk, reading only its header"""
+        with open(path, 'rb') as f:
+            return self._estimate(f, os.fstat(f.fileno()).st_size)
+
+    def _estimate(self, fp, size):
+        try:
+            with Image.open(fp) as image:
+                width, height = image.size
+                bands = len(image.getbands())
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(str(e))
+        if width * height > self.max_pixels:
+            raise ImageTooLarge(f"Image is {width}x{height} ({width * height:,} pixels); "
+                                f"the limit is {self.max_pixels:,} pixels")
+        # Pages are processed one at a time; the request body is held throughout
+        estimated = estimate_page_bytes(width, height, bands) + size
+        if estimated > self.total_bytes:
+            raise ImageTooLarge(f"Image {width}x{height} needs about {estimated // (1024 * 1024)} MB to process; "
+                                f"the limit is {self.total_bytes // (1024 * 1024)} MB")
+        return estimated
+
+    def admit(self, estimated):
+        """
+        Reserve estimated bytes, waiting up to self.wait seconds for room.
+        Use the returned Admission as a context manager to release it.
+        """
+        admission = Admission(self, estimated)
+        started = time.monotonic()
+        with self._cond:
+            while self._reserved + estimated > self.total_bytes:
+                remaining = self.wait - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise MemoryBudgetExhausted(
+                        f"Server is busy: {self._reserved // (1024 * 1024)} MB of "
+                        f"{self.total_bytes // (1024 * 1024)} MB reserved")
+                self._cond.wait(remaining)
+            self._reserved += estimated
+            self._active.append(admission)
+            self._ensure_sampler()
+        admission.waited = time.monotonic() - started
+        rss = current_rss()
+        if rss is not None:
+            admission.observe(rss)
+        return admission
+
+    def _release(self, admission):
+        rss = current_rss()
+        with self._cond:
+            if rss is not None:
+                admission.observe(rss)
+            self._reserved -= admission.estimated
+            self._active.remove(admission)
+            self._cond.notify_all()
+
+    def _ensure_sampler(self):
+        # Called with the lock held; the sampler exits once no job is active
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        while True:
+            rss = current_rss()
+            with self._cond:
+                if not self._active or rss is None:
+                    self._sampler = None
+                    return
+                for admission in self._active:
+                    admission.observe(rss)
+            time.sleep(RSS_INTERVAL)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'total_bytes': self.total_bytes,
+                'reserved_bytes': self._reserved,
+                'jobs': len(self._active),
+            }
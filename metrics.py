@@ -0,0 +1,44 @@
+"""
+In-process counters and timings, exposed as JSON at /metrics.
+"""
+import threading
+
+
+class Metrics:
+    """Thread-safe counters and duration summaries"""
+
+    def __init__(self):
+        self._counters = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """Record one duration (in seconds) under name"""
+        with self._lock:
+            timing = self._timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+
+    def mean(self, name):
+        """Mean of the durations recorded under name, or 0.0 before the first"""
+        with self._lock:
+            timing = self._timings.get(name)
+            return timing['total'] / timing['count'] if timing else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': {
+                    name: dict(timing, mean=timing['total'] / timing['count'])
+                    for name, timing in self._timings.items()
+                }
+            }
+
+
+metrics = Metrics()
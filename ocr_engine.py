@@ -0,0 +1,381 @@
+"""
+Tesseract engine layer: word boxes with confidences and targeted re-OCR.
+
+The first pass reads the whole page with image_to_data, which gives us every
+word with its box and confidence. Follow-up passes only run while the caller's
+fields are still missing, and they re-read just the low-confidence lines
+(cropped, with a single-line PSM and optionally upscaled) instead of sending
+the full 2000 px page through Tesseract again.
+
+Very tall pages (full A4 scans) are split into overlapping horizontal strips
+cut along blank rows, and each full-page pass reads the strips in parallel;
+Tesseract is single-threaded per call, so this spreads one page over all
+cores and keeps each process's memory bounded by the strip size.
+"""
+import os
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from deadline import DeadlineExceeded, call_tesseract
+from ocr_profiles import with_profile
+
+logger = logging.getLogger(__name__)
+
+# Full-page pass that every request pays for
+PRIMARY_PASS = r'--oem 3 --psm 6'  # Assume a single uniform block of text
+
+# Follow-up passes over weak line crops: (config, scale)
+REFINE_PASSES = [
+    (r'--oem 3 --psm 7', 1.0),  # Treat each weak line as a single text line
+    (r'--oem 3 --psm 7', 2.0),  # Same, upscaled for small print
+]
+
+# Full-page passes used only when the primary pass left no weak lines to retry
+FALLBACK_PASSES = [
+    r'--oem 3 --psm 4',  # Assume a single column of text of variable sizes
+    r'--oem 3 --psm 11',  # Sparse text with OSD
+]
+
+# Full-page pass used with a field profile when there are no weak lines to
+# retry; sparse-text mode finds isolated fields such as an ID number
+PROFILE_PAGE_PASS = r'--oem 3 --psm 11'
+
+# Lines whose mean word confidence falls below this are re-read on a miss
+LOW_CONFIDENCE = 60
+
+# Pixels of context kept around a line box when cropping it
+LINE_PADDING = 8
+
+# Share of the remaining request budget the primary pass may use; the rest
+# is split evenly across the follow-up passes
+PRIMARY_SHARE = 0.6
+
+# Pages taller than this are read in strips of about STRIP_HEIGHT rows, cut
+# at the emptiest row within GAP_SEARCH of each nominal boundary and padded
+# by STRIP_OVERLAP rows on either side
+TILE_MIN_HEIGHT = 3000
+STRIP_HEIGHT = 1200
+GAP_SEARCH = 200
+STRIP_OVERLAP = 48
+
+# Tesseract processes reading strips at once in this process (the app sets
+# this from OCR_TILE_WORKERS before the pool starts)
+TILE_WORKERS = os.cpu_count() or 1
+
+Word = namedtuple('Word', ['text', 'conf', 'left', 'top', 'width', 'height'])
+Line = namedtuple('Line', ['text', 'conf', 'left', 'top', 'width', 'height', 'words'])
+# Rows of a page read together; core_top:core_bottom excludes the overlap
+Strip = namedtuple('Strip', ['top', 'bottom', 'core_top', 'core_bottom'])
+
+
+class OcrResult:
+    """Text and layout collected across the passes run for one image"""
+
+    def __init__(self):
+        self.texts = []    # One entry per pass that produced text
+        self.lines = []    # Line boxes from the primary pass, refined in place
+        self.passes = []   # Description of every pass that ran
+        self.skipped = []  # Passes cut short by the deadline or a disconnect
+        self.preprocess = []  # Timing of each preprocessing stage for the page
+        self.rejected = None  # Quality gate verdict when the page was not OCRed
+        self.layout = None  # Template and field readings when only field crops were read
+
+    def add_text(self, text):
+        text = text.strip()
+        if text:
+            self.texts.append(text)
+
+    @property
+    def weak_lines(self):
+        return [line for line in self.lines if line.conf < LOW_CONFIDENCE]
+
+    def skip(self, passes, reason):
+        """Record passes, as (scope, config, scale[, profile]), that did not run"""
+        for scope, config, scale, *profile in passes:
+            entry = {'config': config, 'scope': scope, 'scale': scale, 'reason': reason}
+            if profile and profile[0] is not None:
+                entry['profile'] = profile[0].name
+            self.skipped.append(entry)
+
+    def to_dict(self):
+        """Structured form returned to clients that ask for it"""
+        return {
+            'rejected': self.rejected,
+            'layout': self.layout,
+            'preprocess': self.preprocess,
+            'passes': self.passes,
+            'skipped': self.skipped,
+            'lines': [
+                {
+                    'text': line.text,
+                    'conf': round(line.conf, 1),
+                    'box': [line.left, line.top, line.width, line.height],
+                    'words': [
+                        {
+                            'text': word.text,
+                            'conf': round(word.conf, 1),
+                            'box': [word.left, word.top, word.width, word.height]
+                        } for word in line.words
+                    ]
+                } for line in self.lines
+            ]
+        }
+
+
+def image_to_lines(image, config, deadline=None, share=1.0):
+    """Run image_to_data and group the recognised words into lines"""
+    data = call_tesseract(pytesseract.image_to_data, image, config, deadline, share,
+                          output_type=pytesseract.Output.DICT)
+
+    grouped = {}
+    for i, text in enumerate(data['text']):
+        text = (text or '').strip()
+        conf = float(data['conf'][i])
+        if not text or conf < 0:
+            continue
+        key = (data['page_num'][i], data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        grouped.setdefault(key, []).append(Word(
+            text, conf,
+            data['left'][i], data['top'][i], data['width'][i], data['height'][i]
+        ))
+
+    return [_make_line(words) for words in grouped.values()]
+
+
+def _make_line(words):
+    left = min(word.left for word in words)
+    top = min(word.top for word in words)
+    right = max(word.left + word.width for word in words)
+    bottom = max(word.top + word.height for word in words)
+    conf = sum(word.conf for word in words) / len(words)
+    return Line(' '.join(word.text for word in words), conf,
+                left, top, right - left, bottom - top, words)
+
+
+def _crop_line(image, line, scale):
+    box = (
+        max(0, line.left - LINE_PADDING),
+        max(0, line.top - LINE_PADDING),
+        min(image.width, line.left + line.width + LINE_PADDING),
+        min(image.height, line.top + line.height + LINE_PADDING),
+    )
+    crop = image.crop(box)
+    if scale != 1.0:
+        crop = crop.resize((int(crop.width * scale), int(crop.height * scale)),
+                           Image.Resampling.LANCZOS)
+    return crop
+
+
+_tile_executor = None
+_tile_lock = threading.Lock()
+
+
+def _parallel_map(fn, items):
+    """map() over a shared thread pool; each call mostly waits on a Tesseract process"""
+    global _tile_executor
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with _tile_lock:
+        if _tile_executor is None:
+            _tile_executor = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix='ocr-tile')
+    return list(_tile_executor.map(fn, items))
+
+
+def _blank_row_near(ink, target):
+    """Middle of the emptiest run of rows within GAP_SEARCH of target"""
+    lo = max(0, target - GAP_SEARCH)
+    window = ink[lo:target + GAP_SEARCH]
+    emptiest = np.flatnonzero(window == window.min())
+    start = end = emptiest[0]
+    while end + 1 < len(window) and window[end + 1] == window[start]:
+        end += 1
+    return lo + int((start + end) // 2)
+
+
+def split_strips(image):
+    """
+    Strips covering a binary page, cut along whitespace gaps found by row
+    projection; a single strip for pages of normal height
+    """
+    if image.height <= TILE_MIN_HEIGHT:
+        return [Strip(0, image.height, 0, image.height)]
+
+    ink = (np.asarray(image) < 128).sum(axis=1)
+    # Smooth so a cut lands between lines rather than inside a thin stroke gap
+    ink = np.convolve(ink, np.ones(9), mode='same')
+
+    cuts = [0]
+    while image.height - cuts[-1] > STRIP_HEIGHT + GAP_SEARCH:
+        cuts.append(_blank_row_near(ink, cuts[-1] + STRIP_HEIGHT))
+    cuts.append(image.height)
+    return [Strip(max(0, top - STRIP_OVERLAP), min(image.height, bottom + STRIP_OVERLAP), top, bottom)
+            for top, bottom in zip(cuts, cuts[1:])]
+
+
+def _shift_line(line, dy):
+    words = [word._replace(top=word.top + dy) for word in line.words]
+    return line._replace(top=line.top + dy, words=words)
+
+
+def page_lines(image, strips, config, deadline=None, share=1.0):
+    """
+    image_to_lines over every strip in parallel, stitched back into page
+    coordinates. Each line is kept by the strip whose core holds its centre,
+    so lines read twice (or cut in half) in an overlap appear once; a line
+    centred on a cut is dropped if the neighbouring strip already has it.
+    """
+    if len(strips) == 1:
+        return image_to_lines(image, config, deadline, share)
+
+    crops = [image.crop((0, strip.top, image.width, strip.bottom)) for strip in strips]
+    read = _parallel_map(lambda crop: image_to_lines(crop, config, deadline, share), crops)
+    lines = []
+    seen = set()
+    for strip, strip_lines in zip(strips, read):
+        strip_seen = set()
+        for line in strip_lines:
+            line = _shift_line(line, strip.top)
+            centre = line.top + line.height / 2.0
+            if not strip.core_top <= centre < strip.core_bottom:
+                continue
+            if abs(centre - strip.core_top) < line.height and line.text in seen:
+                continue
+            strip_seen.add(line.text)
+            lines.append(line)
+        # Only the neighbouring strip can overlap this one
+        seen = strip_seen
+    return lines
+
+
+def page_text(image, strips, config, deadline=None, share=1.0):
+    """Full-page text for a fallback pass, read strip by strip on tall pages"""
+    if len(strips) == 1:
+        return call_tesseract(pytesseract.image_to_string, image, config, deadline, share)
+    return '\n'.join(line.text for line in page_lines(image, strips, config, deadline, share))
+
+
+def reocr_line(image, line, config, scale=1.0, deadline=None, share=1.0):
+    """Re-read a single line box; returns the better of the old and new reading"""
+    reread = image_to_lines(_crop_line(image, line, scale), config, deadline, share)
+    if not reread:
+        return line
+
+    words = [word for candidate in reread for word in candidate.words]
+    conf = sum(word.conf for word in words) / len(words)
+    if conf <= line.conf:
+        return line
+    # Keep page coordinates so the structured result stays consistent
+    return line._replace(text=' '.join(word.text for word in words), conf=conf)
+
+
+def recognize(image, is_satisfied=None, deadline=None, profiles=()):
+    """
+    OCR an image, spending extra passes only while they are needed.
+
+    is_satisfied(text) is called with the text gathered so far after every
+    pass; once it returns True no further passes run. Without it, weak lines
+    are still refined, but the full-page fallback passes only run when the
+    primary pass read nothing at all.
+
+    profiles (see ocr_profiles) replace the general follow-up pass with the
+    same configuration: their readings are added as candidate text for
+    is_satisfied but never replace the general reading of a line, so weak
+    lines keep their primary-pass text when profiles are given.
+
+    With a deadline, each pass gets its share of the remaining budget; when
+    the budget runs out or the client disconnects, the text read so far is
+    returned and the passes that did not run are listed in result.skipped.
+    TesseractNotFoundError propagates so the caller can re-detect Tesseract.
+    """
+    result = OcrResult()
+    strips = split_strips(image)
+
+    def done():
+        return is_satisfied is not None and is_satisfied('\n'.join(result.texts))
+
+    def page_pass(config, profile=None):
+        described = {'config': config, 'scope': 'page', 'scale': 1.0}
+        if profile is not None:
+            described['profile'] = profile.name
+        if len(strips) > 1:
+            described['strips'] = len(strips)
+        return described
+
+    try:
+        result.lines = page_lines(image, strips, PRIMARY_PASS, deadline, PRIMARY_SHARE)
+        result.add_text('\n'.join(line.text for line in result.lines))
+        result.passes.append(page_pass(PRIMARY_PASS))
+    except pytesseract.TesseractError as e:
+        logger.error(f"Tesseract error: {str(e)}")
+    except DeadlineExceeded as e:
+        result.skip([('page', PRIMARY_PASS, 1.0)], e.reason)
+        return result
+
+    if done():
+        return result
+
+    if result.weak_lines:
+        # Each refine pass runs once per profile in place of its general reading
+        plan = [('lines', config, scale, profile) for config, scale in REFINE_PASSES
+                for profile in (profiles or [None])]
+    elif is_satisfied is None and result.texts:
+        plan = []
+    else:
+        plan = [('page', PROFILE_PAGE_PASS, 1.0, profile) for profile in profiles]
+        plan += [('page', config, 1.0, None) for config in FALLBACK_PASSES
+                 if not (profiles and config == PROFILE_PAGE_PASS)]
+
+    for step, (scope, config, scale, profile) in enumerate(plan):
+        share = 1.0 / (len(plan) - step)
+        try:
+            if scope == 'lines':
+                weak = [i for i, line in enumerate(result.lines) if line.conf < LOW_CONFIDENCE]
+                if not weak:
+                    break
+
+                def refine(i, config=with_profile(config, profile), scale=scale, share=share,
+                           profile=profile):
+                    try:
+                        if profile is not None:
+                            crop = _crop_line(image, result.lines[i], scale)
+                            reread = image_to_lines(crop, config, deadline, share)
+                            return None, ' '.join(line.text for line in reread)
+                        line = reocr_line(image, result.lines[i], config, scale, deadline, share)
+                        return line, line.text
+                    except pytesseract.TesseractError as e:
+                        logger.error(f"Tesseract error: {str(e)}")
+                        return None, ''
+
+                refined = []
+                for i, (line, text) in zip(weak, _parallel_map(refine, weak)):
+                    if line is not None:
+                        result.lines[i] = line
+                    if text:
+                        refined.append(text)
+                result.add_text('\n'.join(refined))
+                described = {'config': config, 'scope': 'lines', 'scale': scale, 'lines': len(weak)}
+                if profile is not None:
+                    described['profile'] = profile.name
+                result.passes.append(described)
+            else:
+                try:
+                    result.add_text(page_text(image, strips, with_profile(config, profile),
+                                              deadline, share))
+                    result.passes.append(page_pass(config, profile))
+                except pytesseract.TesseractError as e:
+                    logger.error(f"Tesseract error: {str(e)}")
+                    continue
+        except DeadlineExceeded as e:
+            result.skip(plan[step:], e.reason)
+            return result
+
+        if done():
+            break
+
+    return result
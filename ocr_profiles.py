@@ -0,0 +1,107 @@
+"""
+Field-specific Tesseract profiles.
+
+The general passes read with the full English dictionary and character set,
+which is the wrong prior for a student ID ("2O21-OO4587") and an unhelpful
+one for surnames. A profile adds Tesseract options for one kind of field:
+the ID profile whitelists the characters an ID can contain, turns the word
+dictionaries off and supplies user-patterns built from our ID formats; the
+name profile supplies the expected name as user-words. Profile passes add
+candidate text for matching; they never replace the general reading.
+"""
+import os
+import re
+import shlex
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+
+# Tesseract user-patterns for the ID formats we issue (\d digit, \c letter)
+ID_PATTERNS = [
+    r'\d\d\d\d-\d\d\d\d\d\d',
+    r'\d\d\d\d\d\d\d\d\d\d',
+]
+
+ID_CHARS = '0123456789-'
+NAME_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-'.,"
+
+# Word and pattern lists are written once per content and reused
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'tes_ocr_profiles')
+
+OcrProfile = namedtuple('OcrProfile', ['name', 'flags'])
+
+_write_lock = threading.Lock()
+
+
+def _list_file(kind, lines):
+    """Path of a file holding lines, named by its content"""
+    content = '\n'.join(lines) + '\n'
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(PROFILE_DIR, f"{kind}-{digest}.txt")
+    if not os.path.exists(path):
+        with _write_lock:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+    return path
+
+
+def id_pattern(id_number):
+    """Tesseract user-pattern matching the shape of an ID, e.g. 2021-0045 -> \\d\\d\\d\\d-\\d\\d\\d\\d"""
+    pattern = []
+    for char in id_number.strip():
+        if char.isdigit():
+            pattern.append(r'\d')
+        elif char.isalpha():
+            pattern.append(r'\c')
+        elif char == '\\':
+            pattern.append(r'\\')
+        elif not char.isspace():
+            pattern.append(char)
+    return ''.join(pattern)
+
+
+def id_profile(id_number=None, patterns=None):
+    """Digits (plus any letters the ID uses), no dictionaries, ID-shaped patterns"""
+    patterns = list(patterns if patterns is not None else ID_PATTERNS)
+    chars = ID_CHARS
+    if id_number:
+        letters = sorted({char.upper() for char in id_number if char.isalpha()})
+        chars += ''.join(letters)
+        shape = id_pattern(id_number)
+        if shape and shape not in patterns:
+            patterns.append(shape)
+
+    flags = [
+        f'-c tessedit_char_whitelist={chars}',
+        '-c load_system_dawg=0',
+        '-c load_freq_dawg=0',
+    ]
+    if patterns:
+        flags.append(f'--user-patterns {_list_file("patterns", patterns)}')
+    return OcrProfile('id', ' '.join(flags))
+
+
+def name_profile(name=None):
+    """Letters and name punctuation, with the expected name as user-words"""
+    # Quoted: pytesseract shlex-splits the config, and the apostrophe would open a quote
+    flags = [f"-c {shlex.quote('tessedit_char_whitelist=' + NAME_CHARS)}", '-c load_freq_dawg=0']
+    words = [word for word in re.split(r'[^\w\'-]+', name or '') if len(word) > 1]
+    if words:
+        variants = sorted({form for word in words for form in (word, word.upper(), word.capitalize())})
+        flags.append(f'--user-words {_list_file("words", variants)}')
+    return OcrProfile('name', ' '.join(flags))
+
+
+PROFILES = {
+    'id': id_profile,
+    'name': name_profile,
+}
+
+
+def with_profile(config, profile):
+    """Tesseract config string for a pass run under profile (None: unchanged)"""
+    return f'{config} {profile.flags}' if profile is not None else config
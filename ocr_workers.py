@@ -0,0 +1,186 @@
+"""
+OCR in worker processes with a shared-memory image hand-off.
+
+Pickling a 2000xH page through a pipe for every job costs about as much as
+thresholding it. Instead, the dispatcher leases a segment from a pool of
+multiprocessing.shared_memory blocks, the binarized page is copied into it
+locally, and the worker receives only the segment name, shape and dtype.
+Segments are recycled by size class, so steady-state traffic neither copies
+image bytes between processes nor creates new segments.
+"""
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from deadline import Deadline
+from ocr_engine import recognize
+
+logger = logging.getLogger(__name__)
+
+# Segments are sized in powers of two from this up, so pages of similar size
+# share a class and a segment can serve any page that fits in it
+MIN_SEGMENT_BYTES = 1024 * 1024
+
+# Idle segments kept per size class; beyond that they are unlinked
+MAX_FREE_PER_CLASS = 4
+
+# What the worker needs to map a page: no pixel data crosses the pipe
+SharedImage = namedtuple('SharedImage', ['name', 'shape', 'dtype'])
+
+
+def _size_class(nbytes):
+    size = MIN_SEGMENT_BYTES
+    while size < nbytes:
+        size *= 2
+    return size
+
+
+class SegmentPool:
+    """Recycled shared-memory segments, owned by the dispatching process"""
+
+    def __init__(self, max_free_per_class=MAX_FREE_PER_CLASS):
+        self.max_free_per_class = max_free_per_class
+        self._free = {}  # size class -> [SharedMemory]
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self, nbytes):
+        size = _size_class(nbytes)
+        with self._lock:
+            free = self._free.get(size)
+            if free:
+                return free.pop()
+            self.created += 1
+        return shared_memory.SharedMemory(create=True, size=size)
+
+    def release(self, segment):
+        with self._lock:
+            free = self._free.setdefault(segment.size, [])
+            if len(free) < self.max_free_per_class:
+                free.append(segment)
+                return
+        self._destroy(segment)
+
+    def close(self):
+        with self._lock:
+            segments = [segment for free in self._free.values() for segment in free]
+            self._free.clear()
+        for segment in segments:
+            self._destroy(segment)
+
+    @staticmethod
+    def _destroy(segment):
+        try:
+            segment.close()
+            segment.unlink()
+        except (BufferError, FileNotFoundError) as e:
+            logger.warning(f"Could not remove shared memory segment {segment.name}: {str(e)}")
+
+
+class PageLease:
+    """
+    One page's shared-memory buffer for the length of a with-block. Pass
+    allocate as the output allocator to preprocessing, then hand the lease
+    to OcrWorkerPool.recognize.
+    """
+
+    def __init__(self, segments):
+        self._segments = segments
+        self.segment = None
+        self.handle = None
+
+    def allocate(self, shape, dtype):
+        if self.segment is not None:
+            raise RuntimeError('Page buffer already allocated')
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        self.segment = self._segments.acquire(nbytes)
+        self.handle = SharedImage(self.segment.name, tuple(shape), dtype.str)
+        return np.ndarray(shape, dtype=dtype, buffer=self.segment.buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.segment is not None:
+            self._segments.release(self.segment)
+            self.segment = None
+        return False
+
+
+def _recognize_shared(handle, is_satisfied, budget, tesseract_cmd, profiles=()):
+    """Worker side: map the page, OCR it, detach. Returns (OcrResult, error)"""
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    segment = shared_memory.SharedMemory(name=handle.name)
+    try:
+        array = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=segment.buf)
+        image = Image.fromarray(array)
+        deadline = Deadline(budget) if budget is not None else None
+        try:
+            return recognize(image, is_satisfied, deadline, profiles), None
+        except pytesseract.TesseractNotFoundError:
+            # Not picklable as-is; the dispatcher raises it again
+            return None, 'tesseract_not_found'
+        finally:
+            del image, array
+    finally:
+        segment.close()
+
+
+class OcrWorkerPool:
+    """Process pool that OCRs pages leased from a shared SegmentPool"""
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.segments = SegmentPool()
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        """Start the workers once per process (safe across gunicorn's fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Workers must not be forked from a multi-threaded server process
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            self.segments = SegmentPool()
+            self._pid = os.getpid()
+
+    def lease(self):
+        self._ensure_started()
+        return PageLease(self.segments)
+
+    def recognize(self, lease, is_satisfied=None, deadline=None, profiles=()):
+        """
+        OCR a leased page in a worker. is_satisfied must be picklable. The
+        worker gets the request's remaining budget; cancellation on client
+        disconnect only takes effect between pages.
+        """
+        budget = deadline.remaining() if deadline is not None else None
+        future = self._executor.submit(_recognize_shared, lease.handle, is_satisfied, budget,
+                                       pytesseract.pytesseract.tesseract_cmd, profiles)
+        result, error = future.result()
+        if error == 'tesseract_not_found':
+            raise pytesseract.TesseractNotFoundError()
+        return result
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        self._executor.shutdown(wait=False)
+        self.segments.close()
@@ -0,0 +1,412 @@
+"""
+Image preprocessing shared by the OCR endpoints.
+
+Before thresholding, every image goes through a cheap orientation pass: EXIF
+rotation is applied first, then a downscaled copy is used to decide whether
+the text runs sideways or upside down and how far it is skewed, using ink
+projection profiles. Only when the profiles are ambiguous do we ask
+Tesseract's OSD. Decisions are cached by image hash so retries of the same
+upload skip the estimate entirely.
+
+The steps after decoding form a chain of named stages (see STAGES and
+CHAINS). Each stage's output is memoized by image hash plus the chain prefix
+that produced it, so chains sharing their first stages compute them once,
+and every stage is timed.
+"""
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps
+
+from deadline import call_tesseract
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Width every page is resized to before OCR
+BASE_WIDTH = 2000
+
+# Longest side of the copy used for orientation and skew estimates
+THUMBNAIL_SIZE = 600
+
+# Skew search range and resolution, in degrees
+MAX_SKEW = 10.0
+COARSE_SKEW_STEP = 1.0
+FINE_SKEW_STEP = 0.2
+
+# Row profile must beat the column profile by this factor (or vice versa)
+# before we trust it to tell horizontal from vertical text
+ORIENTATION_RATIO = 1.2
+
+# Minimum ascender/descender imbalance needed to call a page upright or flipped
+UPRIGHT_MARGIN = 0.15
+
+# Orientation decisions kept per image hash
+ORIENTATION_CACHE_SIZE = 1024
+
+# Share of the remaining request budget an OSD call may use; most of it is
+# kept for the OCR passes
+OSD_SHARE = 0.2
+
+# Bytes of intermediate stage outputs kept for reuse across requests (per
+# process; the app reads STAGE_CACHE_BYTES from the environment)
+STAGE_CACHE_BYTES = 32 * 1024 * 1024
+
+Orientation = namedtuple('Orientation', ['rotate', 'skew', 'source'])
+
+_orientation_cache = OrderedDict()
+_orientation_lock = threading.Lock()
+
+
+def _cached_orientation(image_key):
+    if image_key is None:
+        return None
+    with _orientation_lock:
+        orientation = _orientation_cache.get(image_key)
+        if orientation is not None:
+            _orientation_cache.move_to_end(image_key)
+        return orientation
+
+
+def _cache_orientation(image_key, orientation):
+    if image_key is None:
+        return
+    with _orientation_lock:
+        _orientation_cache[image_key] = orientation
+        _orientation_cache.move_to_end(image_key)
+        while len(_orientation_cache) > ORIENTATION_CACHE_SIZE:
+            _orientation_cache.popitem(last=False)
+
+
+def _ink_mask(gray):
+    """Binarise a thumbnail so that text pixels are 1 and paper is 0"""
+    _, mask = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return mask
+
+
+def _profile_score(profile):
+    """Sharpness of a projection profile; high when lines and gaps alternate"""
+    profile = profile.astype(np.float64)
+    return float(np.sum(np.diff(profile) ** 2))
+
+
+def _rotate_small(mask, angle):
+    """Rotate a thumbnail by a small angle (degrees, counter-clockwise)"""
+    h, w = mask.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(mask, matrix, (w, h), flags=cv2.INTER_NEAREST, borderValue=0)
+
+
+def _estimate_skew(mask):
+    """
+    Angle that makes text lines horizontal, by maximising row-profile
+    sharpness; returns (angle, score)
+    """
+    def best_in(angles):
+        scored = [(_profile_score(_rotate_small(mask, a).sum(axis=1)), a) for a in angles]
+        return max(scored)
+
+    _, coarse = best_in(np.arange(-MAX_SKEW, MAX_SKEW + COARSE_SKEW_STEP, COARSE_SKEW_STEP))
+    score, fine = best_in(np.arange(coarse - COARSE_SKEW_STEP,
+                                    coarse + COARSE_SKEW_STEP + FINE_SKEW_STEP, FINE_SKEW_STEP))
+    return float(round(fine, 2)) + 0.0, score
+
+
+def _upright_score(mask):
+    """
+    Positive for upright Latin text, negative when upside down.
+
+    Ascenders and capitals are more common than descenders, so within each
+    text line more ink sits above the dense x-height band than below it.
+    The outermost row of each line is left out: on a thumbnail it is mostly
+    anti-aliasing, and on all-caps lines it alone would decide the sign.
+    """
+    rows = mask.sum(axis=1).astype(np.float64)
+    if not rows.any():
+        return 0.0
+
+    in_line = rows > rows.max() * 0.05
+    above = below = 0.0
+    start = None
+    for y, inside in enumerate(np.append(in_line, False)):
+        if inside and start is None:
+            start = y
+        elif not inside and start is not None:
+            band = rows[start:y]
+            core = np.nonzero(band >= band.max() * 0.5)[0]
+            above += band[1:core[0]].sum()
+            below += band[core[-1] + 1:-1].sum()
+            start = None
+
+    total = above + below
+    return (above - below) / total if total else 0.0
+
+
+def _osd_orientation(gray, deadline=None):
+    """Ask Tesseract's orientation and script detection; 0 on failure"""
+    try:
+        osd = call_tesseract(pytesseract.image_to_osd, Image.fromarray(gray), '--psm 0',
+                             deadline, OSD_SHARE)
+        match = re.search(r'Rotate:\s*(\d+)', osd)
+        return int(match.group(1)) % 360 if match else 0
+    except pytesseract.TesseractError as e:
+        logger.info(f"OSD unavailable, assuming upright: {str(e)}")
+        return 0
+
+
+def _rotate_quadrant(array, rotate):
+    """Rotate clockwise by a multiple of 90 degrees"""
+    if rotate == 90:
+        return cv2.rotate(array, cv2.ROTATE_90_CLOCKWISE)
+    if rotate == 180:
+        return cv2.rotate(array, cv2.ROTATE_180)
+    if rotate == 270:
+        return cv2.rotate(array, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return array
+
+
+def estimate_orientation(gray, deadline=None):
+    """
+    Decide the clockwise rotation (0/90/180/270) and residual skew that make
+    the text in a grayscale page upright and horizontal. An OSD call cut
+    short by the deadline raises DeadlineExceeded rather than guessing.
+    """
+    scale = THUMBNAIL_SIZE / float(max(gray.shape))
+    thumb = gray if scale >= 1 else cv2.resize(gray, None, fx=scale, fy=scale,
+                                               interpolation=cv2.INTER_AREA)
+    mask = _ink_mask(thumb)
+    if not mask.any():
+        return Orientation(0, 0.0, 'profile')
+
+    # Deskewed row profiles of the page as-is and turned a quarter: the one
+    # with sharper line/gap alternation has horizontal text lines
+    skew, rows = _estimate_skew(mask)
+    turned = _rotate_quadrant(mask, 90)
+    turned_skew, cols = _estimate_skew(turned)
+    if rows >= cols * ORIENTATION_RATIO:
+        rotate = 0
+    elif cols >= rows * ORIENTATION_RATIO:
+        rotate, skew, mask = 90, turned_skew, turned
+    else:
+        rotate = _osd_orientation(gray, deadline)
+        if rotate in (90, 270):
+            skew = turned_skew
+        return Orientation(rotate, skew, 'osd')
+
+    upright = _upright_score(_rotate_small(mask, skew))
+    if upright <= -UPRIGHT_MARGIN:
+        rotate += 180
+    elif upright < UPRIGHT_MARGIN:
+        # Direction is known but not which way up; let OSD settle it
+        osd_rotate = _osd_orientation(gray, deadline)
+        if osd_rotate in (rotate, rotate + 180):
+            rotate = osd_rotate
+        return Orientation(rotate, skew, 'osd')
+
+    return Orientation(rotate, skew, 'profile')
+
+
+def correct_orientation(gray, image_key=None, deadline=None):
+    """Rotate and deskew a grayscale page array; returns (array, Orientation)"""
+    orientation = _cached_orientation(image_key)
+    if orientation is None:
+        orientation = estimate_orientation(gray, deadline)
+        _cache_orientation(image_key, orientation)
+
+    gray = _rotate_quadrant(gray, orientation.rotate)
+    if abs(orientation.skew) >= FINE_SKEW_STEP:
+        h, w = gray.shape
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), orientation.skew, 1.0)
+        gray = cv2.warpAffine(gray, matrix, (w, h), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REPLICATE)
+    return gray, orientation
+
+
+def iter_frames(image):
+    """
+    Yield (index, frame) for every page of a multi-frame image (TIFF, GIF),
+    seeking lazily so only the frame being processed is ever decoded. The
+    same Image object is reused, so consume each frame before the next.
+    """
+    index = 0
+    while True:
+        try:
+            image.seek(index)
+        except (EOFError, ValueError):
+            return
+        yield index, image
+        index += 1
+
+
+# name -> fn(gray, image_key, deadline) returning a new uint8 array
+STAGES = {}
+
+
+def stage(name):
+    """Register a preprocessing stage under name"""
+    def register(fn):
+        STAGES[name] = fn
+        return fn
+    return register
+
+
+@stage('orient')
+def _orient_stage(gray, image_key, deadline):
+    gray, _ = correct_orientation(gray, image_key, deadline)
+    return gray
+
+
+@stage('resize')
+def _resize_stage(gray, image_key, deadline):
+    # Resize for better OCR
+    h, w = gray.shape
+    h_size = int(h * (BASE_WIDTH / float(w)))
+    return np.array(Image.fromarray(gray).resize((BASE_WIDTH, h_size), Image.Resampling.LANCZOS))
+
+
+@stage('denoise')
+def _denoise_stage(gray, image_key, deadline):
+    return cv2.medianBlur(gray, 3)
+
+
+@stage('clahe')
+def _clahe_stage(gray, image_key, deadline):
+    return cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+
+
+@stage('otsu')
+def _otsu_stage(gray, image_key, deadline):
+    _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+
+@stage('adaptive')
+def _adaptive_stage(gray, image_key, deadline):
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+
+# Stages that produce the black-and-white page OCR expects
+BINARIZERS = ('otsu', 'adaptive')
+
+# Named chains; every chain must end in a binarizing stage
+CHAINS = {
+    'default': ('orient', 'resize', 'otsu'),
+    'denoise': ('orient', 'resize', 'denoise', 'otsu'),
+    'clahe': ('orient', 'resize', 'clahe', 'otsu'),
+    'adaptive': ('orient', 'resize', 'clahe', 'adaptive'),
+}
+DEFAULT_CHAIN = CHAINS['default']
+
+
+def resolve_chain(spec):
+    """
+    Stage tuple for a chain name or a comma-separated list of stage names;
+    raises ValueError for anything not registered or not ending in one of
+    BINARIZERS
+    """
+    if not spec:
+        return DEFAULT_CHAIN
+    if spec in CHAINS:
+        return CHAINS[spec]
+    chain = tuple(name.strip() for name in spec.split(',') if name.strip())
+    unknown = [name for name in chain if name not in STAGES]
+    if not chain or unknown:
+        raise ValueError(f"Unknown preprocessing chain or stage: {spec}")
+    if chain[-1] not in BINARIZERS:
+        raise ValueError(f"Preprocessing chain must end in {' or '.join(BINARIZERS)}: {spec}")
+    return chain
+
+
+class StageCache:
+    """LRU of stage outputs keyed by (image key, chain prefix), bounded in bytes"""
+
+    def __init__(self, max_bytes=STAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            array = self._entries.get(key)
+            if array is not None:
+                self._entries.move_to_end(key)
+            return array
+
+    def put(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return
+        # Shared between requests, so nobody may write to it
+        array.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = array
+            self._bytes += array.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+
+stage_cache = StageCache()
+
+
+def run_chain(gray, chain, image_key=None, deadline=None, timings=None):
+    """
+    Run the stages of chain over a grayscale array, starting from the longest
+    prefix already memoized for image_key. Appends {'stage', 'ms', 'cached'}
+    per stage to timings when given.
+    """
+    start = 0
+    if image_key is not None:
+        for end in range(len(chain), 0, -1):
+            cached = stage_cache.get((image_key, chain[:end]))
+            if cached is not None:
+                gray, start = cached, end
+                break
+
+    for index, name in enumerate(chain):
+        if index < start:
+            metrics.incr(f'preprocess_{name}_cached')
+            if timings is not None:
+                timings.append({'stage': name, 'ms': 0.0, 'cached': True})
+            continue
+        began = time.perf_counter()
+        gray = STAGES[name](gray, image_key, deadline)
+        elapsed = time.perf_counter() - began
+        metrics.observe(f'preprocess_{name}', elapsed)
+        if timings is not None:
+            timings.append({'stage': name, 'ms': round(elapsed * 1000, 2), 'cached': False})
+        if image_key is not None:
+            stage_cache.put((image_key, chain[:index + 1]), gray)
+    return gray
+
+
+def binarize(image, image_key=None, deadline=None, allocate=None, chain=DEFAULT_CHAIN, timings=None):
+    """
+    Turn an uploaded image into the binary page array Tesseract reads: EXIF
+    orientation and grayscale, then the stages of chain (by default
+    orientation/skew correction, resize, threshold).
+    allocate(shape, dtype), if given, supplies the output array, so the page
+    can be written straight into a buffer shared with an OCR worker.
+    """
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('L')
+
+    page = run_chain(np.array(image), chain, image_key, deadline, timings)
+    if allocate is None:
+        return page
+    out = allocate(page.shape, page.dtype)
+    np.copyto(out, page)
+    return out
+
+
+def preprocess_image(image, image_key=None, deadline=None, chain=DEFAULT_CHAIN):
+    """binarize() as a PIL image"""
+    return Image.fromarray(binarize(image, image_key, deadline, chain=chain))
@@ -0,0 +1,103 @@
+"""
+Downscaled WebP previews of stored uploads.
+
+The results page only needs a screen-sized image, not the multi-megabyte
+original. After an upload is stored, its previews are rendered on a
+background thread and written to the upload store under
+<sha256>-w<width>.webp, so the store's retention GC covers them too. A
+preview requested before its render has finished is rendered on demand
+(once, however many requests ask for it). Names are derived from content,
+so previews can be cached forever and the name is a strong ETag.
+"""
+import os
+import re
+import logging
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_WIDTHS = (480, 1024)
+PREVIEW_QUALITY = 80
+
+_SOURCE_NAME = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+
+
+class PreviewRenderer:
+    """Renders and stores previews of uploads kept in an UploadStore"""
+
+    def __init__(self, store, widths=PREVIEW_WIDTHS, quality=PREVIEW_QUALITY, workers=1):
+        self.store = store
+        self.widths = tuple(sorted(widths))
+        self.quality = quality
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+    def preview_name(self, name, width):
+        """Store name of the width preview of the stored upload name, or None if name is not one"""
+        match = _SOURCE_NAME.match(name)
+        if not match or width not in self.widths:
+            return None
+        return f"{match.group(1)}-w{width}.webp"
+
+    def _ensure_started(self):
+        """Start the render pool once per process (safe across fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preview')
+            self._pid = os.getpid()
+
+    def schedule(self, name, data):
+        """Render every preview of name in the background"""
+        self._ensure_started()
+        self._executor.submit(self._render_all, name, data)
+
+    def _render_all(self, name, data):
+        for width in self.widths:
+            try:
+                self.get(name, width, data)
+            except Exception as e:
+                logger.warning(f"Could not render {width}px preview of {name}: {str(e)}")
+
+    def get(self, name, width, data=None):
+        """
+        Name of the stored preview, rendering it now if needed; None when the
+        upload is not (or no longer) stored. data, if given, is the upload.
+        """
+        preview = self.preview_name(name, width)
+        if preview is None:
+            return None
+        if self.store.get_pending(preview) is not None or self.store.exists(preview):
+            return preview
+        rendered, _ = self._flights.do(preview, lambda: self._render(name, width, preview, data))
+        return rendered
+
+    def _render(self, name, width, preview, data):
+        if data is None:
+            data = self.store.read(name)
+            if data is None:
+                return None
+        with Image.open(BytesIO(data)) as image:
+            # Let JPEG decode at reduced scale instead of full size
+            image.draft('RGB', (width, width * image.height // max(image.width, 1)))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            if image.width > width:
+                image = image.resize((width, max(1, image.height * width // image.width)),
+                                     Image.Resampling.LANCZOS)
+            out = BytesIO()
+            image.save(out, 'WEBP', quality=self.quality, method=4)
+        self.store.put(out.getvalue(), 'webp', name=preview)
+        return preview
@@ -0,0 +1,190 @@
+"""
+Opt-in profiling of individual production requests.
+
+A request is profiled when it carries the admin token in X-Profile-Token, or
+when it is picked by the sampling rate. Its handling runs under cProfile
+(a .prof file for pstats / snakeviz) or a statistical sampler of the request
+thread (a .collapsed file of "frame;frame;frame count" lines for
+flamegraph.pl or speedscope). Files go to a directory capped at a number of
+files, oldest removed first, so every worker can write to the same place.
+
+When neither a token nor a sampling rate is configured, wrap() returns the
+view unchanged and profiling costs nothing.
+
+Only the request thread is profiled: work handed to OCR worker processes or
+the refine/strip thread pools shows up as time spent waiting for them.
+"""
+import os
+import re
+import sys
+import hmac
+import time
+import random
+import logging
+import cProfile
+import threading
+from functools import wraps
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('pstats', 'collapsed')
+
+# Sampler period; short enough to catch a Tesseract call, long enough to stay cheap
+SAMPLE_INTERVAL = 0.005
+
+# <epoch ms>-<endpoint>-<duration ms>ms-<pid>.<prof|collapsed>
+_PROFILE_NAME = re.compile(r'^(\d+)-([a-z0-9_]+)-(\d+)ms-(\d+)\.(prof|collapsed)$')
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled from a helper thread"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """Decides which requests to profile and keeps the resulting files"""
+
+    def __init__(self, root, token='', sample_rate=0.0, fmt='pstats', max_files=50):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown profile format '{fmt}'; expected one of {', '.join(FORMATS)}")
+        self.root = root
+        self.token = token
+        self.sample_rate = sample_rate
+        self.format = fmt
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.token) or self.sample_rate > 0
+
+    def authorized(self, headers):
+        """Whether the request carries the admin token"""
+        supplied = headers.get('X-Profile-Token', '')
+        return bool(self.token) and bool(supplied) and hmac.compare_digest(supplied, self.token)
+
+    def wanted(self, headers):
+        return self.authorized(headers) or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def wrap(self, endpoint, get_headers):
+        """Decorator profiling a view when wanted(get_headers()); a no-op when disabled"""
+        def decorator(view):
+            if not self.enabled:
+                return view
+
+            @wraps(view)
+            def profiled_view(*args, **kwargs):
+                if not self.wanted(get_headers()):
+                    return view(*args, **kwargs)
+                return self.run(endpoint, view, *args, **kwargs)
+            return profiled_view
+        return decorator
+
+    def run(self, endpoint, fn, *args, **kwargs):
+        """Call fn under the configured profiler and save the profile"""
+        started = time.time()
+        profiler = sampler = None
+        if self.format == 'pstats':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler already owns this thread
+                profiler = None
+        else:
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            try:
+                self._save(endpoint, started, profiler, sampler)
+            except OSError as e:
+                logger.warning(f"Could not save profile for {endpoint}: {str(e)}")
+
+    def _save(self, endpoint, started, profiler, sampler):
+        if profiler is None and sampler is None:
+            return
+        elapsed_ms = int((time.time() - started) * 1000)
+        extension = 'prof' if profiler is not None else 'collapsed'
+        name = f"{int(started * 1000)}-{endpoint}-{elapsed_ms}ms-{os.getpid()}.{extension}"
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, name)
+        tmp_path = f"{path}.tmp"
+        if profiler is not None:
+            profiler.dump_stats(tmp_path)
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(sampler.collapsed())
+        os.replace(tmp_path, path)
+        logger.info(f"Saved profile {name}")
+        self._prune()
+
+    def _prune(self):
+        """Remove the oldest profiles beyond max_files"""
+        with self._lock:
+            names = sorted(self._names())
+            for name in names[:max(0, len(names) - self.max_files)]:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass  # Another worker pruned it first
+
+    def _names(self):
+        try:
+            return [name for name in os.listdir(self.root) if _PROFILE_NAME.match(name)]
+        except FileNotFoundError:
+            return []
+
+    def recent(self, limit=50):
+        """Newest profiles first, with what their names record"""
+        profiles = []
+        for name in sorted(self._names(), reverse=True)[:limit]:
+            started_ms, endpoint, elapsed_ms, pid, extension = _PROFILE_NAME.match(name).groups()
+            profiles.append({
+                'name': name,
+                'endpoint': endpoint,
+                'started': int(started_ms) / 1000,
+                'duration_ms': int(elapsed_ms),
+                'pid': int(pid),
+                'format': 'pstats' if extension == 'prof' else 'collapsed',
+            })
+        return profiles
+
+    def path(self, name):
+        """Path of a stored profile, or None for names the profiler does not own"""
+        if not _PROFILE_NAME.match(name):
+            return None
+        return os.path.join(self.root, name)
@@ -0,0 +1,134 @@
+"""
+Cheap image quality and document check, run before OCR.
+
+Blank frames, shots too blurry to read and photos of things that aren't
+documents otherwise go through every OCR pass before the request fails to
+verify. The gate measures a small grayscale copy of each page in a few
+milliseconds and rejects hopeless pages with a specific reason:
+
+    blank        almost no contrast anywhere
+    too_dark     underexposed beyond what thresholding can recover
+    overexposed  nearly everything is clipped to white
+    blurry       too little fine detail (variance of the Laplacian)
+    no_text      too few edges, or too few text-sized blobs, for a document
+
+Thresholds are deliberately loose: a page that passes may still fail OCR,
+but a page that fails would not have verified anyway.
+"""
+import time
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Longest side of the copy measured; detail finer than this is not judged
+GATE_SIZE = 800
+
+DEFAULT_THRESHOLDS = {
+    # Standard deviation of gray levels below which the page is blank
+    'min_contrast': 8.0,
+    # Mean gray level below which the page is too dark
+    'min_brightness': 30.0,
+    # Share of pixels at or above 250 above which the page is washed out (a
+    # clean scan of a sparse card is already ~97% white)
+    'max_clipped': 0.995,
+    # Variance of the Laplacian below which the page is too blurry
+    'min_sharpness': 15.0,
+    # Share of pixels on Canny edges below which there is nothing to read
+    'min_edge_density': 0.01,
+    # Text-sized connected components needed to look like a document
+    'min_text_components': 20,
+}
+
+REASONS = {
+    'blank': 'The image is blank',
+    'too_dark': 'The image is too dark to read',
+    'overexposed': 'The image is overexposed',
+    'blurry': 'The image is too blurry to read; hold the camera steady and retake it',
+    'no_text': 'The image does not look like a document',
+}
+
+GateResult = namedtuple('GateResult', ['passed', 'reason', 'measures', 'seconds'])
+
+
+def _small_gray(image):
+    """Grayscale copy of a PIL image with its longest side at most GATE_SIZE"""
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGB')
+    # reduce() box-filters on the way down, far cheaper than converting first
+    factor = max(1, max(image.size) // GATE_SIZE)
+    small = image.reduce(factor) if factor > 1 else image
+    gray = np.asarray(small.convert('L'))
+    scale = GATE_SIZE / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def text_components(gray):
+    """Connected components of a locally thresholded page sized and shaped like characters"""
+    height = gray.shape[0]
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    if count <= 1:
+        return 0
+    w = stats[1:, cv2.CC_STAT_WIDTH]
+    h = stats[1:, cv2.CC_STAT_HEIGHT]
+    area = stats[1:, cv2.CC_STAT_AREA]
+    fill = area / np.maximum(w * h, 1)
+    text_like = (
+        (h >= max(4, height * 0.005)) & (h <= height * 0.1) &
+        (w <= h * 4) & (w >= 1) &
+        (fill >= 0.1) & (fill <= 0.95)
+    )
+    return int(np.count_nonzero(text_like))
+
+
+def measure(gray):
+    """Quality measures of a small grayscale page"""
+    mean, std = cv2.meanStdDev(gray)
+    edges = cv2.Canny(gray, 50, 150)
+    return {
+        'brightness': round(float(mean[0][0]), 1),
+        'contrast': round(float(std[0][0]), 1),
+        'clipped': round(float(np.count_nonzero(gray >= 250)) / gray.size, 4),
+        'sharpness': round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 1),
+        'edge_density': round(float(np.count_nonzero(edges)) / gray.size, 4),
+        'text_components': text_components(gray),
+    }
+
+
+class QualityGate:
+    """Measures pages and decides whether they are worth OCRing"""
+
+    def __init__(self, thresholds=None, enabled=True):
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self.enabled = enabled
+
+    def reason(self, measures):
+        """First rejection reason for the measures, or None if the page passes"""
+        t = self.thresholds
+        if measures['brightness'] < t['min_brightness']:
+            return 'too_dark'
+        if measures['contrast'] < t['min_contrast']:
+            return 'blank'
+        if measures['clipped'] > t['max_clipped']:
+            return 'overexposed'
+        if measures['sharpness'] < t['min_sharpness']:
+            return 'blurry'
+        if measures['edge_density'] < t['min_edge_density'] or \
+                measures['text_components'] < t['min_text_components']:
+            return 'no_text'
+        return None
+
+    def check(self, image):
+        """GateResult for a PIL page; always passes when the gate is disabled"""
+        if not self.enabled:
+            return GateResult(True, None, {}, 0.0)
+        began = time.perf_counter()
+        measures = measure(_small_gray(image))
+        reason = self.reason(measures)
+        return GateResult(reason is None, reason, measures, time.perf_counter() - began)
@@ -0,0 +1,66 @@
+"""
+Single-flight execution of duplicate work.
+
+Double-clicks and client retries send the same image several times within
+seconds. The first caller for a key runs the job; callers that arrive while
+it is still running wait for it and share its result (or its exception)
+instead of running the same OCR again.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Registry of in-flight jobs keyed by caller-supplied identity"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run fn() once per key at a time. Returns (result, shared) where
+        shared is True when the result came from another caller's run.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def has_waiters(self, key):
+        """Whether other callers are waiting on the job running for key"""
+        with self._lock:
+            call = self._calls.get(key)
+            return call is not None and call.waiters > 0
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
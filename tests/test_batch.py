@@ -0,0 +1,148 @@
+"""Batch checkpoints (resume, retries, crash recovery) and the submission window."""
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import batch
+from batch import load_checkpoint
+
+
+def write_records(path, *records, tail=''):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records) + tail)
+
+
+def test_missing_output_is_an_empty_checkpoint(tmp_path):
+    assert load_checkpoint(str(tmp_path / 'results.jsonl')) == (set(), set())
+
+
+def test_partial_last_line_is_truncated(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    write_records(output, {'file': 'a.png', 'text': 'A'}, tail='{"file": "b.png", "te')
+    done, _ = load_checkpoint(str(output))
+    assert done == {'a.png'}
+    assert output.read_text() == json.dumps({'file': 'a.png', 'text': 'A'}) + '\n'
+
+
+def test_complete_record_without_newline_is_truncated(tmp_path):
+    # Appending after it would glue the next record onto the same line
+    output = tmp_path / 'results.jsonl'
+    write_records(output, {'file': 'a.png'}, tail=json.dumps({'file': 'b.png'}))
+    done, _ = load_checkpoint(str(output))
+    assert done == {'a.png'}
+    assert output.read_text().count('\n') == 1
+
+
+def test_successes_are_skipped_and_failures_retried(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    write_records(output,
+                  {'file': 'ok.png', 'sha256': 'aa'},
+                  {'file': 'failed.png', 'sha256': 'bb', 'error': 'OSError: boom'},
+                  {'file': 'recovered.png', 'sha256': 'cc', 'error': 'OSError: boom'},
+                  {'file': 'recovered.png', 'sha256': 'cc'})
+    done, exhausted = load_checkpoint(str(output))
+    assert done == {'ok.png', 'recovered.png'}
+    assert exhausted == set()
+
+
+def test_retries_stop_after_max_attempts_with_the_same_content(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    failure = {'file': 'bad.png', 'sha256': 'bb', 'error': 'UnidentifiedImageError: cannot identify'}
+    write_records(output, failure, failure)
+    assert load_checkpoint(str(output), max_attempts=3) == (set(), set())
+    write_records(output, failure, failure, failure)
+    assert load_checkpoint(str(output), max_attempts=3) == (set(), {'bad.png'})
+
+
+def test_changed_content_is_retried_again(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    failure = {'file': 'bad.png', 'sha256': 'bb', 'error': 'OSError: boom'}
+    write_records(output, failure, failure, dict(failure, sha256='cc'))
+    assert load_checkpoint(str(output), max_attempts=2) == (set(), set())
+
+
+@pytest.fixture
+def in_threads(monkeypatch):
+    """
+    Run the pool in threads with a fake process_file; returns the files it
+    was given and a semaphore that lets entries marked 'hold' finish
+    """
+    seen = []
+    release = threading.Semaphore(0)
+
+    def process_file(entry):
+        seen.append(entry['file'])
+        if entry.get('hold'):
+            release.acquire(timeout=5)
+        if entry['file'].startswith('bad'):
+            return {'file': entry['file'], 'sha256': 'bb', 'error': 'OSError: boom'}
+        return {'file': entry['file'], 'sha256': 'aa', 'text': ''}
+
+    monkeypatch.setattr(batch, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(batch, 'init_worker', lambda budget: None)
+    monkeypatch.setattr(batch, 'process_file', process_file)
+    return seen, release
+
+
+def test_run_resumes_from_its_output(in_threads, tmp_path):
+    seen, _ = in_threads
+    output = str(tmp_path / 'results.jsonl')
+    entries = [{'file': name} for name in ('a.png', 'bad.png', 'c.png')]
+
+    assert batch.run(entries, output, workers=2, budget=0, max_attempts=2) == 1
+    assert sorted(seen) == ['a.png', 'bad.png', 'c.png']
+
+    seen.clear()
+    assert batch.run(entries, output, workers=2, budget=0, max_attempts=2) == 1
+    assert seen == ['bad.png']
+
+    # Failed twice with the same content: given up
+    seen.clear()
+    assert batch.run(entries, output, workers=2, budget=0, max_attempts=2) == 0
+    assert seen == []
+    with open(output) as f:
+        assert len(f.readlines()) == 4
+
+
+def test_run_submits_at_most_queue_depth_per_worker(in_threads, tmp_path, monkeypatch):
+    _, release = in_threads
+    monkeypatch.setattr(batch, 'QUEUE_DEPTH', 2)
+    pulled = []
+
+    def entries():
+        for index in range(20):
+            pulled.append(index)
+            yield {'file': f'{index}.png', 'hold': True}
+
+    worker = threading.Thread(target=batch.run, args=(entries(), str(tmp_path / 'results.jsonl'), 2, 0))
+    worker.start()
+    try:
+        # Two workers, two queued each: the fifth entry is not read until one finishes
+        for _ in range(100):
+            if len(pulled) == 4:
+                break
+            time.sleep(0.01)
+        time.sleep(0.1)
+        assert len(pulled) == 4
+    finally:
+        for _ in range(20):
+            release.release()
+        worker.join(5)
+    assert len(pulled) == 20
+
+
+def test_unreadable_image_is_recorded_as_an_error(tmp_path):
+    path = tmp_path / 'scan.png'
+    path.write_bytes(b'not an image')
+    record = batch.process_file({'file': 'scan.png', 'path': str(path)})
+    assert record['error'].startswith('UnidentifiedImageError')
+    assert len(record['sha256']) == 64
+    assert 'text' not in record
+
+
+def test_missing_file_is_recorded_without_a_hash(tmp_path):
+    record = batch.process_file({'file': 'gone.png', 'path': str(tmp_path / 'gone.png')})
+    assert record['error'].startswith('FileNotFoundError')
+    assert 'sha256' not in record
@@ -0,0 +1,111 @@
+"""Deadline: budget expiry, per-call timeouts and killing a running Tesseract process."""
+import sys
+import time
+
+import pytest
+import pytesseract
+
+import deadline
+from deadline import (CLIENT_DISCONNECTED, DEADLINE, MIN_CALL_SECONDS, Deadline, DeadlineExceeded,
+                      call_tesseract)
+
+
+@pytest.fixture(autouse=True)
+def fast_watch(monkeypatch):
+    monkeypatch.setattr(deadline, 'WATCH_INTERVAL', 0.02)
+
+
+def fake_tesseract(started):
+    """A pytesseract-style call that runs a long child process, as Tesseract would"""
+    def run(image, config='', timeout=0):
+        proc = pytesseract.pytesseract.subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(30)'])
+        started.append(proc)
+        if proc.wait() != 0:
+            raise pytesseract.TesseractError(proc.returncode, 'killed')
+        return 'text'
+    return run
+
+
+def test_budget_expires():
+    budget = Deadline(0.05)
+    assert budget.check() is None
+    assert 0 < budget.remaining() <= 0.05
+    time.sleep(0.06)
+    assert budget.remaining() == 0
+    assert budget.check() == DEADLINE
+    with pytest.raises(DeadlineExceeded) as raised:
+        budget.timeout()
+    assert raised.value.reason == DEADLINE
+
+
+def test_timeout_is_a_share_of_what_is_left():
+    budget = Deadline(10)
+    assert 3 < budget.timeout(0.4) <= 4
+
+
+def test_call_too_short_to_be_useful_is_not_started():
+    budget = Deadline(MIN_CALL_SECONDS * 1.5)
+    with pytest.raises(DeadlineExceeded):
+        budget.timeout(0.5)
+    # The request is over: later calls are refused too
+    assert budget.check() == DEADLINE
+
+
+def test_disconnected_client_stops_the_request():
+    assert Deadline(10, is_disconnected=lambda: True).check() == CLIENT_DISCONNECTED
+
+
+def test_without_deadline_the_call_runs_unbounded():
+    calls = []
+    result = call_tesseract(lambda image, config: calls.append(config) or 'text', None, '--psm 6')
+    assert result == 'text'
+    assert calls == ['--psm 6']
+
+
+def test_pytesseract_timeout_becomes_deadline_exceeded():
+    def timed_out(image, config='', timeout=0):
+        raise RuntimeError('Tesseract process timeout')
+
+    budget = Deadline(10)
+    with pytest.raises(DeadlineExceeded) as raised:
+        call_tesseract(timed_out, None, '', budget)
+    assert raised.value.reason == DEADLINE
+    assert budget.reason == DEADLINE
+
+
+def test_disconnect_kills_the_running_process():
+    started = []
+    disconnected_at = time.monotonic() + 0.2
+    budget = Deadline(30, is_disconnected=lambda: time.monotonic() > disconnected_at)
+
+    began = time.monotonic()
+    with budget, pytest.raises(DeadlineExceeded) as raised:
+        call_tesseract(fake_tesseract(started), None, '', budget)
+    assert raised.value.reason == CLIENT_DISCONNECTED
+    assert time.monotonic() - began < 5
+    assert started[0].poll() is not None
+
+
+def test_expiry_kills_the_running_process():
+    started = []
+    budget = Deadline(MIN_CALL_SECONDS + 0.1, is_disconnected=lambda: False)
+
+    with budget, pytest.raises(DeadlineExceeded) as raised:
+        call_tesseract(fake_tesseract(started), None, '', budget)
+    assert raised.value.reason == DEADLINE
+    assert started[0].poll() is not None
+
+
+def test_process_started_after_cancel_is_killed():
+    started = []
+    budget = Deadline(30)
+    budget.cancel(CLIENT_DISCONNECTED)
+    # The check before the call refuses it; a process slipping past is killed on start
+    deadline._active.deadline = budget
+    try:
+        with pytest.raises(pytesseract.TesseractError):
+            fake_tesseract(started)(None)
+    finally:
+        deadline._active.deadline = None
+    assert started[0].poll() is not None
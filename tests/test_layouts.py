@@ -0,0 +1,43 @@
+"""Layout matching against the template of the synthetic test document."""
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from create_test_image import render_test_document
+from layouts import LayoutRegistry, field_crop
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures', 'layouts')
+
+
+def test_no_directory_means_no_templates():
+    registry = LayoutRegistry('')
+    assert registry.templates == []
+    assert registry.match(np.asarray(render_test_document().convert('L'))) is None
+
+
+def test_fixture_matches_the_test_document():
+    registry = LayoutRegistry(FIXTURES)
+    assert [template.name for template in registry.templates] == ['test-document']
+    match = registry.match(np.asarray(render_test_document().convert('L')))
+    assert match is not None
+    assert match.template.name == 'test-document'
+
+
+def test_fixture_matches_an_upside_down_photo():
+    registry = LayoutRegistry(FIXTURES)
+    photo = Image.new('L', (1500, 1100), 160)
+    photo.paste(render_test_document().convert('L').rotate(180), (150, 150))
+    match = registry.match(np.asarray(photo))
+    assert match is not None and match.template.name == 'test-document'
+    # The card's top-left corner lands at the photo's bottom right, and vice versa
+    corners = cv2.perspectiveTransform(np.float32([[[0, 0]], [[1, 1]]]), match.to_page).reshape(2, 2)
+    assert np.abs(corners - [[1350, 950], [150, 150]]).max() < 10
+    crop = field_crop(np.asarray(photo), match, match.template.fields[0])
+    assert crop.shape[0] >= 64
+
+
+def test_blank_page_does_not_match():
+    registry = LayoutRegistry(FIXTURES)
+    assert registry.match(np.full((800, 1200), 255, dtype=np.uint8)) is None
@@ -0,0 +1,77 @@
+"""find_id_match on OCR-style text: look-alikes, edits, the edit bound and spans."""
+import pytest
+
+from matching import find_id_match
+
+
+@pytest.mark.parametrize('id_number, text', [
+    ('ABC123', 'Student abcl23 enrolled'),
+    ('2021-004587', 'ID: 2O21-OO4S87'),
+    ('2021-004587', 'ID: 2021004587'),
+    ('S8-0161', 'no. 5B-O1G1'),
+])
+def test_ocr_confusions_are_free(id_number, text):
+    match = find_id_match(id_number, text)
+    assert match is not None
+    assert match.distance == 0
+
+
+def test_span_points_into_the_original_text():
+    text = 'Name: Jane Doe\nID: 2O21-OO4587 valid'
+    match = find_id_match('2021-004587', text)
+    assert (match.start, match.end) == (text.index('2O21'), text.index(' valid'))
+    assert match.matched == '2O21-OO4587'
+    assert text[match.start:match.end] == match.matched
+
+
+def test_one_substitution_is_charged():
+    match = find_id_match('2021-004587', 'ID 2021-004597 ok')
+    assert match.distance == 1
+    assert match.matched == '2021-004597'
+
+
+def test_transposition_costs_two_edits():
+    assert find_id_match('2021-004587', 'ID 2021-004857') is None
+    match = find_id_match('2021-004587', 'ID 2021-004857', max_distance=2)
+    assert match.distance == 2
+    assert match.matched == '2021-004857'
+
+
+def test_edits_are_bounded_by_a_third_of_the_id():
+    # Six characters allow one edit however generous max_distance is
+    assert find_id_match('ABC123', 'abc183', max_distance=3).distance == 1
+    assert find_id_match('ABC123', 'abx183', max_distance=3) is None
+    # Three characters allow none
+    assert find_id_match('A12', 'a13', max_distance=3) is None
+    assert find_id_match('A12', 'a12').distance == 0
+
+
+def test_max_distance_zero_needs_an_exact_match():
+    assert find_id_match('2021-004587', '2021-004597', max_distance=0) is None
+
+
+def test_a_word_break_is_charged_as_an_edit():
+    match = find_id_match('2021-004587', 'ID 2021 004587')
+    assert match.distance == 1
+    assert match.matched == '2021 004587'
+    assert find_id_match('2021-004587', 'ID 2021 004587', max_distance=0) is None
+
+
+def test_an_inserted_word_does_not_match():
+    assert find_id_match('2021-004587', 'year 2021 x 004587 end') is None
+
+
+def test_spaces_in_the_id_are_free():
+    assert find_id_match('AB 123 456', 'card AB 123 456').distance == 0
+
+
+@pytest.mark.parametrize('id_number, text', [
+    (None, '2021-004587'),
+    ('', '2021-004587'),
+    ('2021-004587', None),
+    ('2021-004587', ''),
+    ('---', '2021-004587'),
+    ('2021-004587', 'nothing to see here'),
+])
+def test_nothing_to_match(id_number, text):
+    assert find_id_match(id_number, text) is None
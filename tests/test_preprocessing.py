@@ -0,0 +1,48 @@
+"""Orientation estimates on the synthetic test document, and chain parsing."""
+import numpy as np
+import pytest
+
+import preprocessing
+from create_test_image import render_test_document
+from preprocessing import CHAINS, estimate_orientation, resolve_chain
+
+
+@pytest.fixture
+def no_osd(monkeypatch):
+    def osd(gray, deadline=None):
+        raise AssertionError('a clean page should not need OSD')
+    monkeypatch.setattr(preprocessing, '_osd_orientation', osd)
+
+
+@pytest.fixture
+def document():
+    return np.asarray(render_test_document().convert('L'))
+
+
+def test_upright_document_resolves_without_osd(no_osd, document):
+    assert estimate_orientation(document) == (0, 0.0, 'profile')
+
+
+@pytest.mark.parametrize('rotate', [90, 180, 270])
+def test_turned_document_resolves_without_osd(no_osd, document, rotate):
+    # Turn the page counter-clockwise; the fix is the same turn clockwise
+    turned = np.ascontiguousarray(np.rot90(document, rotate // 90))
+    orientation = estimate_orientation(turned)
+    assert orientation.rotate == rotate
+    assert orientation.source == 'profile'
+
+
+def test_blank_page_is_upright(no_osd):
+    assert estimate_orientation(np.full((800, 1200), 255, dtype=np.uint8)) == (0, 0.0, 'profile')
+
+
+def test_resolve_chain_names_and_lists():
+    assert resolve_chain(None) == CHAINS['default']
+    assert resolve_chain('clahe') == CHAINS['clahe']
+    assert resolve_chain('orient, resize,adaptive') == ('orient', 'resize', 'adaptive')
+
+
+@pytest.mark.parametrize('spec', ['orient', 'resize,otsu,clahe', 'orient,sharpen,otsu', ','])
+def test_resolve_chain_rejects_bad_chains(spec):
+    with pytest.raises(ValueError):
+        resolve_chain(spec)
@@ -0,0 +1,137 @@
+"""RequestProfiler: which requests are profiled, file naming, listing and pruning."""
+import os
+import re
+import time
+import pstats
+
+import pytest
+
+from profiling import RequestProfiler
+
+NAME = re.compile(r'^(\d{13})-upload-(\d+)ms-(\d+)\.(prof|collapsed)$')
+
+
+def busy(seconds=0.05):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+    return 'response'
+
+
+def touch_profile(root, started_ms, endpoint='upload'):
+    name = f"{started_ms}-{endpoint}-12ms-{os.getpid()}.prof"
+    (root / name).write_bytes(b'')
+    return name
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        RequestProfiler(str(tmp_path), token='t', fmt='json')
+
+
+def test_disabled_profiler_returns_the_view_unchanged(tmp_path):
+    view = lambda: 'response'
+    assert RequestProfiler(str(tmp_path)).wrap('upload', dict)(view) is view
+
+
+def test_only_the_admin_token_is_authorized(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+    assert profiler.authorized({'X-Profile-Token': 'secret'})
+    assert not profiler.authorized({'X-Profile-Token': 'guess'})
+    assert not profiler.authorized({})
+    # No token configured: nothing is authorized, not even an empty header
+    assert not RequestProfiler(str(tmp_path), sample_rate=0.5).authorized({'X-Profile-Token': ''})
+
+
+def test_wrapped_view_is_profiled_only_when_wanted(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+    headers = {}
+    view = profiler.wrap('upload', lambda: headers)(busy)
+
+    assert view() == 'response'
+    assert os.listdir(tmp_path) == []
+
+    headers['X-Profile-Token'] = 'secret'
+    assert view() == 'response'
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_pstats_profile_is_named_and_readable(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+    before_ms = int(time.time() * 1000)
+    assert profiler.run('upload', busy) == 'response'
+
+    [name] = os.listdir(tmp_path)
+    started_ms, duration_ms, pid, extension = NAME.match(name).groups()
+    assert int(started_ms) >= before_ms
+    assert int(duration_ms) >= 50
+    assert int(pid) == os.getpid()
+    assert extension == 'prof'
+    stats = pstats.Stats(str(tmp_path / name))
+    assert any(function == 'busy' for _, _, function in stats.stats)
+
+
+def test_collapsed_profile_holds_sampled_stacks(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret', fmt='collapsed')
+    profiler.run('upload', busy, 0.1)
+
+    [name] = os.listdir(tmp_path)
+    assert NAME.match(name).group(4) == 'collapsed'
+    lines = (tmp_path / name).read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+    assert any('busy (test_profiling.py:' in line for line in lines)
+
+
+def test_failing_request_is_still_saved(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        profiler.run('upload', fail)
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_oldest_profiles_are_pruned(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret', max_files=3)
+    names = [touch_profile(tmp_path, 1700000000000 + step) for step in range(5)]
+    (tmp_path / 'notes.txt').write_text('not a profile')
+
+    profiler._prune()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(names[2:] + ['notes.txt'])
+
+
+def test_saving_prunes_to_max_files(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret', max_files=2)
+    for step in range(3):
+        touch_profile(tmp_path, 1700000000000 + step)
+    profiler.run('upload', busy, 0)
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) == 2
+    # The profile just written is the newest, so it survives
+    assert not names[-1].startswith('1700000000')
+
+
+def test_recent_lists_newest_first(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+    touch_profile(tmp_path, 1700000000000)
+    newest = touch_profile(tmp_path, 1700000005000, endpoint='verify_student')
+
+    [first, second] = profiler.recent()
+    assert first == {'name': newest, 'endpoint': 'verify_student', 'started': 1700000005.0,
+                     'duration_ms': 12, 'pid': os.getpid(), 'format': 'pstats'}
+    assert second['started'] == 1700000000.0
+    assert profiler.recent(limit=1) == [first]
+
+
+def test_path_only_resolves_profile_names(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+    name = touch_profile(tmp_path, 1700000000000)
+    assert profiler.path(name) == os.path.join(str(tmp_path), name)
+    assert profiler.path('../etc/passwd') is None
+    assert profiler.path('notes.txt') is None
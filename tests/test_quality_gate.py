@@ -0,0 +1,80 @@
+"""QualityGate verdicts on the synthetic test document and on degraded copies of it."""
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from create_test_image import render_test_document
+from quality_gate import DEFAULT_THRESHOLDS, GATE_SIZE, REASONS, QualityGate, _small_gray
+
+
+@pytest.fixture(scope='module')
+def document():
+    return render_test_document()
+
+
+def checkerboard():
+    """Sharp, high-contrast and nothing like text"""
+    cells = np.indices((6, 8)).sum(axis=0) % 2 * 200 + 30
+    return Image.fromarray(np.kron(cells, np.ones((100, 100))).astype(np.uint8))
+
+
+def washed_out():
+    """A white page with one short dark bar: contrast, but almost all clipped"""
+    page = np.full((600, 800), 255, np.uint8)
+    page[300:310, 100:292] = 0
+    return Image.fromarray(page)
+
+
+def test_clean_document_passes(document):
+    result = QualityGate().check(document)
+    assert result.passed
+    assert result.reason is None
+    assert set(result.measures) == {'brightness', 'contrast', 'clipped', 'sharpness',
+                                    'edge_density', 'text_components'}
+    assert result.seconds > 0
+
+
+@pytest.mark.parametrize('degrade, reason', [
+    (lambda page: page.filter(ImageFilter.GaussianBlur(8)), 'blurry'),
+    (lambda page: page.convert('L').point(lambda p: p * 0.08), 'too_dark'),
+    (lambda page: Image.new('L', page.size, 255), 'blank'),
+    (lambda page: Image.new('RGB', page.size, (128, 128, 128)), 'blank'),
+    (lambda page: washed_out(), 'overexposed'),
+    (lambda page: checkerboard(), 'no_text'),
+])
+def test_hopeless_pages_are_rejected_with_a_reason(document, degrade, reason):
+    result = QualityGate().check(degrade(document))
+    assert not result.passed
+    assert result.reason == reason
+    assert reason in REASONS
+
+
+def test_blur_is_measured_as_lost_sharpness(document):
+    gate = QualityGate()
+    sharp = gate.check(document).measures['sharpness']
+    blurred = gate.check(document.filter(ImageFilter.GaussianBlur(8))).measures['sharpness']
+    assert sharp > DEFAULT_THRESHOLDS['min_sharpness'] > blurred
+
+
+def test_thresholds_can_be_overridden(document):
+    blurred = document.filter(ImageFilter.GaussianBlur(8))
+    gate = QualityGate({'min_sharpness': 0.0, 'min_edge_density': 0.0, 'min_text_components': 0})
+    assert gate.thresholds['min_brightness'] == DEFAULT_THRESHOLDS['min_brightness']
+    assert gate.check(blurred).passed
+
+
+def test_darkness_is_reported_before_blankness():
+    measures = {'brightness': 5.0, 'contrast': 0.0, 'clipped': 0.0, 'sharpness': 0.0,
+                'edge_density': 0.0, 'text_components': 0}
+    assert QualityGate().reason(measures) == 'too_dark'
+
+
+def test_disabled_gate_passes_everything():
+    result = QualityGate(enabled=False).check(Image.new('L', (100, 100), 0))
+    assert result == (True, None, {}, 0.0)
+
+
+def test_large_pages_are_measured_small(document):
+    gray = _small_gray(document.resize((4800, 3200)))
+    assert max(gray.shape) == GATE_SIZE
+    assert _small_gray(Image.new('P', (100, 50))).shape == (50, 100)
@@ -0,0 +1,97 @@
+"""SingleFlight: duplicate calls share one run, its result and its exception."""
+import time
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+WAITERS = 4
+
+
+def wait_for_waiters(flights, key, count):
+    for _ in range(500):
+        call = flights._calls.get(key)
+        if call is not None and call.waiters == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f'{count} waiters never arrived')
+
+
+def run_concurrently(flights, key, fn):
+    """Start a leader and WAITERS duplicates of fn; returns (threads, outcomes)"""
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(flights.do(key, fn))
+        except Exception as e:
+            outcomes.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    while not flights.in_flight():
+        time.sleep(0.001)
+    threads = [threading.Thread(target=call) for _ in range(WAITERS)]
+    for thread in threads:
+        thread.start()
+    wait_for_waiters(flights, key, WAITERS)
+    return [leader] + threads, outcomes
+
+
+def test_duplicates_share_one_run():
+    flights = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def job():
+        runs.append(1)
+        release.wait(5)
+        return {'text': 'shared'}
+
+    threads, outcomes = run_concurrently(flights, 'k', job)
+    assert flights.has_waiters('k')
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(runs) == 1
+    assert len(outcomes) == WAITERS + 1
+    assert all(result == {'text': 'shared'} for result, _ in outcomes)
+    assert sorted(shared for _, shared in outcomes) == [False] + [True] * WAITERS
+    assert flights.in_flight() == 0
+
+
+def test_error_reaches_every_waiter():
+    flights = SingleFlight()
+    release = threading.Event()
+    error = ValueError('OCR failed')
+
+    def job():
+        release.wait(5)
+        raise error
+
+    threads, outcomes = run_concurrently(flights, 'k', job)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert outcomes == [error] * (WAITERS + 1)
+    assert flights.in_flight() == 0
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    assert flights.do('a', lambda: 1) == (1, False)
+    assert flights.do('b', lambda: 2) == (2, False)
+
+
+def test_key_runs_again_once_finished():
+    flights = SingleFlight()
+    assert flights.do('k', lambda: 'first') == ('first', False)
+    assert flights.do('k', lambda: 'second') == ('second', False)
+
+    with pytest.raises(KeyError):
+        flights.do('k', lambda: {}['missing'])
+    assert flights.do('k', lambda: 'recovered') == ('recovered', False)
+    assert not flights.has_waiters('k')
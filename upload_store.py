@@ -0,0 +1,175 @@
+"""
+Content-addressed storage for uploaded images.
+
+Files are named by the SHA-256 of their bytes, so re-uploads of the same
+image share one file and different images with the same client filename no
+longer overwrite each other. Writes (including fsync) happen on a background
+thread; until a write lands, the bytes are served from memory. A garbage
+collector thread removes stored files past the age limit and then the oldest
+ones until the store is back under the size limit; files that are not named
+by hash are never touched.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Names the store owns (uploads and their -w<width> previews); anything else
+# in the directory is left alone by GC
+_STORED_NAME = re.compile(r'^[0-9a-f]{64}(-w\d+)?(\.[a-z0-9]+)?$')
+
+# mkstemp creates files readable by their owner only; stored files are made
+# readable by a front-end server too, less whatever the umask withholds.
+# umask can only be read by setting it, so do that once, at import
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+_FILE_MODE = 0o644 & ~_UMASK
+
+
+class UploadStore:
+    """Hash-named upload directory with asynchronous writes and retention GC"""
+
+    def __init__(self, root, max_age=7 * 24 * 3600, max_bytes=1024 * 1024 * 1024,
+                 gc_interval=600, writers=2):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.gc_interval = gc_interval
+        self.writers = writers
+
+        self._pending = {}  # name -> bytes not yet on disk
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+        os.makedirs(root, exist_ok=True)
+
+    def _ensure_started(self):
+        """Start the writer pool and GC thread once per process (safe across fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.writers,
+                                                thread_name_prefix='upload-writer')
+            threading.Thread(target=self._gc_loop, name='upload-gc', daemon=True).start()
+            self._pid = os.getpid()
+
+    @staticmethod
+    def name_for(data, extension):
+        """Storage name for a blob: <sha256>.<extension>"""
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest}.{extension.lower()}" if extension else digest
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def put(self, data, extension, name=None):
+        """
+        Store data and return its name without waiting for the disk.
+        An existing copy only has its timestamp refreshed.
+        """
+        self._ensure_started()
+        name = name or self.name_for(data, extension)
+        path = self.path(name)
+
+        with self._lock:
+            if name in self._pending:
+                return name
+            if os.path.exists(path):
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return name
+            self._pending[name] = data
+
+        self._executor.submit(self._write, name, data)
+        return name
+
+    def get_pending(self, name):
+        """Bytes for a name whose write has not finished yet, else None"""
+        with self._lock:
+            return self._pending.get(name)
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def read(self, name):
+        """Bytes stored under name, pending or on disk, or None"""
+        pending = self.get_pending(name)
+        if pending is not None:
+            return pending
+        try:
+            with open(self.path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name, data):
+        path = self.path(name)
+        try:
+            # Write to a temp file and rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(tmp_path, _FILE_MODE)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Failed to store upload {name}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def collect_garbage(self):
+        """Apply the age and total-size limits; returns the number of files removed"""
+        now = time.time()
+        entries = []
+        removed = 0
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if not entry.is_file() or not _STORED_NAME.match(entry.name):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logger.error(f"Upload GC could not scan {self.root}: {str(e)}")
+            return 0
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            too_old = self.max_age and now - mtime > self.max_age
+            too_big = self.max_bytes and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Upload GC could not remove {path}: {str(e)}")
+
+        if removed:
+            logger.info(f"Upload GC removed {removed} files, {total} bytes remain")
+        return removed
+
+    def _gc_loop(self):
+        while True:
+            self.collect_garbage()
+            time.sleep(self.gc_interval)
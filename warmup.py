@@ -0,0 +1,79 @@
+"""
+Per-process warm-up before taking traffic.
+
+A fresh worker pays for cold traineddata, first-time OpenCV and Tesseract
+loading and lazy initialisation on whichever real request arrives first.
+Warmup runs a function that exercises those paths once per process on a
+background thread; a readiness endpoint reports not-ready until it has
+finished, so the router holds traffic back until the worker is warm.
+"""
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Runs fn() once per process in the background and tracks its progress"""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._pid = None
+        self._state = 'pending'
+        self._started = None
+        self._seconds = None
+        self._steps = []
+        self._error = None
+
+    def start(self):
+        """Start warming up this process (once; safe to call from every entry point)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked worker starts over, whatever the parent had done
+            self._pid = os.getpid()
+            self._state = 'running'
+            self._started = time.time()
+            self._seconds = None
+            self._steps = []
+            self._error = None
+        threading.Thread(target=self._run, name='warmup', daemon=True).start()
+
+    def _run(self):
+        began = time.perf_counter()
+        error = None
+        try:
+            self.fn(self._record)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Warm-up failed: {error}", exc_info=True)
+        with self._lock:
+            self._state = 'ready'
+            self._seconds = round(time.perf_counter() - began, 3)
+            self._error = error
+        logger.info(f"Warm-up finished in {self._seconds}s (pid {os.getpid()})")
+
+    def _record(self, name, seconds, error=None):
+        """Passed to fn so it can report each step it ran"""
+        step = {'step': name, 'ms': round(seconds * 1000, 1)}
+        if error:
+            step['error'] = error
+        with self._lock:
+            self._steps.append(step)
+
+    @property
+    def ready(self):
+        return self._pid == os.getpid() and self._state == 'ready'
+
+    def status(self):
+        with self._lock:
+            return {
+                'ready': self._pid == os.getpid() and self._state == 'ready',
+                'state': self._state if self._pid == os.getpid() else 'pending',
+                'seconds': self._seconds,
+                'steps': list(self._steps),
+                'error': self._error,
+            }